@@ -1,24 +1,54 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from config import Config
 from services.plan_service import plan_service
+from services.plan_store import plan_store
 from services.auth_service import auth_service
 from services.research_service import research_service
+from services.job_service import job_service
+from services.forecast_service import forecast_service
+from services.export_service import export_service
 from services.gemini_service import gemini_service
-from prompts import PromptLibrary
-from datetime import datetime, timedelta
+from services.metrics_service import metrics
+from services.idempotency_service import IdempotencyConflict, idempotency_service
+from services.schemas import NEXT_MOVE_SCHEMA
+from prompts import PromptLibrary, PlanPromptSerializer
 import json
+import time
 
 app = Flask(__name__)
 app.config.from_object(Config)
 CORS(app)
 
+# --- INSTRUMENTATION ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    # For streamed responses this is the time until the body starts flowing.
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe(
+        "http_request_duration_seconds", elapsed,
+        route=route, method=request.method, status=response.status_code
+    )
+    phases = metrics.finish_request()
+    if Config.METRICS_SERVER_TIMING:
+        entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in sorted(phases.items())]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ", ".join(entries)
+    return response
+
 # --- MOCK DATA SEEDING ---
 def seed_data():
     """Create a sample plan for the mock user."""
-    if not any(p for p in Config.DATABASE['plans'].values() if p['title'] == "Apartment Deep Clean"):
+    existing_titles = {p['title'] for p in plan_store.list_by_user("mock_user_123")}
+    if "Apartment Deep Clean" not in existing_titles:
         plan_service.create_new_plan(user_id="mock_user_123", user_input="Apartment Deep Clean", mode="free")
-    if not any(p for p in Config.DATABASE['plans'].values() if p['title'] == "Launch a new SaaS product"):
+    if "Launch a new SaaS product" not in existing_titles:
         plan_service.create_new_plan(user_id="mock_user_123", user_input="Launch a new SaaS product", mode="paid")
 
 # --- API DECORATOR ---
@@ -36,8 +66,101 @@ def token_required(f):
     decorated.__name__ = f.__name__
     return decorated
 
+def idempotent(f):
+    """Honours an Idempotency-Key header on routes that create or replan.
+
+    A retry with the same key attaches to the original request while it runs,
+    or gets its stored response back (marked Idempotent-Replayed) afterwards.
+    Reusing a key for a different request is rejected with 422.
+    """
+    def decorated(*args, current_user_payload, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs, current_user_payload=current_user_payload)
+        if len(key) > idempotency_service.MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be at most {idempotency_service.MAX_KEY_LENGTH} characters"}), 400
+
+        def call():
+            response = app.make_response(f(*args, **kwargs, current_user_payload=current_user_payload))
+            headers = {'Location': response.headers['Location']} if 'Location' in response.headers else {}
+            return response.get_json(silent=True), response.status_code, headers
+
+        fingerprint = idempotency_service.fingerprint(request.method, request.path, request.get_data())
+        try:
+            body, status_code, headers, replayed = idempotency_service.run(
+                current_user_payload['user_id'], request.url_rule.rule, key, fingerprint, call
+            )
+        except IdempotencyConflict:
+            return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+
+        response = jsonify(body)
+        response.status_code = status_code
+        response.headers.update(headers)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    decorated.__name__ = f.__name__
+    return decorated
+
+# --- BACKGROUND JOB HELPERS ---
+def wants_background_job(data):
+    """Clients opt into job mode with {"async": true} or a 'Prefer: respond-async' header."""
+    return bool(data.get('async')) or 'respond-async' in request.headers.get('Prefer', '')
+
+def callback_url_error(callback_url):
+    return None if callback_url is None else job_service.callback_url_error(callback_url)
+
+def job_accepted(job):
+    status_url = f"/api/jobs/{job['id']}"
+    body = {"job_id": job['id'], "status": job['status'], "status_url": status_url}
+    return jsonify(body), 202, {'Location': status_url}
+
+# --- STREAMING HELPERS ---
+def sse_event(event, data):
+    """Formats a single Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_text_events(chunks):
+    """Forwards model text chunks as 'chunk' events, ending with 'done' or 'error'."""
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event('chunk', {"text": chunk})
+    except Exception as e:
+        print(f"Error streaming text from Gemini: {e}")
+        yield sse_event('error', {"error": "Failed to generate AI response.", "details": str(e)})
+        return
+    yield sse_event('done', {"text": "".join(parts).strip()})
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def export_response(current_user_payload, plan_id, fmt):
+    user_id = current_user_payload['user_id']
+    plan = plan_store.get(plan_id)
+    if not plan or plan.get('user_id') != user_id:
+        return jsonify({"error": "Plan not found or unauthorized"}), 404
+
+    chunks, mimetype = export_service.export(plan, fmt)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{export_service.filename(plan, fmt)}"'}
+    )
+
 # --- API ROUTES ---
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not Config.METRICS_ALLOW_REMOTE and request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"error": "Not found"}), 404
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/auth/get_token', methods=['GET'])
 def get_token():
     """Mock endpoint to get a token. Can pass ?tier=free for testing."""
@@ -49,40 +172,103 @@ def get_token():
 @token_required
 def get_plans(current_user_payload):
     user_id = current_user_payload['user_id']
-    plans = plan_service.get_user_plans(user_id)
-    return jsonify(plans)
+    args = request.args
+    # Without paging parameters, keep returning the full list for older clients.
+    if not any(key in args for key in ('limit', 'cursor', 'tag', 'view')):
+        plans = plan_service.get_user_plans(user_id)
+        return jsonify(plans)
+
+    try:
+        limit = int(args.get('limit', Config.PLANS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    limit = max(1, min(limit, Config.PLANS_MAX_PAGE_SIZE))
+    view = args.get('view', 'summary')
+    if view not in ('summary', 'full'):
+        return jsonify({"error": "'view' must be 'summary' or 'full'"}), 400
+
+    result, status_code = plan_service.list_user_plans(
+        user_id, limit, cursor=args.get('cursor'), tag=args.get('tag'), view=view
+    )
+    return jsonify(result), status_code
+
+@app.route('/api/plans/summary', methods=['GET'])
+@token_required
+def get_plan_summaries(current_user_payload):
+    user_id = current_user_payload['user_id']
+    ids = request.args.get('ids')
+    plan_ids = [plan_id for plan_id in ids.split(',') if plan_id] if ids else None
+    if plan_ids is not None and len(plan_ids) > Config.PLANS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"At most {Config.PLANS_MAX_PAGE_SIZE} plan ids per request"}), 400
+
+    result, status_code = plan_service.get_plan_summaries(user_id, plan_ids=plan_ids, tag=request.args.get('tag'))
+    return jsonify(result), status_code
 
 @app.route('/api/generate_plan', methods=['POST'])
 @token_required
+@idempotent
 def generate_plan(current_user_payload):
     user_id = current_user_payload['user_id']
     data = request.get_json()
     if not data or 'user_input' not in data or 'mode' not in data:
         return jsonify({"error": "Missing user_input or mode"}), 400
 
-    plan = plan_service.create_new_plan(
-        user_id=user_id,
-        user_input=data.get('user_input'),
-        mode=data.get('mode'),
-        extras=data.get('extras')
-    )
-    if isinstance(plan, dict) and "error" in plan:
-        return jsonify(plan), 500
-    return jsonify(plan), 201
+    callback_error = callback_url_error(data.get('callback_url'))
+    if callback_error:
+        return jsonify({"error": callback_error}), 400
+
+    def run():
+        plan = plan_service.create_new_plan(
+            user_id=user_id,
+            user_input=data.get('user_input'),
+            mode=data.get('mode'),
+            extras=data.get('extras')
+        )
+        if isinstance(plan, dict) and "error" in plan:
+            return plan, 500
+        return plan, 201
+
+    if wants_background_job(data):
+        return job_accepted(job_service.submit(user_id, 'generate_plan', run, data.get('callback_url')))
+    plan, status_code = run()
+    return jsonify(plan), status_code
+
+@app.route('/api/generate_plan/stream', methods=['POST'])
+@token_required
+def generate_plan_stream(current_user_payload):
+    user_id = current_user_payload['user_id']
+    data = request.get_json()
+    if not data or 'user_input' not in data or 'mode' not in data:
+        return jsonify({"error": "Missing user_input or mode"}), 400
+
+    def events():
+        try:
+            for event, payload in plan_service.stream_new_plan(
+                user_id=user_id,
+                user_input=data.get('user_input'),
+                mode=data.get('mode'),
+                extras=data.get('extras')
+            ):
+                yield sse_event(event, payload)
+        except Exception as e:
+            print(f"Error streaming plan from Gemini: {e}")
+            yield sse_event('error', {"error": "Failed to generate or parse AI plan.", "details": str(e)})
+
+    return sse_response(events())
 
 # --- NEW ENDPOINT: NEXT BEST MOVE SUGGESTION ---
 @app.route('/api/plan/next_move', methods=['POST'])
 @token_required
 def get_next_move(current_user_payload):
     plan_data = request.get_json()
-    if not plan_data:
+    if not plan_data or not isinstance(plan_data, dict):
         return jsonify({"error": "Missing plan data in request"}), 400
 
     # We don't strictly need to check ownership here as we are just analyzing the data sent,
     # but it's good practice to ensure the request is authenticated.
-    plan_json_str = json.dumps(plan_data, indent=2)
+    plan_json_str = PlanPromptSerializer.serialize(plan_data, 'next_move')
     prompt = PromptLibrary.get_next_best_move_suggestion(plan_json_str)
-    response = gemini_service.generate_json_response(prompt)
+    response = gemini_service.generate_json_response(prompt, schema=NEXT_MOVE_SCHEMA, prompt_name='next_best_move')
 
     if isinstance(response, dict) and 'error' in response:
         return jsonify(response), 500
@@ -102,6 +288,17 @@ def ask_ai_on_step(current_user_payload):
         return jsonify(result), 500
     return jsonify({"answer": result})
 
+@app.route('/api/ask_ai_on_step/stream', methods=['POST'])
+@token_required
+def ask_ai_on_step_stream(current_user_payload):
+    data = request.get_json()
+    if not data or 'step_description' not in data or 'user_question' not in data:
+        return jsonify({"error": "Missing step_description or user_question"}), 400
+    chunks = plan_service.stream_ai_step_assistance(
+        data['step_description'], data['user_question']
+    )
+    return sse_response(stream_text_events(chunks))
+
 @app.route('/api/decompose_step', methods=['POST'])
 @token_required
 def decompose_step(current_user_payload):
@@ -113,14 +310,30 @@ def decompose_step(current_user_payload):
         return jsonify(result), 500
     return jsonify({"micro_steps": result})
 
+@app.route('/api/plan/<plan_id>/decompose', methods=['POST'])
+@token_required
+@idempotent
+def decompose_plan(current_user_payload, plan_id):
+    user_id = current_user_payload['user_id']
+    data = request.get_json(silent=True) or {}
+    step_ids = data.get('step_ids')
+    if step_ids is not None and not isinstance(step_ids, list):
+        return jsonify({"error": "'step_ids' must be a list"}), 400
+
+    if plan_store.get_owner(plan_id) != user_id:
+        return jsonify({"error": "Plan not found or unauthorized"}), 403
+
+    result, status_code = plan_service.decompose_plan_steps(plan_id, step_ids)
+    return jsonify(result), status_code
+
 @app.route('/api/plan/<plan_id>/step/<step_id>', methods=['PATCH'])
 @token_required
 def toggle_step(current_user_payload, plan_id, step_id):
     user_id = current_user_payload['user_id']
-    plan = Config.DATABASE['plans'].get(plan_id)
+    owner_id = plan_store.get_owner(plan_id)
     
     # Robust authorization check
-    if not plan or plan.get('user_id') != user_id:
+    if owner_id != user_id:
         return jsonify({"error": "Plan not found or unauthorized"}), 403
 
     result, status_code = plan_service.toggle_step_status(plan_id, step_id)
@@ -128,20 +341,42 @@ def toggle_step(current_user_payload, plan_id, step_id):
 
 @app.route('/api/plan/<plan_id>/step/<step_id>/replan', methods=['POST'])
 @token_required
+@idempotent
 def replan_from_step(current_user_payload, plan_id, step_id):
     user_id = current_user_payload['user_id']
     data = request.get_json()
     if not data or 'outcome' not in data:
         return jsonify({"error": "Missing 'outcome' (success/failure) in request"}), 400
 
-    plan = Config.DATABASE['plans'].get(plan_id)
-    if not plan or plan.get('user_id') != user_id:
+    owner_id = plan_store.get_owner(plan_id)
+    if owner_id != user_id:
         return jsonify({"error": "Plan not found or unauthorized"}), 403
 
+    mode = data.get('mode')
+    if mode not in (None, 'differential', 'full'):
+        return jsonify({"error": "'mode' must be 'differential' or 'full'"}), 400
+
+    callback_error = callback_url_error(data.get('callback_url'))
+    if callback_error:
+        return jsonify({"error": callback_error}), 400
+
     reason = data.get('reason')
-    result, status_code = plan_service.get_dynamic_replan(plan_id, step_id, data['outcome'], reason)
+    def run():
+        return plan_service.get_dynamic_replan(plan_id, step_id, data['outcome'], reason, mode=mode)
+
+    if wants_background_job(data):
+        return job_accepted(job_service.submit(user_id, 'replan', run, data.get('callback_url')))
+    result, status_code = run()
     return jsonify(result), status_code
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user_payload, job_id):
+    job = job_service.get_job(job_id)
+    if not job or job.get('user_id') != current_user_payload['user_id']:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route('/api/plan/<plan_id>/simulate_agent', methods=['POST'])
 @token_required
 def simulate_agent(current_user_payload, plan_id):
@@ -150,15 +385,31 @@ def simulate_agent(current_user_payload, plan_id):
     if not data or 'persona' not in data or 'argument' not in data:
         return jsonify({"error": "Missing 'persona' or 'argument' in request"}), 400
 
-    plan = Config.DATABASE['plans'].get(plan_id)
+    plan = plan_store.get(plan_id)
     if not plan or plan.get('user_id') != user_id:
         return jsonify({"error": "Plan not found or unauthorized"}), 403
 
-    plan_json_str = json.dumps(plan, indent=2)
+    plan_json_str = PlanPromptSerializer.serialize(plan, 'agent_simulation')
     prompt = PromptLibrary.agent_simulation(plan_json_str, data['persona'], data['argument'])
-    response = gemini_service.generate_text_response(prompt)
+    response = gemini_service.generate_text_response(prompt, prompt_name='agent_simulation')
     return jsonify({"agent_response": response})
 
+@app.route('/api/plan/<plan_id>/simulate_agent/stream', methods=['POST'])
+@token_required
+def simulate_agent_stream(current_user_payload, plan_id):
+    user_id = current_user_payload['user_id']
+    data = request.get_json()
+    if not data or 'persona' not in data or 'argument' not in data:
+        return jsonify({"error": "Missing 'persona' or 'argument' in request"}), 400
+
+    plan = plan_store.get(plan_id)
+    if not plan or plan.get('user_id') != user_id:
+        return jsonify({"error": "Plan not found or unauthorized"}), 403
+
+    plan_json_str = PlanPromptSerializer.serialize(plan, 'agent_simulation')
+    prompt = PromptLibrary.agent_simulation(plan_json_str, data['persona'], data['argument'])
+    return sse_response(stream_text_events(gemini_service.stream_text_response(prompt, prompt_name='agent_simulation')))
+
 @app.route('/api/discover_idea', methods=['POST'])
 @token_required
 def discover_idea(current_user_payload):
@@ -167,27 +418,33 @@ def discover_idea(current_user_payload):
         return jsonify({"error": "Missing 'niche' in request"}), 400
     
     prompt = PromptLibrary.discover_idea(data['niche'])
-    idea = gemini_service.generate_text_response(prompt)
+    idea = gemini_service.generate_text_response(
+        prompt, cache_scope='discover_idea', similar_to=(data['niche'],)
+    )
     return jsonify({"idea": idea})
 
+@app.route('/api/discover_idea/stream', methods=['POST'])
+@token_required
+def discover_idea_stream(current_user_payload):
+    data = request.get_json()
+    if not data or 'niche' not in data:
+        return jsonify({"error": "Missing 'niche' in request"}), 400
+
+    prompt = PromptLibrary.discover_idea(data['niche'])
+    chunks = gemini_service.stream_text_response(
+        prompt, cache_scope='discover_idea', similar_to=(data['niche'],)
+    )
+    return sse_response(stream_text_events(chunks))
+
 @app.route('/api/plan/<plan_id>/export/pdf', methods=['GET'])
 @token_required
 def export_plan_pdf(current_user_payload, plan_id):
-    user_id = current_user_payload['user_id']
-    plan = Config.DATABASE['plans'].get(plan_id)
-    if not plan or plan.get('user_id') != user_id:
-        return jsonify({"error": "Plan not found or unauthorized"}), 404
+    return export_response(current_user_payload, plan_id, 'pdf')
 
-    html_content = f"<h1>{plan['title']}</h1>"
-    for step in plan['steps']:
-        html_content += f"<h2>Step: {step['title']}</h2>"
-        if step.get('subtasks'):
-            html_content += "<ul>"
-            for subtask in step['subtasks']:
-                html_content += f"<li>{subtask}</li>"
-            html_content += "</ul>"
-            
-    return jsonify({"message": "PDF generation endpoint is conceptual.", "html_preview": html_content})
+@app.route('/api/plan/<plan_id>/export/html', methods=['GET'])
+@token_required
+def export_plan_html(current_user_payload, plan_id):
+    return export_response(current_user_payload, plan_id, 'html')
 
 @app.route('/api/research', methods=['POST'])
 @token_required
@@ -204,39 +461,24 @@ def research(current_user_payload):
         
     return jsonify({"research_summary": result})
 
+@app.route('/api/research/stream', methods=['POST'])
+@token_required
+def research_stream(current_user_payload):
+    data = request.get_json()
+    if not data or 'query' not in data:
+        return jsonify({"error": "Missing 'query' in request"}), 400
+
+    return sse_response(stream_text_events(research_service.stream_research(data['query'])))
+
 @app.route('/api/plan/<plan_id>/forecast', methods=['GET'])
 @token_required
 def get_plan_forecast(current_user_payload, plan_id):
     user_id = current_user_payload['user_id']
-    plan = Config.DATABASE['plans'].get(plan_id)
+    plan = plan_store.get(plan_id)
     if not plan or plan.get('user_id') != user_id:
         return jsonify({"error": "Plan not found or unauthorized"}), 404
 
-    forecast_data = []
-    current_date = datetime.now()
-
-    for step in plan['steps']:
-        estimate_obj = step.get('time_estimate', {'min': 1, 'max': 1, 'unit': 'days'})
-        avg_duration = (estimate_obj.get('min', 1) + estimate_obj.get('max', 1)) / 2
-        
-        if estimate_obj.get('unit') == 'weeks':
-            duration_delta = timedelta(weeks=avg_duration)
-        elif estimate_obj.get('unit') == 'hours':
-            duration_delta = timedelta(hours=avg_duration)
-        else:
-            duration_delta = timedelta(days=avg_duration)
-
-        end_date = current_date + duration_delta
-        
-        forecast_data.append({
-            "step_title": step['title'],
-            "start_date": current_date.isoformat(),
-            "end_date": end_date.isoformat(),
-            "effort": step.get('effort', 'medium'),
-            "is_milestone": step.get('is_milestone', False)
-        })
-        current_date = end_date + timedelta(days=1)
-
+    forecast_data = forecast_service.forecast(plan)
     return jsonify(forecast_data)
 
 # --- APP RUN ---
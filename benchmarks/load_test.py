@@ -0,0 +1,336 @@
+"""Load test for the API against the local fake model backend.
+
+Starts gunicorn with gunicorn_config.py (MODEL_BACKEND=fake, throwaway
+stores in a temp directory), seeds every virtual user with a few plans, then
+drives a weighted mix of requests for a fixed duration and reports
+throughput and p50/p90/p99 latency per operation.
+
+    python benchmarks/load_test.py --duration 30 --users 20 --concurrency 40
+    python benchmarks/load_test.py --output run.json
+    python benchmarks/load_test.py --baseline run.json   # exit 1 on regression
+    python benchmarks/load_test.py --url http://127.0.0.1:10000 --secret-key ...
+
+Only the standard library and PyJWT (already a dependency) are used.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "generate=1,list=5,summary=3,forecast=5,toggle=5,replan=1"
+
+
+class Client:
+    def __init__(self, base_url, token):
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    def request(self, method, path, body=None, timeout=180):
+        """Returns (status, parsed JSON or None, seconds)."""
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, headers=self.headers, method=method)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return 0, None, time.perf_counter() - started
+        elapsed = time.perf_counter() - started
+        try:
+            return status, json.loads(payload), elapsed
+        except ValueError:
+            return status, None, elapsed
+
+
+class VirtualUser:
+    """One simulated user: owns some plans and works through them."""
+
+    def __init__(self, client, rng):
+        self.client = client
+        self.rng = rng
+        self.plans = {}  # plan_id -> list of step ids
+
+    def generate(self):
+        status, plan, elapsed = self.client.request('POST', '/api/generate_plan', {
+            "user_input": f"Goal {self.rng.randint(1, 10 ** 6)}",
+            "mode": self.rng.choice(["free", "paid"]),
+            "extras": {"constraints": {"time_per_day": self.rng.choice([1, 2, 4])}}
+        })
+        if status == 201 and isinstance(plan, dict) and 'id' in plan:
+            self._remember(plan)
+        return status, elapsed
+
+    def list(self):
+        status, _, elapsed = self.client.request('GET', '/api/plans?limit=20')
+        return status, elapsed
+
+    def summary(self):
+        status, _, elapsed = self.client.request('GET', '/api/plans/summary')
+        return status, elapsed
+
+    def forecast(self):
+        plan_id = self._pick_plan()
+        if plan_id is None:
+            return self.generate()
+        status, _, elapsed = self.client.request('GET', f'/api/plan/{plan_id}/forecast')
+        return status, elapsed
+
+    def toggle(self):
+        plan_id = self._pick_plan()
+        if plan_id is None or not self.plans[plan_id]:
+            return self.generate()
+        step_id = self.rng.choice(self.plans[plan_id])
+        status, _, elapsed = self.client.request('PATCH', f'/api/plan/{plan_id}/step/{step_id}')
+        return status, elapsed
+
+    def replan(self):
+        plan_id = self._pick_plan()
+        if plan_id is None or not self.plans[plan_id]:
+            return self.generate()
+        step_id = self.rng.choice(self.plans[plan_id])
+        status, plan, elapsed = self.client.request(
+            'POST', f'/api/plan/{plan_id}/step/{step_id}/replan',
+            {"outcome": self.rng.choice(["success", "failure"])}
+        )
+        if status == 200 and isinstance(plan, dict) and 'id' in plan:
+            self._remember(plan)
+        return status, elapsed
+
+    def _pick_plan(self):
+        return self.rng.choice(list(self.plans)) if self.plans else None
+
+    def _remember(self, plan):
+        self.plans[plan['id']] = [
+            str(step['id']) for step in plan.get('steps') or [] if isinstance(step, dict) and 'id' in step
+        ]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if not hasattr(VirtualUser, name.strip()):
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile.
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir, secret_key):
+    port = args.port or free_port()
+    env = dict(
+        os.environ,
+        MODEL_BACKEND='fake',
+        SECRET_KEY=secret_key,
+        FAKE_MODEL_SEED=str(args.seed),
+        FAKE_MODEL_LATENCY_MS=str(args.latency_ms),
+        FAKE_MODEL_LATENCY_SIGMA=str(args.latency_sigma),
+        FAKE_MODEL_TOKEN_DELAY_MS=str(args.token_delay_ms),
+        FAKE_MODEL_MALFORMED_RATE=str(args.malformed_rate),
+        PLAN_STORE_PATH=os.path.join(workdir, 'plans.sqlite3'),
+        JOB_STORE_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        RESPONSE_CACHE_PATH=os.path.join(workdir, 'responses.sqlite3'),
+        EXPORT_CACHE_DIR=os.path.join(workdir, 'exports'),
+        METRICS_DIR=os.path.join(workdir, 'metrics'),
+    )
+    for name, value in (('SERVER_WORKERS', args.workers), ('SERVER_WORKER_CLASS', args.worker_class),
+                        ('SERVER_THREADS', args.threads)):
+        if value is not None:
+            env[name] = str(value)
+
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.close()
+            with open(log.name) as output:
+                raise SystemExit("gunicorn exited early:\n" + output.read()[-4000:])
+        try:
+            with urllib.request.urlopen(base_url + '/api/auth/get_token', timeout=2):
+                return process, base_url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("gunicorn did not start within 30s")
+
+
+def run(args):
+    secret_key = args.secret_key or f"load-test-{random.random()}"
+    workdir = tempfile.mkdtemp(prefix='schematiq-load-')
+    process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            process, base_url = start_server(args, workdir, secret_key)
+
+        rng = random.Random(args.seed)
+        users = [
+            VirtualUser(
+                Client(base_url, jwt.encode({"user_id": f"load_user_{index}", "tier": "paid"},
+                                            secret_key, algorithm="HS256")),
+                random.Random(rng.random())
+            )
+            for index in range(args.users)
+        ]
+
+        print(f"Seeding {args.seed_plans} plan(s) for each of {args.users} user(s)...")
+        for user in users:
+            for _ in range(args.seed_plans):
+                user.generate()
+
+        mix = parse_mix(args.mix)
+        operations, weights = list(mix), list(mix.values())
+        samples, lock = [], threading.Lock()
+        # Each virtual user is driven by one thread at a time.
+        user_locks = [threading.Lock() for _ in users]
+        deadline = time.perf_counter() + args.duration
+
+        def worker(worker_index):
+            worker_rng = random.Random(f"{args.seed}:{worker_index}")
+            while time.perf_counter() < deadline:
+                index = worker_rng.randrange(len(users))
+                with user_locks[index]:
+                    operation = worker_rng.choices(operations, weights)[0]
+                    status, elapsed = getattr(users[index], operation)()
+                with lock:
+                    samples.append((operation, status, elapsed))
+
+        print(f"Running {args.concurrency} client thread(s) for {args.duration}s against {base_url}...")
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        return summarize(samples, wall)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.keep_workdir:
+            print(f"Server files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(samples, wall):
+    report = {"duration_seconds": round(wall, 2), "operations": {}}
+    groups = {}
+    for operation, status, elapsed in samples:
+        groups.setdefault(operation, []).append((status, elapsed))
+    groups["all"] = [(status, elapsed) for _, status, elapsed in samples]
+    for operation, results in groups.items():
+        latencies = sorted(elapsed for _, elapsed in results)
+        report["operations"][operation] = {
+            "requests": len(results),
+            "errors": sum(1 for status, _ in results if status == 0 or status >= 500),
+            "throughput_rps": round(len(results) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{'operation':<10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for operation, stats in sorted(report["operations"].items(), key=lambda item: item[0] == "all"):
+        print(f"{operation:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>9} {stats['p90_ms']:>9} {stats['p99_ms']:>9}")
+
+
+def compare(report, baseline, tolerance):
+    """Returns descriptions of operations that regressed beyond `tolerance` (a fraction)."""
+    regressions = []
+    for operation, stats in report["operations"].items():
+        before = baseline.get("operations", {}).get(operation)
+        if not before:
+            continue
+        if before["p99_ms"] and stats["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{operation}: p99 {before['p99_ms']}ms -> {stats['p99_ms']}ms")
+        if before["throughput_rps"] and stats["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{operation}: throughput {before['throughput_rps']} -> {stats['throughput_rps']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--duration', type=float, default=30, help="seconds of measured load")
+    parser.add_argument('--users', type=int, default=20, help="virtual users (distinct JWTs)")
+    parser.add_argument('--concurrency', type=int, default=40, help="client threads")
+    parser.add_argument('--seed-plans', type=int, default=3, help="plans generated per user before measuring")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="weighted operations, e.g. 'list=5,toggle=3'")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=800, help="fake model median latency")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="fake model lognormal sigma")
+    parser.add_argument('--token-delay-ms', type=float, default=5, help="fake model delay per streamed token")
+    parser.add_argument('--malformed-rate', type=float, default=0.02, help="share of malformed JSON responses")
+    parser.add_argument('--workers', type=int, help="override SERVER_WORKERS")
+    parser.add_argument('--worker-class', help="override SERVER_WORKER_CLASS")
+    parser.add_argument('--threads', type=int, help="override SERVER_THREADS")
+    parser.add_argument('--port', type=int, help="port for the spawned server (default: any free port)")
+    parser.add_argument('--url', help="benchmark an already running server instead of starting one")
+    parser.add_argument('--secret-key', help="SECRET_KEY of the server given by --url")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report to compare against; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed regression vs. baseline")
+    parser.add_argument('--keep-workdir', action='store_true', help="keep the server's stores and log")
+    args = parser.parse_args()
+    if args.url and not args.secret_key:
+        parser.error("--url needs --secret-key to mint tokens for the virtual users")
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
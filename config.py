@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,10 +8,148 @@ class Config:
     """Application configuration."""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'a-very-secret-key')
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    # 'gemini' calls the real API; 'fake' serves deterministic local responses
+    # (no API key needed) for development and benchmarks/load_test.py.
+    MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')
+    FAKE_MODEL_SEED = int(os.environ.get('FAKE_MODEL_SEED', 0))
+    FAKE_MODEL_LATENCY_MS = float(os.environ.get('FAKE_MODEL_LATENCY_MS', 800))
+    FAKE_MODEL_LATENCY_SIGMA = float(os.environ.get('FAKE_MODEL_LATENCY_SIGMA', 0.5))
+    FAKE_MODEL_TOKEN_DELAY_MS = float(os.environ.get('FAKE_MODEL_TOKEN_DELAY_MS', 5))
+    FAKE_MODEL_MALFORMED_RATE = float(os.environ.get('FAKE_MODEL_MALFORMED_RATE', 0.0))
+    GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-pro-latest')
+
+    # Upstream context caching for the static plan-generation/replan preambles.
+    # Cached content uses GEMINI_MODEL and needs a pinned version of it (e.g.
+    # gemini-1.5-pro-002) and a preamble of at least CONTEXT_CACHE_MIN_TOKENS;
+    # otherwise the preamble is sent as a system instruction instead.
+    CONTEXT_CACHE_ENABLED = os.environ.get('CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+    CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get('CONTEXT_CACHE_MIN_TOKENS', 32768))
+    CONTEXT_CACHE_TTL = int(os.environ.get('CONTEXT_CACHE_TTL', 3600))
+    CONTEXT_CACHE_REFRESH_MARGIN = int(os.environ.get('CONTEXT_CACHE_REFRESH_MARGIN', 300))
+
+    # Cache of verified (and recently rejected) tokens used by token_required.
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+    TOKEN_NEGATIVE_CACHE_TTL = int(os.environ.get('TOKEN_NEGATIVE_CACHE_TTL', 60))
+
+    # Response cache for model calls. Only the scopes listed here are cached;
+    # the 'sqlite' backend shares entries between gunicorn workers.
+    RESPONSE_CACHE_SCOPES = [s.strip() for s in os.environ.get(
+        'RESPONSE_CACHE_SCOPES', 'decompose_step,discover_idea,ask_ai_on_step'
+    ).split(',') if s.strip()]
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+
+    # Near-duplicate cache: a request whose inputs are at least as similar as
+    # the scope's threshold (Jaccard over word and character n-grams, found via
+    # MinHash LSH) to an earlier one reuses its answer. Kept per process.
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLDS = os.environ.get(
+        'SEMANTIC_CACHE_THRESHOLDS', 'discover_idea=0.8,decompose_step=0.85,ask_ai_on_step=0.9'
+    )
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 2048))
+    SEMANTIC_CACHE_TTL = int(os.environ.get('SEMANTIC_CACHE_TTL', 86400))
+    SEMANTIC_CACHE_NUM_PERM = int(os.environ.get('SEMANTIC_CACHE_NUM_PERM', 64))
+    SEMANTIC_CACHE_BANDS = int(os.environ.get('SEMANTIC_CACHE_BANDS', 16))
+
+    # Concurrent model calls with an identical prompt hash share one upstream request.
+    SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+
+    # Serving model (see gunicorn_config.py): 'sync', 'gthread' or 'gevent'.
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 3))
+    SERVER_WORKER_CLASS = os.environ.get('SERVER_WORKER_CLASS', 'gthread')
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+    SERVER_WORKER_CONNECTIONS = int(os.environ.get('SERVER_WORKER_CONNECTIONS', 500))
+    # Import the app once in the master so workers fork with it already loaded.
+    SERVER_PRELOAD_APP = os.environ.get('SERVER_PRELOAD_APP', 'false').lower() == 'true'
+    # Configure the Gemini SDK and build the standard model as each worker starts.
+    MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'true').lower() == 'true'
+
+    # Upstream model call execution: concurrency limit per process, deadlines,
+    # retry/backoff for retryable errors and the circuit breaker.
+    MODEL_MAX_CONCURRENCY = int(os.environ.get('MODEL_MAX_CONCURRENCY', 16))
+    MODEL_QUEUE_TIMEOUT = float(os.environ.get('MODEL_QUEUE_TIMEOUT', 10))
+    MODEL_CALL_TIMEOUT = float(os.environ.get('MODEL_CALL_TIMEOUT', 60))
+    MODEL_TOTAL_DEADLINE = float(os.environ.get('MODEL_TOTAL_DEADLINE', 120))
+    MODEL_MAX_RETRIES = int(os.environ.get('MODEL_MAX_RETRIES', 2))
+    MODEL_BACKOFF_BASE = float(os.environ.get('MODEL_BACKOFF_BASE', 0.5))
+    MODEL_BACKOFF_MAX = float(os.environ.get('MODEL_BACKOFF_MAX', 8))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+
+    # Whole-plan step decomposition: steps per batched prompt and parallel batches.
+    DECOMPOSE_BATCH_SIZE = int(os.environ.get('DECOMPOSE_BATCH_SIZE', 6))
+    DECOMPOSE_MAX_PARALLEL = int(os.environ.get('DECOMPOSE_MAX_PARALLEL', 4))
+
+    # Schema-constrained JSON generation; unparseable or invalid responses are
+    # repaired locally first and only regenerated up to JSON_MAX_RETRIES times.
+    STRUCTURED_OUTPUT_ENABLED = os.environ.get('STRUCTURED_OUTPUT_ENABLED', 'true').lower() == 'true'
+    JSON_MAX_RETRIES = int(os.environ.get('JSON_MAX_RETRIES', 1))
+
+    # Replanning: 'differential' regenerates only the affected tail slice (the next
+    # REPLAN_WINDOW incomplete steps plus same-category ones); 'full' regenerates
+    # every incomplete step.
+    REPLAN_MODE = os.environ.get('REPLAN_MODE', 'differential')
+    REPLAN_WINDOW = int(os.environ.get('REPLAN_WINDOW', 3))
+
+    # Approximate token budget for a plan embedded in a prompt (0 disables trimming).
+    PROMPT_PLAN_TOKEN_BUDGET = int(os.environ.get('PROMPT_PLAN_TOKEN_BUDGET', 2000))
+
+    # Plan forecasts: schedules cached per plan version, and the idle gap between
+    # consecutive step groups.
+    FORECAST_CACHE_SIZE = int(os.environ.get('FORECAST_CACHE_SIZE', 1024))
+    FORECAST_STEP_GAP_HOURS = float(os.environ.get('FORECAST_STEP_GAP_HOURS', 24))
+
+    # Metrics: each worker snapshots its counters into METRICS_DIR every
+    # METRICS_FLUSH_INTERVAL seconds and /metrics merges them. /metrics only answers
+    # local requests unless METRICS_ALLOW_REMOTE; METRICS_SERVER_TIMING adds a
+    # per-request Server-Timing header.
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'schematiq-metrics'))
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+    METRICS_ALLOW_REMOTE = os.environ.get('METRICS_ALLOW_REMOTE', 'false').lower() == 'true'
+    METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'false').lower() == 'true'
+
+    # Plan exports: rendered HTML/PDF artifacts are cached in EXPORT_CACHE_DIR per
+    # plan version (empty disables the cache) and streamed in EXPORT_CHUNK_SIZE chunks.
+    EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', 'exports')
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 16384))
+
+    # Plan storage. 'sqlite' is shared by all gunicorn workers and survives restarts;
+    # 'memory' keeps plans in the per-process DATABASE dict below.
+    PLAN_STORE_BACKEND = os.environ.get('PLAN_STORE_BACKEND', 'sqlite')
+    PLAN_STORE_PATH = os.environ.get('PLAN_STORE_PATH', 'plans.sqlite3')
+    PLANS_PAGE_SIZE = int(os.environ.get('PLANS_PAGE_SIZE', 20))
+    PLANS_MAX_PAGE_SIZE = int(os.environ.get('PLANS_MAX_PAGE_SIZE', 100))
+
+    # Background jobs for plan generation and replanning. Job records follow the
+    # plan store backend by default so any worker can answer a status poll.
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', PLAN_STORE_BACKEND)
+    JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', 'jobs.sqlite3')
+    JOB_CALLBACK_TIMEOUT = float(os.environ.get('JOB_CALLBACK_TIMEOUT', 10))
+    JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 86400))
+    # Jobs still queued/running this many seconds after their last update are
+    # reported as failed (the worker that owned them is gone).
+    JOB_DEADLINE = int(os.environ.get('JOB_DEADLINE', 600))
+    # Callback URLs must resolve to public addresses. When JOB_CALLBACK_ALLOWED_HOSTS
+    # is set, only those hosts are accepted.
+    JOB_CALLBACK_ALLOWED_HOSTS = [h.strip().lower() for h in os.environ.get(
+        'JOB_CALLBACK_ALLOWED_HOSTS', ''
+    ).split(',') if h.strip()]
+
+    # Idempotency-Key support for plan creation/replanning: responses are kept for
+    # IDEMPOTENCY_TTL seconds (at most IDEMPOTENCY_MAX_ENTRIES in memory), shared
+    # between workers when the backend is 'sqlite'.
+    IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', PLAN_STORE_BACKEND)
+    IDEMPOTENCY_PATH = os.environ.get('IDEMPOTENCY_PATH', 'idempotency.sqlite3')
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+    IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
 
     # In a real app, this would point to a database URI
     # For now, we'll use an in-memory dictionary as a mock DB
     DATABASE = {
         "users": {},
         "plans": {}
-    }
\ No newline at end of file
+    }
@@ -1,3 +1,37 @@
 # gunicorn_config.py
+import glob
+import os
+from config import Config
+
 bind = "0.0.0.0:10000"
-workers = 3
\ No newline at end of file
+workers = Config.SERVER_WORKERS
+
+# 'sync' serves one request per worker. 'gthread' serves SERVER_THREADS requests
+# per worker, and 'gevent' multiplexes up to SERVER_WORKER_CONNECTIONS requests per
+# worker on greenlets, which suits routes that mostly wait on Gemini.
+worker_class = Config.SERVER_WORKER_CLASS
+threads = Config.SERVER_THREADS
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+
+# The Gemini SDK is set up lazily per process, so preloading shares only plain
+# Python state with the workers.
+preload_app = Config.SERVER_PRELOAD_APP
+
+# Model calls can legitimately run for the whole upstream deadline.
+timeout = int(Config.MODEL_TOTAL_DEADLINE) + 30
+
+def on_starting(server):
+    # Metric snapshots from a previous run would otherwise be merged into this one.
+    for pattern in ("metrics-*.json", ".metrics-*.tmp"):
+        for path in glob.glob(os.path.join(Config.METRICS_DIR, pattern)):
+            os.remove(path)
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        # gRPC (used by the Gemini SDK) must cooperate with gevent's event loop.
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+    if Config.MODEL_WARMUP:
+        from services.gemini_service import gemini_service
+        gemini_service.warmup()
@@ -1,94 +1,333 @@
+import hashlib
+import json
+import re
+from config import Config
+from services.metrics_service import metrics
+
+
+def _compact(text):
+    """Normalizes a prompt fragment: strips indentation and trailing whitespace and
+    collapses runs of blank lines, so the same template always yields the same bytes."""
+    lines = [line.strip() for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+def _example_json(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def _timed_builder(fn):
+    """Records each call's build time under the builder's name."""
+    return metrics.timed("prompt_build_duration_seconds", builder=fn.__name__)(fn)
+
+
+def _timed_serializer(fn):
+    return metrics.timed("plan_serialize_duration_seconds", method=fn.__name__)(fn)
+
+
+class PromptTemplate:
+    """A prompt split into a static prefix, normalized once at import, and a small
+    per-call suffix.
+
+    The prefix is byte-identical across calls, which keeps it eligible for upstream
+    context caching; prefix_hash identifies it for caches and metrics.
+    """
+
+    def __init__(self, name, prefix):
+        self.name = name
+        self.prefix = _compact(prefix)
+        self.prefix_hash = hashlib.sha256(self.prefix.encode('utf-8')).hexdigest()[:16]
+
+    def render(self, *suffix_lines):
+        return self.prefix + "\n\n" + "\n".join(line for line in suffix_lines if line)
+
+
+_MICRO_STEP_FIELDS = """
+Each micro-step object must have these three keys:
+- "title": The short, actionable name of the micro-step.
+- "explanation": A one-sentence clarification of why this micro-step is important or what it entails.
+- "example": A brief, concrete example of the micro-step in action.
+"""
+
+_MICRO_STEP_EXAMPLES = [
+    {
+        "title": "Identify 3-5 Key Competitors",
+        "explanation": "Find the primary players in your market to establish a baseline for comparison.",
+        "example": "e.g., For a new coffee shop, competitors might be Starbucks, a local cafe, and a new artisanal roaster."
+    },
+    {
+        "title": "Analyze Their Website & UX",
+        "explanation": "Evaluate their online presence and user journey to find their strengths and weaknesses.",
+        "example": "e.g., Note down their website's loading speed, ease of navigation, and checkout process."
+    },
+    {
+        "title": "Review Their Pricing & Offers",
+        "explanation": "Understand their monetization strategy to position your own product effectively.",
+        "example": "e.g., Document their subscription tiers: Basic ($10/mo), Pro ($25/mo), Enterprise (custom)."
+    }
+]
+
+DECOMPOSE_STEP = PromptTemplate("decompose_step", f"""
+You are SchematIQ, an AI expert at breaking down complex tasks into simple, actionable micro-steps.
+Your task is to generate a list of granular micro-steps required to complete the parent step given at the end.
+For each micro-step, you MUST provide a title, a short explanation, and a concrete example.
+
+Output ONLY a valid JSON array of objects. Do not include any other text, explanations, or markdown.
+{_MICRO_STEP_FIELDS}
+Example output for a parent step "Conduct Competitor Analysis":
+{_example_json(_MICRO_STEP_EXAMPLES)}
+""")
+
+DECOMPOSE_STEPS_BATCH = PromptTemplate("decompose_steps_batch", f"""
+You are SchematIQ, an AI expert at breaking down complex tasks into simple, actionable micro-steps.
+For EACH plan step given at the end, generate a list of granular micro-steps required to complete it.
+For each micro-step, you MUST provide a title, a short explanation, and a concrete example.
+
+Output ONLY a valid JSON object. Do not include any other text, explanations, or markdown.
+Each key of the object MUST be the "id" of one of the given steps, and its value MUST be a JSON array of micro-step objects.
+{_MICRO_STEP_FIELDS}
+Example output for steps [{{"id":"s1","title":"Conduct Competitor Analysis"}}]:
+{_example_json({"s1": _MICRO_STEP_EXAMPLES[:1]})}
+""")
+
+NEXT_BEST_MOVE = PromptTemplate("next_best_move", f"""
+You are SchematIQ, an AI project strategist acting as a momentum coach.
+Your goal is to provide a single, short, encouraging, and actionable suggestion to a user based on their current plan progress, given at the end.
+
+INSTRUCTIONS:
+1. Analyze the plan and identify the VERY NEXT incomplete step (the step immediately following the last completed one, or the first step if none are complete).
+2. Based on the title and category of that next step, generate a single, insightful "Next Best Move".
+3. The suggestion should be varied. It could be:
+- An encouraging nudge: "Looks like 'Content Creation' is next. Ready to start scripting?"
+- A specific tip: "For 'Niche Research', try using Google Trends to validate your ideas first."
+- A question to provoke thought: "You're about to start 'Channel Setup'. Have you thought about your channel banner art yet?"
+- A tool recommendation if applicable: "When you get to editing, a tool like CapCut can make things much faster."
+4. Keep the suggestion to one or two sentences. It should be concise and motivational.
+
+Output ONLY a single JSON object with one key, "suggestion".
+
+Example Output:
+{_example_json({"suggestion": "Most users find 'Niche Research' to be the most critical step. Want help brainstorming some video ideas for your chosen niche?"})}
+""")
+
+DISCOVER_IDEA = PromptTemplate("discover_idea", """
+You are SchematIQ, an AI business and project idea generator.
+Your task is to generate a single, compelling, and actionable project or business idea for the niche given at the end.
+The idea should be described in one concise sentence. Output only the single sentence idea.
+
+Example for niche "sustainable tech":
+"An app that uses computer vision to identify recyclable vs. non-recyclable items from a phone's camera."
+""")
+
+_PLAN_SUMMARY_INSTRUCTIONS = """
+The root of the JSON response MUST be a single object. At the top level of this object, include:
+- "estimated_duration": A concise string representing the total estimated time for the plan (e.g., "2-3 Weeks", "3 Months", "1 Year").
+- "budget_level": A single-word summary of the likely budget required: "Low", "Medium", "High", or "Variable".
+- "tags": A JSON array of 2-4 relevant string tags for the plan. Choose from: "Business", "Tech", "Creative", "Marketing", "Health", "Lifestyle", "Productivity", "Finance".
+- "steps": A JSON array of step objects. THIS MUST BE AN ARRAY, NOT AN OBJECT.
+"""
+
+_POWER_MODE_INSTRUCTIONS = """
+Use these detailed instructions for Strategist Mode:
+- Each step should be highly detailed.
+- Include a 'power_tools' key with a list of specific software or physical tools.
+- Add a 'potential_pitfall' key with a brief warning for each step.
+- The categories should be professional (e.g., 'Market Research', 'Logistics', 'Execution').
+
+IMPORTANT: When suggesting tools in the `power_tools` section, you MUST provide them as a JSON object with the fields "name", "description", "link", and "cost".
+- "name": The official name of the tool (e.g., "Figma", "Notion", "Google Analytics").
+- "description": A brief, one-sentence summary of what the tool does.
+- "link": The homepage URL for the tool.
+- "cost": A brief summary of the pricing (e.g., "Free", "Freemium", "Paid", "$20/month").
+"""
+
+_BASE_MODE_INSTRUCTIONS = """
+Use these instructions for Everyday Mode:
+- Steps must be actionable and clear.
+- Subtasks should be small, concrete actions.
+- Categories should be simple (e.g., 'Planning', 'Action', 'Review').
+"""
+
+_PLAN_EXAMPLE = {
+    "id": "unique_plan_id_1",
+    "title": "Launch a new SaaS product",
+    "mode": "paid",
+    "estimated_duration": "3-4 Months",
+    "budget_level": "Medium",
+    "tags": ["Business", "Tech", "SaaS"],
+    "steps": [
+        {
+            "id": "unique_step_id_1",
+            "title": "Market Research",
+            "subtasks": ["Define target audience", "Analyze 5 competitors"],
+            "time_estimate": {"min": 1, "max": 2, "unit": "weeks"},
+            "effort": "high",
+            "is_milestone": True,
+            "category": "Research",
+            "is_complete": False,
+            "parallel_with_previous": False,
+            "power_tools": [],
+            "potential_pitfall": "Inadequate research leading to a product no one needs."
+        }
+    ]
+}
+
+def _base_plan_template(name, mode_label, mode_instructions):
+    return PromptTemplate(name, f"""
+You are SchematIQ, an AI-powered planning assistant. Generate a complete plan object for the user's request given at the end.
+
+{_PLAN_SUMMARY_INSTRUCTIONS}
+The user has selected: **{mode_label}**.
+{mode_instructions}
+CRITICAL FORMATTING RULES FOR STEPS:
+1. For each step, provide a realistic time estimate as a JSON object with "min", "max", and "unit" fields.
+2. For each step, provide an "effort" level as a string: "low", "medium", "high".
+3. For each step, decide if it is a major project milestone and set "is_milestone" to true or false.
+4. Set "parallel_with_previous" to true when a step can be worked on at the same time as the step before it (it does not depend on it); otherwise false.
+
+The final output MUST be a valid JSON object. Do not include any other text.
+
+Example JSON format:
+{_example_json(_PLAN_EXAMPLE)}
+""")
+
+BASE_PLAN_STRATEGIST = _base_plan_template("base_plan_strategist", "Strategist Mode", _POWER_MODE_INSTRUCTIONS)
+BASE_PLAN_EVERYDAY = _base_plan_template("base_plan_everyday", "Everyday Mode", _BASE_MODE_INSTRUCTIONS)
+
+REPLAN = PromptTemplate("replan", """
+You are SchematIQ, an expert AI strategist capable of dynamic replanning. A user is executing a plan and has just completed a step with a specific outcome; the plan, the step and the outcome are given at the end.
+Your task is to analyze the original plan in light of this new information and generate a revised list of *only the remaining, incomplete steps*.
+INSTRUCTIONS:
+1. **Analyze the Impact:** Consider how the success or failure of the completed step affects the subsequent steps.
+2. **Adapt, Don't Replace:** Do not change the fundamental goal. Modify, re-order, add, or remove *future* steps to better align with the new reality.
+3. **Preserve IDs:** For any step that you keep from the original plan, you MUST retain its original "id".
+4. **Generate New IDs:** For any completely new steps you add, generate a new unique ID (e.g., "generated_step_xyz").
+5. **Maintain Format:** The output must be a valid JSON array of step objects, following the exact same format as the original plan's steps.
+6. **Output Only Remaining Steps:** The JSON you return should ONLY contain the steps that are yet to be completed.
+""")
+
+REPLAN_SLICE = PromptTemplate("replan_slice", """
+You are SchematIQ, an expert AI strategist capable of dynamic replanning. A user is executing a plan and has just completed a step with a specific outcome.
+You are given, at the end: an outline of the rest of the plan (which stays unchanged), the step just completed with its outcome, and the slice of upcoming steps that may be affected by it.
+Your task is to generate a revised version of *only that slice*. It will be spliced back into the plan in place of the original slice.
+INSTRUCTIONS:
+1. **Analyze the Impact:** Consider how the success or failure of the completed step affects the steps in the slice.
+2. **Adapt, Don't Replace:** Do not change the fundamental goal. Modify, re-order, add, or remove steps *within the slice*; do not repeat or rewrite steps from the outline.
+3. **Preserve IDs:** For any step that you keep from the slice, you MUST retain its original "id".
+4. **Generate New IDs:** For any completely new steps you add, generate a new unique ID (e.g., "generated_step_xyz").
+5. **Maintain Format:** The output must be a valid JSON array of step objects, following the exact same format as the steps in the slice.
+""")
+
+_PERSONAS = {
+    "marketer": "You are a sharp, data-driven Marketing Director. You are skeptical of any plan that doesn't have clear customer acquisition and branding strategies.",
+    "investor": "You are a cautious, skeptical venture capital investor. You only care about the bottom line, scalability, and defensible moats.",
+    "power_user": "You are an enthusiastic but demanding power user of this potential product/service. You care about features, ease of use, and whether the plan truly solves your problem."
+}
+_DEFAULT_PERSONA = "You are a generic critical thinker."
+
+def _agent_simulation_template(name, persona_description):
+    return PromptTemplate(name, f"""
+You are an AI agent simulating a specific persona to stress-test a user's plan.
+**Your Persona:** {persona_description}
+**Your Task:**
+1. Inhabit your persona completely.
+2. Read the user's argument and the plan, given at the end.
+3. Generate a response that directly challenges the user's argument FROM YOUR PERSONA'S POINT OF VIEW.
+4. Be critical and expose weak spots. Ask tough questions. Point out potential flaws.
+5. Start your response with a short, in-character statement.
+6. Keep your response concise and formatted in Markdown.
+""")
+
+AGENT_SIMULATION = {
+    persona: _agent_simulation_template(f"agent_simulation_{persona}", description)
+    for persona, description in _PERSONAS.items()
+}
+AGENT_SIMULATION_DEFAULT = _agent_simulation_template("agent_simulation_default", _DEFAULT_PERSONA)
+
+AI_RESEARCHER = PromptTemplate("ai_researcher", """
+You are a world-class AI research analyst for SchematIQ. Your task is to use your integrated search tool to answer the user's research query, given at the end, with up-to-date information.
+Instructions:
+1. Thoroughly analyze the user's query.
+2. Formulate and execute search queries to find relevant, recent data, trends, statistics, or competitor information.
+3. Synthesize the information into a concise, well-structured report.
+4. Use Markdown for formatting.
+5. Conclude with a "Key Takeaway" or "Verdict".
+6. IMPORTANT: Whenever you state a fact or statistic, you MUST cite the source URL from your search results.
+""")
+
+ASK_AI_ON_STEP = PromptTemplate("ask_ai_on_step", """
+You are SchematIQ, a helpful AI planning assistant.
+Your task is to provide a concise, helpful, and direct answer to the user's question about the plan step given at the end.
+""")
+
+TEMPLATES = {
+    template.name: template
+    for template in [
+        DECOMPOSE_STEP, DECOMPOSE_STEPS_BATCH, NEXT_BEST_MOVE, DISCOVER_IDEA,
+        BASE_PLAN_STRATEGIST, BASE_PLAN_EVERYDAY, REPLAN, REPLAN_SLICE, AGENT_SIMULATION_DEFAULT,
+        AI_RESEARCHER, ASK_AI_ON_STEP, *AGENT_SIMULATION.values()
+    ]
+}
+
+
 class PromptLibrary:
+    """Builds prompts from the precompiled templates above. Each builder only
+    formats the small dynamic suffix; *_parts variants return (template, suffix)
+    for callers that send the static prefix separately."""
+
+    @staticmethod
+    def prefix_hash(template_name):
+        return TEMPLATES[template_name].prefix_hash
 
     @staticmethod
+    @_timed_builder
     def decompose_step(parent_step_title):
-        return f"""
-        You are SchematIQ, an AI expert at breaking down complex tasks into simple, actionable micro-steps.
-        A user wants to decompose the following plan step:
-
-        **Parent Step:** "{parent_step_title}"
-
-        Your task is to generate a list of granular micro-steps required to complete this parent step.
-        For each micro-step, you MUST provide a title, a short explanation, and a concrete example.
-
-        Output ONLY a valid JSON array of objects. Do not include any other text, explanations, or markdown.
-
-        Each object in the array must have these three keys:
-        - "title": The short, actionable name of the micro-step.
-        - "explanation": A one-sentence clarification of why this micro-step is important or what it entails.
-        - "example": A brief, concrete example of the micro-step in action.
-
-        Example output for a parent step "Conduct Competitor Analysis":
-        [
-          {{
-            "title": "Identify 3-5 Key Competitors",
-            "explanation": "Find the primary players in your market to establish a baseline for comparison.",
-            "example": "e.g., For a new coffee shop, competitors might be Starbucks, a local cafe, and a new artisanal roaster."
-          }},
-          {{
-            "title": "Analyze Their Website & UX",
-            "explanation": "Evaluate their online presence and user journey to find their strengths and weaknesses.",
-            "example": "e.g., Note down their website's loading speed, ease of navigation, and checkout process."
-          }},
-          {{
-            "title": "Review Their Pricing & Offers",
-            "explanation": "Understand their monetization strategy to position your own product effectively.",
-            "example": "e.g., Document their subscription tiers: Basic ($10/mo), Pro ($25/mo), Enterprise (custom)."
-          }}
-        ]
+        return DECOMPOSE_STEP.render(
+            f'**Parent Step:** "{parent_step_title}"',
+            "Now, generate the structured micro-steps for the provided parent step."
+        )
+
+    @staticmethod
+    @_timed_builder
+    def decompose_steps_batch(steps):
+        """steps is a list of (step_id, step_title) pairs decomposed in a single call."""
+        steps_json = _example_json([{"id": step_id, "title": title} for step_id, title in steps])
+        return DECOMPOSE_STEPS_BATCH.render(
+            f"**Steps:** {steps_json}",
+            "Now, generate the structured micro-steps for every provided step."
+        )
 
-        Now, generate the structured micro-steps for the provided parent step.
-        """
-        
     @staticmethod
+    @_timed_builder
     def get_next_best_move_suggestion(plan_json):
-        return f"""
-        You are SchematIQ, an AI project strategist acting as a momentum coach.
-        Your goal is to provide a single, short, encouraging, and actionable suggestion to a user based on their current plan progress.
-
-        The user's current plan is:
-        ```json
-        {plan_json}
-        ```
-
-        INSTRUCTIONS:
-        1.  Analyze the plan and identify the VERY NEXT incomplete step (the step immediately following the last completed one, or the first step if none are complete).
-        2.  Based on the title and category of that next step, generate a single, insightful "Next Best Move".
-        3.  The suggestion should be varied. It could be:
-            - An encouraging nudge: "Looks like 'Content Creation' is next. Ready to start scripting?"
-            - A specific tip: "For 'Niche Research', try using Google Trends to validate your ideas first."
-            - A question to provoke thought: "You're about to start 'Channel Setup'. Have you thought about your channel banner art yet?"
-            - A tool recommendation if applicable: "When you get to editing, a tool like CapCut can make things much faster."
-        4.  Keep the suggestion to one or two sentences. It should be concise and motivational.
-
-        Output ONLY a single JSON object with one key, "suggestion".
-
-        Example Output:
-        {{
-            "suggestion": "Most users find 'Niche Research' to be the most critical step. Want help brainstorming some video ideas for your chosen niche?"
-        }}
-
-        Now, generate the suggestion for the provided plan.
-        """
+        return NEXT_BEST_MOVE.render(
+            "The user's current plan is:",
+            f"```json\n{plan_json}\n```",
+            "Now, generate the suggestion for the provided plan."
+        )
 
     @staticmethod
+    @_timed_builder
     def discover_idea(niche):
-        return f"""
-        You are SchematIQ, an AI business and project idea generator.
-        A user is looking for an idea in the following niche: "{niche}"
+        return DISCOVER_IDEA.render(f'Now, generate an idea for the "{niche}" niche.')
 
-        Your task is to generate a single, compelling, and actionable project or business idea.
-        The idea should be described in one concise sentence.
+    @staticmethod
+    def generate_base_plan(user_input, mode, extras=None):
+        template, suffix = PromptLibrary.generate_base_plan_parts(user_input, mode, extras)
+        return template.render(suffix)
 
-        Example for niche "sustainable tech":
-        "An app that uses computer vision to identify recyclable vs. non-recyclable items from a phone's camera."
+    @staticmethod
+    @_timed_builder
+    def generate_base_plan_parts(user_input, mode, extras=None):
+        template = BASE_PLAN_STRATEGIST if mode == 'paid' else BASE_PLAN_EVERYDAY
+        lines = [f'The user wants to: "{user_input}"']
 
-        Now, generate an idea for the "{niche}" niche. Output only the single sentence idea.
-        """
+        if extras and 'expected_outcome' in extras and extras['expected_outcome']:
+            lines.append(f"USER'S GOAL: The user's desired final outcome for this plan is: \"{extras['expected_outcome']}\". All steps should be strategically aligned to achieve this specific goal.")
+
+        if extras and 'experience' in extras:
+            lines.append(f"USER CONTEXT: The user's self-assessed experience level for this task is **{extras['experience']}**. Adjust your time estimates accordingly.")
 
-    @staticmethod
-    def generate_base_plan(user_input, mode, extras=None):
-        constraints_prompt_section = ""
         if extras and 'constraints' in extras and extras['constraints']:
             constraints = extras['constraints']
             constraints_list = []
@@ -99,178 +338,219 @@ class PromptLibrary:
             if 'negative' in constraints and constraints['negative']:
                 negative_items = ", ".join([f'"{item}"' for item in constraints['negative']])
                 constraints_list.append(f"- The plan must explicitly AVOID the following platforms, tools, or strategies: {negative_items}.")
-            
-            if constraints_list:
-                constraints_prompt_section = "\n\nCRITICAL CONSTRAINTS: You must strictly adhere to the following user-defined constraints when generating every step of the plan:\n" + "\n".join(constraints_list)
-
-        user_context_prompt = ""
-        if extras and 'experience' in extras:
-            user_context_prompt = f"\nUSER CONTEXT: The user's self-assessed experience level for this task is **{extras['experience']}**. Adjust your time estimates accordingly."
 
-        outcome_context_section = ""
-        if extras and 'expected_outcome' in extras and extras['expected_outcome']:
-            outcome_context_section = f"\nUSER'S GOAL: The user's desired final outcome for this plan is: \"{extras['expected_outcome']}\". All steps should be strategically aligned to achieve this specific goal."
+            if constraints_list:
+                lines.append("CRITICAL CONSTRAINTS: You must strictly adhere to the following user-defined constraints when generating every step of the plan:")
+                lines.extend(constraints_list)
 
-        power_mode_instructions = """
-        - Each step should be highly detailed.
-        - Include a 'power_tools' key with a list of specific software or physical tools.
-        - Add a 'potential_pitfall' key with a brief warning for each step.
-        - The categories should be professional (e.g., 'Market Research', 'Logistics', 'Execution').
-        """
-        
-        tool_instructions = """
-        IMPORTANT: When suggesting tools in the `power_tools` section, you MUST provide them as a JSON object with the fields "name", "description", "link", and "cost".
-        - "name": The official name of the tool (e.g., "Figma", "Notion", "Google Analytics").
-        - "description": A brief, one-sentence summary of what the tool does.
-        - "link": The homepage URL for the tool.
-        - "cost": A brief summary of the pricing (e.g., "Free", "Freemium", "Paid", "$20/month").
-        """
-        
-        base_instructions = """
-        - Steps must be actionable and clear.
-        - Subtasks should be small, concrete actions.
-        - Categories should be simple (e.g., 'Planning', 'Action', 'Review').
-        """
+        lines.append("Now, generate the complete plan object based on the user's input.")
+        return template, "\n".join(lines)
 
-        plan_summary_instructions = """
-        The root of the JSON response MUST be a single object. At the top level of this object, include:
-        - "estimated_duration": A concise string representing the total estimated time for the plan (e.g., "2-3 Weeks", "3 Months", "1 Year").
-        - "budget_level": A single-word summary of the likely budget required: "Low", "Medium", "High", or "Variable".
-        - "tags": A JSON array of 2-4 relevant string tags for the plan. Choose from: "Business", "Tech", "Creative", "Marketing", "Health", "Lifestyle", "Productivity", "Finance".
-        - "steps": A JSON array of step objects. THIS MUST BE AN ARRAY, NOT AN OBJECT.
-        """
+    @staticmethod
+    def replan_based_on_outcome(plan_json, completed_step_title, outcome, reason=None):
+        template, suffix = PromptLibrary.replan_based_on_outcome_parts(plan_json, completed_step_title, outcome, reason)
+        return template.render(suffix)
 
-        prompt = f"""
-        You are SchematIQ, an AI-powered planning assistant.
-        The user wants to: "{user_input}"
-        {outcome_context_section}
-        {user_context_prompt}
-        {constraints_prompt_section}
-        
-        {plan_summary_instructions}
-
-        The user has selected: **{'Strategist Mode' if mode == 'paid' else 'Everyday Mode'}**.
-
-        {'Use these detailed instructions for Strategist Mode:' + power_mode_instructions + tool_instructions if mode == 'paid' else 'Use these instructions for Everyday Mode:' + base_instructions}
-        
-        CRITICAL FORMATTING RULES FOR STEPS:
-        1. For each step, provide a realistic time estimate as a JSON object with "min", "max", and "unit" fields.
-        2. For each step, provide an "effort" level as a string: "low", "medium", "high".
-        3. For each step, decide if it is a major project milestone and set "is_milestone" to true or false.
-
-        The final output MUST be a valid JSON object. Do not include any other text.
-        
-        Example JSON format:
-        {{
-          "id": "unique_plan_id_1",
-          "title": "Launch a new SaaS product",
-          "mode": "paid",
-          "estimated_duration": "3-4 Months",
-          "budget_level": "Medium",
-          "tags": ["Business", "Tech", "SaaS"],
-          "steps": [
-            {{
-              "id": "unique_step_id_1",
-              "title": "Market Research",
-              "subtasks": ["Define target audience", "Analyze 5 competitors"],
-              "time_estimate": {{ "min": 1, "max": 2, "unit": "weeks" }},
-              "effort": "high",
-              "is_milestone": true,
-              "category": "Research",
-              "is_complete": false,
-              "power_tools": [],
-              "potential_pitfall": "Inadequate research leading to a product no one needs."
-            }}
-          ]
-        }}
-        
-        Now, generate the complete plan object based on the user's input.
-        """
-        return prompt
+    @staticmethod
+    @_timed_builder
+    def replan_based_on_outcome_parts(plan_json, completed_step_title, outcome, reason=None):
+        outcome_adjective = "succeeded and went well" if outcome == "success" else "failed or produced a negative result"
+        lines = [
+            "The original plan is:",
+            f"```json\n{plan_json}\n```",
+            f'The step just completed is: "{completed_step_title}"',
+            f"The outcome of this step was: **This step {outcome_adjective}.**"
+        ]
+        if outcome == "failure" and reason:
+            lines.append(f'The user provided this specific reason for the failure: "{reason}". Take this reason into critical consideration when adapting the plan.')
+        lines.append("Now, generate the new JSON array for the remaining, adapted plan.")
+        return REPLAN, "\n".join(lines)
 
     @staticmethod
-    def replan_based_on_outcome(plan_json, completed_step_title, outcome, reason=None):
+    @_timed_builder
+    def replan_slice_parts(outline_json, slice_json, completed_step_title, outcome, reason=None):
         outcome_adjective = "succeeded and went well" if outcome == "success" else "failed or produced a negative result"
-        failure_reason_context = ""
+        lines = [
+            "Outline of the rest of the plan (unchanged):",
+            f"```json\n{outline_json}\n```",
+            f'The step just completed is: "{completed_step_title}"',
+            f"The outcome of this step was: **This step {outcome_adjective}.**"
+        ]
         if outcome == "failure" and reason:
-            failure_reason_context = f'\n\nThe user provided this specific reason for the failure: "{reason}". Take this reason into critical consideration when adapting the plan.'
-
-        return f"""
-        You are SchematIQ, an expert AI strategist capable of dynamic replanning. A user is executing a plan and has just completed a step with a specific outcome.
-        The original plan is:
-        ```json
-        {plan_json}
-        ```
-        The step just completed is: "{completed_step_title}"
-        The outcome of this step was: **This step {outcome_adjective}.**
-        {failure_reason_context}
-        Your task is to analyze the original plan in light of this new information and generate a revised list of *only the remaining, incomplete steps*.
-        INSTRUCTIONS:
-        1.  **Analyze the Impact:** Consider how the success or failure of the completed step affects the subsequent steps.
-        2.  **Adapt, Don't Replace:** Do not change the fundamental goal. Modify, re-order, add, or remove *future* steps to better align with the new reality.
-        3.  **Preserve IDs:** For any step that you keep from the original plan, you MUST retain its original "id".
-        4.  **Generate New IDs:** For any completely new steps you add, generate a new unique ID (e.g., "generated_step_xyz").
-        5.  **Maintain Format:** The output must be a valid JSON array of step objects, following the exact same format as the original plan's steps.
-        6.  **Output Only Remaining Steps:** The JSON you return should ONLY contain the steps that are yet to be completed.
-        Now, generate the new JSON array for the remaining, adapted plan.
-        """
+            lines.append(f'The user provided this specific reason for the failure: "{reason}". Take this reason into critical consideration when adapting the plan.')
+        lines.extend([
+            "The slice of upcoming steps to revise:",
+            f"```json\n{slice_json}\n```",
+            "Now, generate the new JSON array that replaces this slice."
+        ])
+        return REPLAN_SLICE, "\n".join(lines)
 
     @staticmethod
+    @_timed_builder
     def agent_simulation(plan_json, persona, user_argument):
-        personas = {
-            "marketer": "You are a sharp, data-driven Marketing Director. You are skeptical of any plan that doesn't have clear customer acquisition and branding strategies.",
-            "investor": "You are a cautious, skeptical venture capital investor. You only care about the bottom line, scalability, and defensible moats.",
-            "power_user": "You are an enthusiastic but demanding power user of this potential product/service. You care about features, ease of use, and whether the plan truly solves your problem."
-        }
-        persona_description = personas.get(persona, "You are a generic critical thinker.")
-        return f"""
-        You are an AI agent simulating a specific persona to stress-test a user's plan.
-        **Your Persona:** {persona_description}
-        **The User's Plan:**
-        ```json
-        {plan_json}
-        ```
-        **The User's Argument/Question:**
-        ---
-        "{user_argument}"
-        ---
-        **Your Task:**
-        1.  Inhabit your persona completely.
-        2.  Read the user's argument and the plan.
-        3.  Generate a response that directly challenges the user's argument FROM YOUR PERSONA'S POINT OF VIEW.
-        4.  Be critical and expose weak spots. Ask tough questions. Point out potential flaws.
-        5.  Start your response with a short, in-character statement.
-        6.  Keep your response concise and formatted in Markdown.
-        """
-        
+        template = AGENT_SIMULATION.get(persona, AGENT_SIMULATION_DEFAULT)
+        return template.render(
+            "**The User's Plan:**",
+            f"```json\n{plan_json}\n```",
+            "**The User's Argument/Question:**",
+            f'---\n"{user_argument}"\n---'
+        )
+
     @staticmethod
+    @_timed_builder
     def ai_researcher(query):
-        return f"""
-        You are a world-class AI research analyst for SchematIQ. Your task is to use your integrated search tool to answer the user's question with up-to-date information.
-        The user's research query is:
-        ---
-        "{query}"
-        ---
-        Instructions:
-        1.  Thoroughly analyze the user's query.
-        2.  Formulate and execute search queries to find relevant, recent data, trends, statistics, or competitor information.
-        3.  Synthesize the information into a concise, well-structured report.
-        4.  Use Markdown for formatting.
-        5.  Conclude with a "Key Takeaway" or "Verdict".
-        6.  IMPORTANT: Whenever you state a fact or statistic, you MUST cite the source URL from your search results.
-        """
+        return AI_RESEARCHER.render(
+            "The user's research query is:",
+            f'---\n"{query}"\n---'
+        )
 
     @staticmethod
+    @_timed_builder
     def ask_ai_on_step(step_description, user_question):
-        return f"""
-        You are SchematIQ, a helpful AI planning assistant.
-        The plan step is:
-        ---
-        {step_description}
-        ---
-        The user's question is:
-        ---
-        "{user_question}"
-        ---
-        Your task is to provide a concise, helpful, and direct answer.
-        """
\ No newline at end of file
+        return ASK_AI_ON_STEP.render(
+            "The plan step is:",
+            f"---\n{step_description}\n---",
+            "The user's question is:",
+            f'---\n"{user_question}"\n---'
+        )
+
+
+class PlanPromptSerializer:
+    """Serializes plans into compact JSON for prompts, keeping only the fields
+    each prompt needs and fitting the result into an approximate token budget."""
+
+    # Roughly four characters per token for English text and JSON.
+    CHARS_PER_TOKEN = 4
+
+    PLAN_FIELDS = {
+        "next_move": ("title", "mode"),
+        "agent_simulation": ("title", "mode", "estimated_duration", "budget_level", "tags"),
+        "replan": ("title", "mode", "estimated_duration", "budget_level", "tags"),
+    }
+    STEP_FIELDS = {
+        "next_move": ("title", "category", "is_complete", "is_milestone"),
+        "agent_simulation": ("title", "category", "subtasks", "time_estimate", "is_milestone",
+                             "is_complete", "power_tools", "potential_pitfall"),
+        "replan": ("id", "title", "subtasks", "time_estimate", "effort", "is_milestone", "category",
+                   "is_complete", "parallel_with_previous", "power_tools", "potential_pitfall"),
+    }
+    COMPLETED_STEP_FIELDS = ("id", "title", "is_complete")
+    # What is left of an incomplete step when a plan that must keep all of them is over budget.
+    OUTLINE_STEP_FIELDS = ("id", "title", "category", "is_milestone", "is_complete")
+    # A full replan replaces every incomplete step with the model's output, so
+    # any incomplete step missing from the prompt would be lost.
+    KEEPS_INCOMPLETE_STEPS = {"replan"}
+
+    @staticmethod
+    def estimate_tokens(text):
+        return len(text) // PlanPromptSerializer.CHARS_PER_TOKEN + 1
+
+    @staticmethod
+    @_timed_serializer
+    def serialize(plan, purpose, token_budget=None):
+        """Returns compact JSON for `plan` projected for `purpose`.
+
+        When the result exceeds token_budget it is shrunk in stages: completed
+        steps are reduced to id/title, power_tools are reduced to names, subtasks
+        are trimmed, and finally completed then trailing steps are dropped with
+        an "omitted_steps" count.
+
+        Purposes in KEEPS_INCOMPLETE_STEPS never lose an incomplete step: their
+        incomplete steps are cut to OUTLINE_STEP_FIELDS instead, only completed
+        steps are dropped, and if that is still not enough the result is
+        returned over budget.
+        """
+        if token_budget is None:
+            token_budget = Config.PROMPT_PLAN_TOKEN_BUDGET
+
+        plan_fields = PlanPromptSerializer.PLAN_FIELDS[purpose]
+        step_fields = PlanPromptSerializer.STEP_FIELDS[purpose]
+        projected = {key: plan[key] for key in plan_fields if plan.get(key) not in (None, "", [])}
+        steps = [
+            {key: step[key] for key in step_fields if key in step}
+            for step in plan.get('steps') or [] if isinstance(step, dict)
+        ]
+        projected['steps'] = steps
+
+        text = PlanPromptSerializer._dumps(projected)
+        if not token_budget or PlanPromptSerializer.estimate_tokens(text) <= token_budget:
+            return text
+
+        keep_incomplete = purpose in PlanPromptSerializer.KEEPS_INCOMPLETE_STEPS
+        shrinks = [PlanPromptSerializer._summarize_completed,
+                   PlanPromptSerializer._tool_names_only,
+                   PlanPromptSerializer._trim_subtasks]
+        if keep_incomplete:
+            shrinks.append(PlanPromptSerializer._outline_only)
+        for shrink in shrinks:
+            projected['steps'] = [shrink(step) for step in projected['steps']]
+            text = PlanPromptSerializer._dumps(projected)
+            if PlanPromptSerializer.estimate_tokens(text) <= token_budget:
+                return text
+
+        # Still too large: drop completed steps oldest-first, then trailing steps.
+        total_steps = len(projected['steps'])
+        while len(projected['steps']) > 1 and PlanPromptSerializer.estimate_tokens(text) > token_budget:
+            steps = projected['steps']
+            completed = next((i for i, step in enumerate(steps) if step.get('is_complete')), None)
+            if completed is None and keep_incomplete:
+                print(f"Plan for '{purpose}' prompt is over its {token_budget}-token budget "
+                      f"with only incomplete steps left ({len(steps)}); sending it anyway.")
+                break
+            projected['steps'] = steps[:completed] + steps[completed + 1:] if completed is not None else steps[:-1]
+            projected['omitted_steps'] = total_steps - len(projected['steps'])
+            text = PlanPromptSerializer._dumps(projected)
+        return text
+
+    @staticmethod
+    @_timed_serializer
+    def serialize_steps(steps, purpose):
+        """Compact JSON array of steps projected for `purpose`, without trimming."""
+        step_fields = PlanPromptSerializer.STEP_FIELDS[purpose]
+        return PlanPromptSerializer._dumps([
+            {key: step[key] for key in step_fields if key in step}
+            for step in steps if isinstance(step, dict)
+        ])
+
+    @staticmethod
+    @_timed_serializer
+    def serialize_outline(plan, exclude_positions=()):
+        """Compact one-line-per-step outline of a plan (id, title, category, status)."""
+        outline = {key: plan[key] for key in ("title", "tags") if plan.get(key)}
+        outline['steps'] = [
+            {key: step[key] for key in ("id", "title", "category", "is_complete") if key in step}
+            for position, step in enumerate(plan.get('steps') or [])
+            if isinstance(step, dict) and position not in exclude_positions
+        ]
+        return PlanPromptSerializer._dumps(outline)
+
+    @staticmethod
+    def _dumps(data):
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+    @staticmethod
+    def _summarize_completed(step):
+        if not step.get('is_complete'):
+            return step
+        return {key: step[key] for key in PlanPromptSerializer.COMPLETED_STEP_FIELDS if key in step}
+
+    @staticmethod
+    def _outline_only(step):
+        if step.get('is_complete'):
+            return step
+        return {key: step[key] for key in PlanPromptSerializer.OUTLINE_STEP_FIELDS if key in step}
+
+    @staticmethod
+    def _tool_names_only(step):
+        tools = step.get('power_tools')
+        if not tools:
+            return step
+        names = [tool.get('name') if isinstance(tool, dict) else tool for tool in tools]
+        return {**step, 'power_tools': names}
+
+    @staticmethod
+    def _trim_subtasks(step):
+        subtasks = step.get('subtasks')
+        if not isinstance(subtasks, list) or len(subtasks) <= 3:
+            return step
+        return {**step, 'subtasks': subtasks[:3]}
@@ -1,7 +1,22 @@
 import jwt
+import threading
+import time
+from collections import OrderedDict
 from config import Config
 
+# Negative-cache hit marker; distinct from a (possibly empty) payload.
+_REJECTED = object()
+
 class AuthService:
+    def __init__(self, cache_size=1024, cache_ttl=300, negative_ttl=60):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self._verified = OrderedDict()  # token -> (payload, expires_at)
+        self._rejected = OrderedDict()  # token -> expires_at
+        self._lock = threading.Lock()
+        self._cache_secret = Config.SECRET_KEY
+
     def get_mock_token(self, user_id="mock_user_123", tier="paid"): # Default to 'paid' for full features
         """Generates a mock JWT token for development with a specified tier."""
         payload = {"user_id": user_id, "tier": tier}
@@ -9,14 +24,69 @@ class AuthService:
         return token
 
     def validate_token(self, token):
-        """Validates a JWT token. Returns the full payload or None."""
+        """Validates a JWT token. Returns the full payload or None.
+
+        Recently verified tokens are served from a bounded LRU (never past their
+        `exp`), and recently rejected ones from a short-lived negative cache.
+        """
+        now = time.time()
+        cached = self._cached_result(token, now)
+        if cached is _REJECTED:
+            return None
+        if cached is not None:
+            return cached
+
         # --- THIS BLOCK IS NOW CORRECT ---
         try:
             # The code to be "tried" is now correctly indented under the try block.
             payload = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
-            return payload
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
+            self._remember(self._rejected, token, now + self.negative_ttl)
             return None
 
+        expires_at = now + self.cache_ttl
+        if isinstance(payload.get('exp'), (int, float)):
+            expires_at = min(expires_at, payload['exp'])
+        self._remember(self._verified, token, (payload, expires_at))
+        return dict(payload)
+
+    def invalidate_token_cache(self):
+        """Drops every cached verification result, e.g. after SECRET_KEY rotates."""
+        with self._lock:
+            self._verified.clear()
+            self._rejected.clear()
+            self._cache_secret = Config.SECRET_KEY
+
+    def _cached_result(self, token, now):
+        """Returns a payload copy on a positive hit, _REJECTED on a negative hit, else None."""
+        if self._cache_secret != Config.SECRET_KEY:
+            self.invalidate_token_cache()
+        with self._lock:
+            entry = self._verified.get(token)
+            if entry is not None:
+                payload, expires_at = entry
+                if expires_at > now:
+                    self._verified.move_to_end(token)
+                    return dict(payload)
+                del self._verified[token]
+
+            rejected_until = self._rejected.get(token)
+            if rejected_until is not None:
+                if rejected_until > now:
+                    return _REJECTED
+                del self._rejected[token]
+        return None
+
+    def _remember(self, cache, token, value):
+        with self._lock:
+            cache[token] = value
+            cache.move_to_end(token)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
 # Singleton instance
-auth_service = AuthService()
\ No newline at end of file
+auth_service = AuthService(
+    cache_size=Config.TOKEN_CACHE_SIZE,
+    cache_ttl=Config.TOKEN_CACHE_TTL,
+    negative_ttl=Config.TOKEN_NEGATIVE_CACHE_TTL
+)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from .sqlite_support import SQLiteDatabase
+
+SHARED_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at);
+"""
+
+
+class ResponseCache:
+    """Content-addressed cache for model responses.
+
+    Entries live in a bounded in-process LRU with a TTL. When a shared path is
+    configured, a SQLite tier lets every gunicorn worker reuse the others' answers.
+    Values are stored JSON-encoded, so every hit hands the caller a fresh copy.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries=512, ttl=3600, shared_path=None, scopes=()):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.scopes = set(scopes)
+        self._entries = OrderedDict()  # key -> (expires_at, encoded value)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._writes = 0
+        self._shared = SQLiteDatabase(shared_path, SHARED_CACHE_SCHEMA) if shared_path else None
+
+    @staticmethod
+    def make_key(model_name, tools, prompt, safety_settings=None, generation_config=None):
+        """Hashes everything that influences the model's answer into a stable key."""
+        material = json.dumps({
+            "model": model_name,
+            "tools": sorted(str(tool) for tool in (tools or [])),
+            "prompt": prompt,
+            "safety": sorted((str(k), str(v)) for k, v in (safety_settings or {}).items()),
+            "generation": generation_config or {},
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def is_enabled(self, scope):
+        return scope is not None and scope in self.scopes
+
+    def get(self, key, scope=None):
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+        encoded = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    encoded = entry[1]
+                else:
+                    del self._entries[key]
+
+        if encoded is None and self._shared is not None:
+            encoded = self._shared_get(key, now)
+            if encoded is not None:
+                self._count(scope, 'shared_hits')
+                self._remember(key, encoded, now + self.ttl)
+
+        if encoded is None:
+            self._count(scope, 'misses')
+            return None
+        self._count(scope, 'hits')
+        return json.loads(encoded)
+
+    def set(self, key, value, scope=None):
+        encoded = json.dumps(value)
+        expires_at = time.time() + self.ttl
+        self._remember(key, encoded, expires_at)
+        if self._shared is not None:
+            self._shared_set(key, encoded, expires_at)
+
+    def compare_and_set(self, key, expected, value, scope=None):
+        """Atomically stores value if the current entry equals expected (None: absent
+        or expired). Returns True if it was stored. Shared across workers when a
+        shared path is configured."""
+        encoded = json.dumps(value)
+        now = time.time()
+        expires_at = now + self.ttl
+        if self._shared is not None:
+            if not self._shared_compare_and_set(key, expected, encoded, now, expires_at):
+                with self._lock:
+                    self._entries.pop(key, None)
+                return False
+            self._remember(key, encoded, expires_at)
+            return True
+        with self._lock:
+            entry = self._entries.get(key)
+            current = json.loads(entry[1]) if entry is not None and entry[0] > now else None
+            if current != expected:
+                return False
+            self._store(key, encoded, expires_at)
+        return True
+
+    def stats(self):
+        """Returns a copy of the per-scope hit/miss counters."""
+        with self._lock:
+            return {scope: dict(counters) for scope, counters in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._shared is not None:
+            self._shared.connection().execute("DELETE FROM response_cache")
+
+    def _remember(self, key, encoded, expires_at):
+        with self._lock:
+            self._store(key, encoded, expires_at)
+
+    def _store(self, key, encoded, expires_at):
+        # Caller holds self._lock.
+        self._entries[key] = (expires_at, encoded)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _count(self, scope, counter):
+        with self._lock:
+            counters = self._stats.setdefault(scope or 'default', {'hits': 0, 'misses': 0, 'shared_hits': 0})
+            counters[counter] += 1
+
+    def _shared_get(self, key, now):
+        try:
+            row = self._shared.connection().execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            return row['value'] if row else None
+        except Exception as e:
+            print(f"Shared response cache read failed: {e}")
+            return None
+
+    def _shared_compare_and_set(self, key, expected, encoded, now, expires_at):
+        with self._shared.transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if (json.loads(row['value']) if row else None) != expected:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, encoded, expires_at)
+            )
+            return True
+
+    def _shared_set(self, key, encoded, expires_at):
+        try:
+            conn = self._shared.connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, encoded, expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        except Exception as e:
+            print(f"Shared response cache write failed: {e}")
+
+
+# Singleton instance
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    shared_path=Config.RESPONSE_CACHE_PATH if Config.RESPONSE_CACHE_BACKEND == 'sqlite' else None,
+    scopes=Config.RESPONSE_CACHE_SCOPES,
+)
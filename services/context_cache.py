@@ -0,0 +1,128 @@
+import datetime
+import os
+import threading
+import time
+import google.generativeai as genai
+from config import Config
+
+
+class _Entry:
+    def __init__(self, model, handle=None, expires_at=0.0):
+        self.model = model
+        self.handle = handle
+        self.expires_at = expires_at
+
+
+CHARS_PER_TOKEN = 4
+
+
+class ContextCacheManager:
+    """Serves models whose static prompt preamble is held upstream.
+
+    Each PromptTemplate prefix is registered once per process as cached content
+    and refreshed before its TTL runs out. Preambles shorter than `min_tokens`
+    (the upstream minimum for cached content) are never registered and are
+    sent as a system instruction. If the upstream refuses (caching not
+    available for the model, quota), the system instruction is used too and
+    registration is retried after a TTL. Upstream calls run outside the
+    manager's lock, one at a time per template. The genai calls are injectable
+    so a local fake can stand in.
+    """
+
+    def __init__(self, ttl, refresh_margin, min_tokens=0, create_cache=None, extend_cache=None,
+                 model_from_cache=None, fallback_model=None, clock=time.time):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self._create_cache = create_cache or self._genai_create_cache
+        self._extend_cache = extend_cache or self._genai_extend_cache
+        self._model_from_cache = model_from_cache or self._genai_model_from_cache
+        self._fallback_model = fallback_model or self._genai_fallback_model
+        self._clock = clock
+        self._entries = {}
+        self._refresh_locks = {}  # template name -> lock held while refreshing it
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def model_for(self, template):
+        """Returns a model that already carries template.prefix as its context."""
+        entry, refresh_lock = self._lookup(template)
+        if entry is not None:
+            return entry.model
+        with refresh_lock:
+            # Another thread may have refreshed it while this one waited.
+            entry, _ = self._lookup(template)
+            if entry is not None:
+                return entry.model
+            with self._lock:
+                stale = self._entries.get(template.name)
+            entry = self._refresh(template, stale, self._clock())
+            with self._lock:
+                self._entries[template.name] = entry
+            return entry.model
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, template):
+        """Returns (fresh entry or None, the template's refresh lock)."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Models created before a fork belong to the parent's connections.
+                self._entries = {}
+                self._refresh_locks = {}
+                self._pid = os.getpid()
+            entry = self._entries.get(template.name)
+            refresh_lock = self._refresh_locks.setdefault(template.name, threading.Lock())
+            if entry is not None and entry.expires_at - self.refresh_margin > self._clock():
+                return entry, refresh_lock
+            return None, refresh_lock
+
+    def _refresh(self, template, entry, now):
+        if len(template.prefix) // CHARS_PER_TOKEN < self.min_tokens:
+            # Too small to be cached upstream; no point asking.
+            return _Entry(self._fallback_model(template), None, float('inf'))
+        if entry is not None and entry.handle is not None:
+            try:
+                self._extend_cache(entry.handle, self.ttl)
+                entry.expires_at = now + self.ttl
+                return entry
+            except Exception as e:
+                print(f"Could not extend cached context for '{template.name}', recreating: {e}")
+        try:
+            handle = self._create_cache(template, self.ttl)
+            return _Entry(self._model_from_cache(handle), handle, now + self.ttl)
+        except Exception as e:
+            print(f"Context caching unavailable for '{template.name}', using system instruction: {e}")
+            return _Entry(self._fallback_model(template), None, now + self.ttl)
+
+    @staticmethod
+    def _genai_create_cache(template, ttl):
+        model = Config.GEMINI_MODEL
+        return genai.caching.CachedContent.create(
+            model=model if model.startswith('models/') else f"models/{model}",
+            display_name=f"schematiq-{template.name}-{template.prefix_hash}",
+            system_instruction=template.prefix,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    @staticmethod
+    def _genai_extend_cache(handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+    @staticmethod
+    def _genai_model_from_cache(handle):
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    @staticmethod
+    def _genai_fallback_model(template):
+        return genai.GenerativeModel(Config.GEMINI_MODEL, system_instruction=template.prefix)
+
+
+# Singleton instance
+context_cache = ContextCacheManager(
+    ttl=Config.CONTEXT_CACHE_TTL,
+    refresh_margin=Config.CONTEXT_CACHE_REFRESH_MARGIN,
+    min_tokens=Config.CONTEXT_CACHE_MIN_TOKENS
+)
@@ -0,0 +1,340 @@
+import hashlib
+import html
+import json
+import os
+import textwrap
+import uuid
+from config import Config
+
+# --- HTML ---
+# Fragments are formatted once per element and yielded as they are produced,
+# so rendering never holds more than one step's markup at a time.
+
+HTML_HEAD = (
+    "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n<title>{title}</title>\n"
+    "<style>body{{font-family:Helvetica,Arial,sans-serif;max-width:46em;margin:2em auto;color:#222}}"
+    "h2{{margin-top:1.6em}}.meta{{color:#666;font-size:.9em}}"
+    ".pitfall{{background:#fff4e5;padding:.5em .8em;border-left:3px solid #f0a030}}</style>\n"
+    "</head>\n<body>\n<h1>{title}</h1>\n<p class=\"meta\">{meta}</p>\n"
+)
+HTML_STEP_OPEN = "<section>\n<h2>{marker}Step {number}: {title}</h2>\n<p class=\"meta\">{meta}</p>\n"
+HTML_LIST_OPEN = "<h3>{heading}</h3>\n<ul>\n"
+HTML_LIST_ITEM = "<li>{content}</li>\n"
+HTML_LIST_CLOSE = "</ul>\n"
+HTML_TOOL = "<strong>{name}</strong>{cost}{description}"
+HTML_LINK = "<a href=\"{href}\">{text}</a>"
+HTML_PITFALL = "<p class=\"pitfall\"><strong>Potential pitfall:</strong> {text}</p>\n"
+HTML_STEP_CLOSE = "</section>\n"
+HTML_TAIL = "</body>\n</html>\n"
+
+
+def _esc(value):
+    return html.escape(str(value), quote=True)
+
+
+def plan_meta(plan):
+    parts = [plan.get('estimated_duration'), plan.get('budget_level'), ", ".join(plan.get('tags') or [])]
+    return " | ".join(str(part) for part in parts if part)
+
+
+def step_meta(step):
+    parts = []
+    estimate = step.get('time_estimate')
+    if isinstance(estimate, dict) and 'min' in estimate:
+        parts.append(f"{estimate.get('min')}-{estimate.get('max', estimate.get('min'))} {estimate.get('unit', 'days')}")
+    if step.get('effort'):
+        parts.append(f"{step['effort']} effort")
+    if step.get('category'):
+        parts.append(step['category'])
+    if step.get('is_complete'):
+        parts.append("completed")
+    return " | ".join(str(part) for part in parts)
+
+
+def render_html(plan):
+    """Yields the plan as an HTML document, piece by piece."""
+    title = _esc(plan.get('title') or "Plan")
+    yield HTML_HEAD.format(title=title, meta=_esc(plan_meta(plan)))
+    for number, step in enumerate(plan.get('steps') or [], start=1):
+        if not isinstance(step, dict):
+            continue
+        yield HTML_STEP_OPEN.format(
+            marker="&#9733; " if step.get('is_milestone') else "",
+            number=number,
+            title=_esc(step.get('title', "")),
+            meta=_esc(step_meta(step))
+        )
+        if step.get('subtasks'):
+            yield HTML_LIST_OPEN.format(heading="Subtasks")
+            for subtask in step['subtasks']:
+                yield HTML_LIST_ITEM.format(content=_esc(subtask))
+            yield HTML_LIST_CLOSE
+        if step.get('power_tools'):
+            yield HTML_LIST_OPEN.format(heading="Power tools")
+            for tool in step['power_tools']:
+                if isinstance(tool, dict):
+                    yield HTML_LIST_ITEM.format(content=_html_tool(tool))
+            yield HTML_LIST_CLOSE
+        if step.get('potential_pitfall'):
+            yield HTML_PITFALL.format(text=_esc(step['potential_pitfall']))
+        yield HTML_STEP_CLOSE
+    yield HTML_TAIL
+
+
+def _html_tool(tool):
+    name = _esc(tool.get('name', ""))
+    link = str(tool.get('link') or "")
+    if link.startswith(('http://', 'https://')):
+        name = HTML_LINK.format(href=_esc(link), text=name)
+    return HTML_TOOL.format(
+        name=name,
+        cost=f" ({_esc(tool['cost'])})" if tool.get('cost') else "",
+        description=f" &ndash; {_esc(tool['description'])}" if tool.get('description') else ""
+    )
+
+
+# --- PDF ---
+
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 612, 792, 56  # US Letter, in points
+
+# style -> (font resource, size, indent, space before)
+PDF_STYLES = {
+    "title": ("F2", 18, 0, 0),
+    "meta": ("F1", 9, 0, 4),
+    "heading": ("F2", 13, 0, 16),
+    "label": ("F2", 10.5, 0, 6),
+    "body": ("F1", 10.5, 0, 2),
+    "bullet": ("F1", 10.5, 14, 2),
+}
+
+# Average Helvetica glyph width as a fraction of the font size, used for wrapping.
+AVERAGE_CHAR_WIDTH = 0.5
+
+
+def plan_lines(plan):
+    """Yields (style, text) lines describing the plan, for the PDF layout."""
+    yield "title", plan.get('title') or "Plan"
+    meta = plan_meta(plan)
+    if meta:
+        yield "meta", meta
+    for number, step in enumerate(plan.get('steps') or [], start=1):
+        if not isinstance(step, dict):
+            continue
+        marker = "* " if step.get('is_milestone') else ""
+        yield "heading", f"{marker}Step {number}: {step.get('title', '')}"
+        meta = step_meta(step)
+        if meta:
+            yield "meta", meta
+        if step.get('subtasks'):
+            yield "label", "Subtasks"
+            for subtask in step['subtasks']:
+                yield "bullet", f"- {subtask}"
+        if step.get('power_tools'):
+            yield "label", "Power tools"
+            for tool in step['power_tools']:
+                if isinstance(tool, dict):
+                    yield "bullet", "- " + " ".join(filter(None, [
+                        tool.get('name'),
+                        f"({tool['cost']})" if tool.get('cost') else None,
+                        f"- {tool['description']}" if tool.get('description') else None,
+                        tool.get('link')
+                    ]))
+        if step.get('potential_pitfall'):
+            yield "label", "Potential pitfall"
+            yield "body", step['potential_pitfall']
+
+
+def _pdf_string(text):
+    encoded = str(text).encode('cp1252', errors='replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class PdfStreamWriter:
+    """Minimal PDF 1.4 writer that emits the document as it lays it out.
+
+    Only the current page's content stream and the object offsets are kept in
+    memory. Object 1 is the catalog, 2 the page tree (written last, once every
+    page is known) and 3/4 the built-in Helvetica fonts, so no font data is
+    embedded.
+    """
+
+    def __init__(self):
+        self._offsets = {}
+        self._position = 0
+        self._next_id = 5
+        self._page_ids = []
+
+    def render(self, lines):
+        yield self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        yield self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        yield self._object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+        content, y = [], PAGE_HEIGHT - MARGIN
+        for style, text in lines:
+            font, size, indent, space_before = PDF_STYLES[style]
+            leading = size * 1.35
+            width = int((PAGE_WIDTH - 2 * MARGIN - indent) / (size * AVERAGE_CHAR_WIDTH))
+            y -= space_before
+            for index, line in enumerate(textwrap.wrap(str(text), width) or [""]):
+                if y - leading < MARGIN:
+                    yield self._page(content)
+                    content, y = [], PAGE_HEIGHT - MARGIN
+                y -= leading
+                # Continuation lines of a bullet hang under its text.
+                x = MARGIN + indent + (size * AVERAGE_CHAR_WIDTH * 2 if index and style == "bullet" else 0)
+                content.append(b"BT /%s %g Tf %.2f %.2f Td (%s) Tj ET" % (
+                    font.encode(), size, x, y, _pdf_string(line)
+                ))
+        if content or not self._page_ids:
+            yield self._page(content)
+
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+        yield self._object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_ids)))
+        yield self._xref()
+
+    def _page(self, content):
+        stream = b"\n".join(content)
+        content_id, page_id = self._next_id, self._next_id + 1
+        self._next_id += 2
+        self._page_ids.append(page_id)
+        return self._object(
+            content_id, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        ) + self._object(
+            page_id,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, content_id)
+        )
+
+    def _object(self, object_id, body):
+        self._offsets[object_id] = self._position
+        return self._emit(b"%d 0 obj\n%s\nendobj\n" % (object_id, body))
+
+    def _xref(self):
+        size = self._next_id
+        entries = [b"0000000000 65535 f \n"] + [
+            b"%010d 00000 n \n" % self._offsets[object_id] for object_id in range(1, size)
+        ]
+        return b"xref\n0 %d\n%s" % (size, b"".join(entries)) + (
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, self._position)
+        )
+
+    def _emit(self, data):
+        self._position += len(data)
+        return data
+
+
+def render_pdf(plan):
+    """Yields the plan as a PDF document, page by page."""
+    return PdfStreamWriter().render(plan_lines(plan))
+
+
+# --- Artifacts ---
+
+EXPORT_FORMATS = {
+    "html": (render_html, "text/html; charset=utf-8"),
+    "pdf": (render_pdf, "application/pdf"),
+}
+
+
+def chunked(pieces, size):
+    """Groups small str/bytes pieces into chunks of roughly `size` bytes."""
+    buffer, buffered = [], 0
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class ExportService:
+    """Renders plans to HTML or PDF and keeps finished artifacts on disk.
+
+    Artifacts are keyed by owner, plan id and a hash of the plan content, so a
+    download after the plan changes renders afresh while repeat downloads
+    stream the stored file. A
+    render is written to a temporary file alongside the response and only
+    becomes the cached artifact once the whole document has been sent.
+    """
+
+    def __init__(self, cache_dir, chunk_size=16384):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+
+    def export(self, plan, fmt):
+        """Returns (chunks, mimetype) for the plan in the given format."""
+        render, mimetype = EXPORT_FORMATS[fmt]
+        path = self._artifact_path(plan, fmt)
+        if path is not None and os.path.exists(path):
+            return self._read(path), mimetype
+        chunks = chunked(render(plan), self.chunk_size)
+        if path is None:
+            return chunks, mimetype
+        return self._write_through(chunks, path), mimetype
+
+    @staticmethod
+    def filename(plan, fmt):
+        title = "".join(c if c.isascii() and c.isalnum() else "-" for c in (plan.get('title') or "plan").lower())
+        return f"{'-'.join(filter(None, title.split('-')))[:60] or 'plan'}.{fmt}"
+
+    def _artifact_path(self, plan, fmt):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{self._plan_key(plan)}-v{self._content_key(plan)}.{fmt}")
+
+    @staticmethod
+    def _plan_key(plan):
+        owner = f"{plan.get('user_id')}\0{plan.get('id')}"
+        return hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32]
+
+    @staticmethod
+    def _content_key(plan):
+        # Versions alone are not unique: the memory store restarts them per process.
+        content = json.dumps(plan, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+
+    def _read(self, path):
+        with open(path, 'rb') as artifact:
+            while True:
+                chunk = artifact.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _write_through(self, chunks, path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        completed = False
+        try:
+            with open(temp_path, 'wb') as artifact:
+                for chunk in chunks:
+                    artifact.write(chunk)
+                    yield chunk
+            os.replace(temp_path, path)
+            completed = True
+            self._prune(path)
+        finally:
+            # A client that disconnects mid-download leaves no partial artifact.
+            if not completed and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _prune(self, path):
+        """Removes artifacts for other versions of the same plan and format."""
+        directory, name = os.path.split(path)
+        prefix, fmt = name.split('-v', 1)[0], os.path.splitext(name)[1]
+        for other in os.listdir(directory):
+            if other != name and other.startswith(prefix + '-v') and other.endswith(fmt):
+                try:
+                    os.remove(os.path.join(directory, other))
+                except OSError:
+                    pass
+
+
+# Singleton instance
+export_service = ExportService(Config.EXPORT_CACHE_DIR, chunk_size=Config.EXPORT_CHUNK_SIZE)
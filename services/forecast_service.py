@@ -0,0 +1,178 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import accumulate
+from config import Config
+
+UNIT_HOURS = {"hours": 1, "days": 24, "weeks": 168}
+DEFAULT_ESTIMATE = {"min": 1, "max": 1, "unit": "days"}
+
+
+def hours_per_day(value):
+    """A usable daily time limit from client input, or None (ignored) if invalid."""
+    if isinstance(value, bool):
+        return None
+    try:
+        hours = float(value)
+    except (TypeError, ValueError):
+        return None
+    return hours if 0 < hours <= 24 else None
+
+
+def step_hours(step, time_per_day=None):
+    """Calendar hours a step takes, from the midpoint of its time estimate.
+
+    With a daily time limit, an estimate in hours is spread over
+    hours / time_per_day days. Completed steps take no time.
+    """
+    if step.get('is_complete'):
+        return 0.0
+    estimate = step.get('time_estimate') or DEFAULT_ESTIMATE
+    average = (estimate.get('min', 1) + estimate.get('max', 1)) / 2
+    unit = estimate.get('unit')
+    time_per_day = hours_per_day(time_per_day)
+    if unit == 'hours' and time_per_day:
+        return average / time_per_day * 24
+    return average * UNIT_HOURS.get(unit, 24)
+
+
+class ForecastService:
+    """Computes plan timelines as offsets (in hours) from the time of the request.
+
+    Steps flagged `parallel_with_previous` share a group with the step before
+    them; a group lasts as long as its longest step and groups run one after
+    another, separated by FORECAST_STEP_GAP_HOURS. Offsets are cached per
+    (plan id, plan version), so a plan is only rescheduled after it changes.
+    """
+
+    def __init__(self, max_entries=1024, gap_hours=24):
+        self.max_entries = max_entries
+        self.gap_hours = gap_hours
+        self._offsets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def forecast(self, plan, now=None):
+        """Returns one entry per step with ISO start/end dates."""
+        now = now or datetime.now()
+        offsets = self._cached_offsets(plan)
+        return [
+            {
+                "step_id": step.get('id'),
+                "step_title": step.get('title'),
+                "start_date": (now + timedelta(hours=start)).isoformat(),
+                "end_date": (now + timedelta(hours=end)).isoformat(),
+                "effort": step.get('effort', 'medium'),
+                "is_milestone": step.get('is_milestone', False),
+                "is_complete": step.get('is_complete', False)
+            }
+            for step, (start, end) in zip(plan.get('steps', []), offsets)
+        ]
+
+    def forecast_many(self, plans, now=None):
+        """Forecasts several plans against the same reference time, keyed by plan id."""
+        now = now or datetime.now()
+        return {plan['id']: self.forecast(plan, now) for plan in plans}
+
+    def aggregate(self, plan):
+        """Precomputes the figures behind a plan's dashboard summary.
+
+        Times are stored as offsets in hours so the aggregate stays valid until
+        the plan changes; summarize() anchors them to the current time.
+        """
+        steps = plan.get('steps') or []
+        offsets = self._cached_offsets(plan)
+        time_per_day = (plan.get('constraints') or {}).get('time_per_day')
+        remaining = [
+            (step, end) for step, (start, end) in zip(steps, offsets) if not step.get('is_complete')
+        ]
+        milestone = next(((step, end) for step, end in remaining if step.get('is_milestone')), None)
+        completed = len(steps) - len(remaining)
+        return {
+            "plan_id": plan['id'],
+            "title": plan.get('title'),
+            "tags": plan.get('tags', []),
+            "total_steps": len(steps),
+            "completed_steps": completed,
+            "percent_complete": round(100 * completed / len(steps)) if steps else 0,
+            "remaining_effort_hours": sum(step_hours(step, time_per_day) for step, _ in remaining),
+            "finish_offset_hours": max((end for _, end in remaining), default=None),
+            "next_milestone": {
+                "step_id": milestone[0].get('id'),
+                "title": milestone[0].get('title'),
+                "offset_hours": milestone[1]
+            } if milestone else None
+        }
+
+    @staticmethod
+    def summarize(aggregate, now=None):
+        """Turns a stored aggregate into the dashboard summary for one plan."""
+        now = now or datetime.now()
+        finish = aggregate.get('finish_offset_hours')
+        milestone = aggregate.get('next_milestone')
+        return {
+            "id": aggregate['plan_id'],
+            "title": aggregate.get('title'),
+            "tags": aggregate.get('tags', []),
+            "percent_complete": aggregate.get('percent_complete', 0),
+            "completed_steps": aggregate.get('completed_steps', 0),
+            "total_steps": aggregate.get('total_steps', 0),
+            "remaining_effort_hours": round(aggregate.get('remaining_effort_hours', 0), 1),
+            "projected_end_date": (now + timedelta(hours=finish)).isoformat() if finish is not None else None,
+            "next_milestone": {
+                "step_id": milestone['step_id'],
+                "title": milestone['title'],
+                "due_date": (now + timedelta(hours=milestone['offset_hours'])).isoformat()
+            } if milestone else None
+        }
+
+    def invalidate(self, plan_id):
+        with self._lock:
+            for key in [key for key in self._offsets if key[0] == plan_id]:
+                del self._offsets[key]
+
+    def clear(self):
+        with self._lock:
+            self._offsets.clear()
+
+    def _cached_offsets(self, plan):
+        key = (plan.get('id'), plan.get('version'))
+        with self._lock:
+            offsets = self._offsets.get(key)
+            if offsets is not None:
+                self._offsets.move_to_end(key)
+                return offsets
+
+        offsets = self.schedule(plan.get('steps', []), (plan.get('constraints') or {}).get('time_per_day'))
+        with self._lock:
+            self._offsets[key] = offsets
+            self._offsets.move_to_end(key)
+            while len(self._offsets) > self.max_entries:
+                self._offsets.popitem(last=False)
+        return offsets
+
+    def schedule(self, steps, time_per_day=None):
+        """Returns (start, end) offsets in hours for each step."""
+        durations = [step_hours(step, time_per_day) for step in steps]
+
+        group_of = list(accumulate(
+            0 if index == 0 or step.get('parallel_with_previous') else 1
+            for index, step in enumerate(steps)
+        ))
+        group_hours = [0.0] * (group_of[-1] + 1 if group_of else 0)
+        for group, hours in zip(group_of, durations):
+            group_hours[group] = max(group_hours[group], hours)
+
+        # Finished groups take no time and leave no gap behind them.
+        spans = [hours + self.gap_hours if hours else 0.0 for hours in group_hours]
+        group_starts = [0.0] + list(accumulate(spans))[:-1]
+        return [
+            (group_starts[group], group_starts[group] + hours)
+            for group, hours in zip(group_of, durations)
+        ]
+
+
+# Singleton instance
+forecast_service = ForecastService(
+    max_entries=Config.FORECAST_CACHE_SIZE,
+    gap_hours=Config.FORECAST_STEP_GAP_HOURS
+)
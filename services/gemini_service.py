@@ -1,62 +1,320 @@
-import google.generativeai as genai
 import json
+import os
+import threading
+import time
 from config import Config
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from google.generativeai.types import Tool # <-- NEW IMPORT
+from .cache_service import response_cache
+from .metrics_service import metrics
+from .model_backend import create_model_backend
+from .model_executor import model_executor
+from .schemas import coerce, repair_json, validate
+from .semantic_cache import semantic_cache
+from .singleflight import single_flight
+
+MODEL_NAME = Config.GEMINI_MODEL
+
+# Stricter safety settings for JSON to avoid unwanted text
+JSON_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+}
 
 class GeminiService:
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not found in environment variables.")
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        
-        # --- THIS BLOCK IS NOW CORRECT ---
-        # Create the Tool object for Google Search
-        google_search_tool = Tool(
-            google_search_retrieval={}
+    """Gemini access for the app's services.
+
+    Nothing is set up at import time. The backend (real Gemini, or the local
+    fake selected by MODEL_BACKEND) is configured and the models are built on
+    first use in each process (and again after a fork), so gunicorn can preload
+    the app without sharing gRPC state between workers, and a missing API key
+    surfaces as an error on the first model call instead of at import.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._models = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_model_backend()
+        return self._backend
+
+    @property
+    def standard_model(self):
+        # Standard model for regular, non-research tasks
+        return self._model('standard', self.backend.standard_model)
+
+    @property
+    def research_model(self):
+        # Model enabled with the Google Search tool for RAG; only built once research is used.
+        return self._model('research', self.backend.research_model)
+
+    def warmup(self, research=False):
+        """Configures the SDK and builds the models ahead of the first request."""
+        try:
+            self.standard_model
+            if research:
+                self.research_model
+        except Exception as e:
+            print(f"Gemini warmup failed: {e}")
+
+    def _model(self, name, build):
+        self._ensure_configured()
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = build()
+        return model
+
+    def _ensure_configured(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.backend.configure()
+            # Models built by a parent process hold its connections; start over.
+            self._models = {}
+            self._pid = os.getpid()
+
+    def generate_json_response(self, prompt, cache_scope=None, preamble=None, schema=None, similar_to=None,
+                               prompt_name=None):
+        """Generates content and expects a clean JSON string back.
+
+        When `preamble` (a PromptTemplate) is given, `prompt` is only the dynamic
+        suffix and the template's static prefix is supplied as upstream context.
+        When `schema` is given, generation is constrained to it and the result is
+        validated against it. `similar_to` (the raw user inputs) lets a
+        near-duplicate earlier request answer this one; see SemanticCache.
+        `prompt_name` labels the call's metrics (default: the preamble's name,
+        then cache_scope).
+        """
+        generation_config = self.json_generation_config(schema)
+        cache_key = response_cache.make_key(
+            self._cache_model_name(), [], self._cache_prompt(prompt, preamble), JSON_SAFETY_SETTINGS, generation_config
         )
+        return self._dispatch(
+            cache_scope, cache_key,
+            lambda: self._generate_json(
+                prompt, preamble, schema, generation_config, self._prompt_label(prompt_name, preamble, cache_scope)
+            ),
+            similar_to
+        )
+
+    @staticmethod
+    def json_generation_config(schema=None):
+        generation_config = {"response_mime_type": "application/json"}
+        if schema is not None and Config.STRUCTURED_OUTPUT_ENABLED:
+            generation_config["response_schema"] = schema
+        return generation_config
 
-        # Model enabled with the Google Search tool for RAG
-        self.research_model = genai.GenerativeModel(
-            model_name='gemini-1.5-pro-latest',
-            tools=[google_search_tool] # <-- Use the Tool object
+    def generate_text_response(self, prompt, use_research_tool=False, cache_scope=None, similar_to=None,
+                               prompt_name=None):
+        """Generates a text response, with an option to use the research tool."""
+        tools = ['google_search_retrieval'] if use_research_tool else []
+        cache_key = response_cache.make_key(self._cache_model_name(), tools, prompt)
+        label = self._prompt_label(prompt_name, None, cache_scope)
+        return self._dispatch(
+            cache_scope, cache_key, lambda: self._generate_text(prompt, use_research_tool, label), similar_to
         )
-        
-        # Standard model for regular, non-research tasks
-        self.standard_model = genai.GenerativeModel('gemini-1.5-pro-latest')
 
-    def generate_json_response(self, prompt):
-        """Generates content and expects a clean JSON string back."""
+    def stream_text_response(self, prompt, use_research_tool=False, cache_scope=None, safety_settings=None,
+                             preamble=None, generation_config=None, similar_to=None, prompt_name=None):
+        """Yields the text response chunk by chunk as the model streams it.
+
+        Errors are raised to the consumer, since a partially sent stream cannot
+        be turned back into an error dict.
+        """
+        tools = ['google_search_retrieval'] if use_research_tool else []
+        cache_key = response_cache.make_key(
+            self._cache_model_name(), tools, self._cache_prompt(prompt, preamble), safety_settings, generation_config
+        )
+        use_cache = response_cache.is_enabled(cache_scope)
+        if use_cache:
+            cached = self._cache_lookup(cache_scope, cache_key)
+            if cached is not None:
+                yield cached
+                return
+        use_semantic = similar_to is not None and semantic_cache.is_enabled(cache_scope)
+        if use_semantic:
+            cached = self._semantic_lookup(cache_scope, similar_to)
+            if cached is not None:
+                yield cached
+                return
+
+        if use_research_tool:
+            model, contents = self.research_model, (preamble.render(prompt) if preamble else prompt)
+        else:
+            model, contents = self._model_and_contents(prompt, preamble)
+        parts = []
+        labels = {"kind": "stream", "prompt": self._prompt_label(prompt_name, preamble, cache_scope)}
+        started = time.perf_counter()
+        chunks = model_executor.stream(lambda request_options: model.generate_content(
+            contents, stream=True, safety_settings=safety_settings, generation_config=generation_config,
+            request_options=request_options
+        ))
+        chunk = None
+        for chunk in chunks:
+            text = self._chunk_text(chunk)
+            if text:
+                parts.append(text)
+                yield text
+        metrics.observe("model_call_duration_seconds", time.perf_counter() - started, **labels)
+        # Usage metadata arrives with the final chunk.
+        metrics.record_usage(chunk, **labels)
+
+        if use_cache:
+            response_cache.set(cache_key, "".join(parts).strip(), cache_scope)
+        if use_semantic:
+            semantic_cache.set(cache_scope, "".join(parts).strip(), *similar_to)
+
+    def _model_and_contents(self, prompt, preamble):
+        """Picks the model and request contents, attaching the preamble via context caching."""
+        if preamble is None:
+            return self.standard_model, prompt
+        if not Config.CONTEXT_CACHE_ENABLED:
+            return self.standard_model, preamble.render(prompt)
+        self._ensure_configured()
+        return self.backend.model_for(preamble), prompt
+
+    @staticmethod
+    def _cache_prompt(prompt, preamble):
+        # The prefix hash stands in for the (byte-identical) static preamble.
+        return f"{preamble.prefix_hash}\n{prompt}" if preamble is not None else prompt
+
+    def _cache_model_name(self):
+        # Keeps fake-backend responses out of the cache entries of the real model.
+        return MODEL_NAME if self.backend.name == 'gemini' else f"{self.backend.name}/{MODEL_NAME}"
+
+    @staticmethod
+    def _cache_lookup(cache_scope, cache_key):
+        cached = response_cache.get(cache_key, cache_scope)
+        metrics.inc("response_cache_requests_total", scope=cache_scope, result="miss" if cached is None else "hit")
+        return cached
+
+    @staticmethod
+    def _semantic_lookup(cache_scope, similar_to):
+        cached = semantic_cache.get(cache_scope, *similar_to)
+        metrics.inc("semantic_cache_requests_total", scope=cache_scope, result="miss" if cached is None else "hit")
+        return cached
+
+    @staticmethod
+    def _chunk_text(chunk):
+        """A streamed chunk's text; '' for chunks without text parts (the final,
+        safety or finish-reason chunk), where `.text` would raise ValueError."""
+        candidates = getattr(chunk, 'candidates', None)
+        if candidates is not None:
+            content = getattr(candidates[0], 'content', None) if candidates else None
+            if not getattr(content, 'parts', None):
+                return ""
         try:
-            # Use the standard model for structured JSON generation
-            response = self.standard_model.generate_content(
-                prompt,
-                # Stricter safety settings for JSON to avoid unwanted text
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                }
-            )
-            cleaned_text = response.text.strip().replace('```json', '').replace('```', '')
-            return json.loads(cleaned_text)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error decoding Gemini response: {e}")
-            # Check if response exists before accessing text attribute
-            raw_response_text = ""
-            if 'response' in locals() and hasattr(response, 'text'):
+            return chunk.text
+        except ValueError:
+            return ""
+
+    @staticmethod
+    def _prompt_label(prompt_name, preamble, cache_scope):
+        if prompt_name:
+            return prompt_name
+        if preamble is not None:
+            return preamble.name
+        return cache_scope or "adhoc"
+
+    def _dispatch(self, cache_scope, cache_key, produce, similar_to=None):
+        """Serves produce() through the response cache (when cache_scope has opted in),
+        then the near-duplicate cache (when `similar_to` inputs are given), and
+        coalesces identical in-flight calls onto a single upstream request."""
+        use_cache = response_cache.is_enabled(cache_scope)
+        if use_cache:
+            cached = self._cache_lookup(cache_scope, cache_key)
+            if cached is not None:
+                return cached
+        use_semantic = similar_to is not None and semantic_cache.is_enabled(cache_scope)
+        if use_semantic:
+            cached = self._semantic_lookup(cache_scope, similar_to)
+            if cached is not None:
+                return cached
+
+        def produce_and_store():
+            result = produce()
+            if not (isinstance(result, dict) and 'error' in result):
+                if use_cache:
+                    response_cache.set(cache_key, result, cache_scope)
+                if use_semantic:
+                    semantic_cache.set(cache_scope, result, *similar_to)
+            return result
+
+        if Config.SINGLE_FLIGHT_ENABLED:
+            return single_flight.do(cache_key, produce_and_store)
+        return produce_and_store()
+
+    def _generate_json(self, prompt, preamble=None, schema=None, generation_config=None, label="adhoc"):
+        # A response that cannot be parsed, repaired or validated is regenerated
+        # up to JSON_MAX_RETRIES times before giving up.
+        details = ""
+        labels = {"kind": "json", "prompt": label}
+        for attempt in range(Config.JSON_MAX_RETRIES + 1):
+            try:
+                # Use the standard model for structured JSON generation
+                model, contents = self._model_and_contents(prompt, preamble)
+                with metrics.timer("model_call_duration_seconds", **labels):
+                    response = model_executor.call(lambda request_options: model.generate_content(
+                        contents,
+                        safety_settings=JSON_SAFETY_SETTINGS,
+                        generation_config=generation_config,
+                        request_options=request_options
+                    ))
+                metrics.record_usage(response, **labels)
                 raw_response_text = response.text
+            except Exception as e:
+                print(f"Error generating JSON from Gemini: {e}")
+                return {"error": "Failed to generate or parse AI plan.", "details": str(e)}
+
+            with metrics.timer("json_parse_duration_seconds", prompt=labels["prompt"]):
+                data, details = self._parse_json(raw_response_text, schema)
+            metrics.inc("json_parse_total", prompt=labels["prompt"], outcome="ok" if details is None else "invalid")
+            if details is None:
+                return data
+            print(f"Error decoding Gemini response (attempt {attempt + 1}): {details}")
             print(f"Raw response was: {raw_response_text}")
-            return {"error": "Failed to generate or parse AI plan.", "details": str(e)}
+        return {"error": "Failed to generate or parse AI plan.", "details": details}
 
-    def generate_text_response(self, prompt, use_research_tool=False):
-        """Generates a text response, with an option to use the research tool."""
+    @staticmethod
+    def _parse_json(text, schema=None):
+        """Returns (data, None) on success or (None, problem description)."""
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                data = repair_json(text)
+            except json.JSONDecodeError as e:
+                return None, str(e)
+        if schema is None:
+            return data, None
+        data = coerce(data, schema)
+        errors = validate(data, schema)
+        if errors:
+            return None, "; ".join(errors[:5])
+        return data, None
+
+    def _generate_text(self, prompt, use_research_tool=False, label="adhoc"):
         try:
             model = self.research_model if use_research_tool else self.standard_model
-            response = model.generate_content(prompt)
+            labels = {"kind": "research" if use_research_tool else "text", "prompt": label}
+            with metrics.timer("model_call_duration_seconds", **labels):
+                response = model_executor.call(
+                    lambda request_options: model.generate_content(prompt, request_options=request_options)
+                )
+            metrics.record_usage(response, **labels)
             return response.text.strip()
         except Exception as e:
             print(f"Error generating text from Gemini: {e}")
             return {"error": "Failed to generate AI response.", "details": str(e)}
 
 # Singleton instance
-gemini_service = GeminiService()
\ No newline at end of file
+gemini_service = GeminiService()
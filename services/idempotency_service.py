@@ -0,0 +1,119 @@
+import hashlib
+import time
+from config import Config
+from .cache_service import ResponseCache
+from .singleflight import SingleFlight
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body."""
+
+
+class IdempotencyService:
+    """Makes retried requests that carry the same Idempotency-Key safe.
+
+    Records are scoped by user, route and key. The first request claims the
+    key with a compare-and-set on the record store and runs; a retry that arrives while it is still running attaches to it (in-process
+    via single-flight, across workers by polling the shared record), and a
+    retry after it finished gets the stored response back. Server errors
+    (5xx) are not stored, so a retry after a failure runs again. Records
+    expire after IDEMPOTENCY_TTL.
+    """
+
+    MAX_KEY_LENGTH = 255
+
+    def __init__(self, records, single_flight=None, pending_timeout=150, poll_interval=0.25):
+        self.records = records
+        self.single_flight = single_flight or SingleFlight()
+        self.pending_timeout = pending_timeout
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def fingerprint(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def run(self, user_id, route, key, fingerprint, fn):
+        """Returns (body, status_code, headers, replayed) for fn() -> (body, status_code, headers).
+
+        Raises IdempotencyConflict if the key was used with a different fingerprint.
+        """
+        record_key = self.fingerprint(user_id, route, key)
+        leader = []
+        body, status_code, headers = self.single_flight.do(
+            record_key, lambda: self._run_once(record_key, fingerprint, fn, leader)
+        )
+        return body, status_code, headers, not leader
+
+    def _run_once(self, record_key, fingerprint, fn, leader):
+        """Replays the stored response, or claims the key and runs fn().
+
+        The record is (re-)read here, inside the single-flight, so a request that
+        finished just before this one arrived is replayed rather than run again.
+        """
+        while True:
+            record = self._get(record_key, fingerprint)
+            if record is not None and record['state'] == 'pending' and not self._stale(record):
+                record = self._wait(record_key, fingerprint, record)
+            if record is not None and record['state'] == 'done':
+                return record['body'], record['status'], record['headers']
+            # Absent, failed or abandoned: claim it. Only one worker's swap succeeds;
+            # the others go round again and wait for it.
+            pending = {"state": "pending", "fingerprint": fingerprint, "started_at": time.time()}
+            if self.records.compare_and_set(record_key, record, pending, 'idempotency'):
+                leader.append(True)
+                return self._execute(record_key, fingerprint, fn)
+
+    def _get(self, record_key, fingerprint):
+        record = self.records.get(record_key, 'idempotency')
+        if record is not None and record['fingerprint'] != fingerprint:
+            raise IdempotencyConflict()
+        return record
+
+    def _stale(self, record):
+        # The producing worker died (or is far past any model deadline).
+        return time.time() - record['started_at'] > self.pending_timeout
+
+    def _wait(self, record_key, fingerprint, record):
+        """Polls a record that another worker is producing until it completes or goes stale."""
+        while record is not None and record['state'] == 'pending' and not self._stale(record):
+            time.sleep(self.poll_interval)
+            record = self._get(record_key, fingerprint)
+        return record
+
+    def _execute(self, record_key, fingerprint, fn):
+        try:
+            body, status_code, headers = fn()
+        except Exception:
+            self._finish(record_key, {"state": "failed", "fingerprint": fingerprint})
+            raise
+        if status_code >= 500:
+            self._finish(record_key, {"state": "failed", "fingerprint": fingerprint})
+        else:
+            self._finish(record_key, {
+                "state": "done", "fingerprint": fingerprint,
+                "status": status_code, "body": body, "headers": headers
+            })
+        return body, status_code, headers
+
+    def _finish(self, record_key, record):
+        self.records.set(record_key, record, 'idempotency')
+
+
+def create_record_store():
+    if Config.IDEMPOTENCY_BACKEND == 'sqlite':
+        # No in-process tier: a pending record must be re-read from the shared
+        # store to see another worker finish it.
+        return ResponseCache(max_entries=0, ttl=Config.IDEMPOTENCY_TTL,
+                             shared_path=Config.IDEMPOTENCY_PATH, scopes=['idempotency'])
+    return ResponseCache(max_entries=Config.IDEMPOTENCY_MAX_ENTRIES, ttl=Config.IDEMPOTENCY_TTL,
+                         scopes=['idempotency'])
+
+# Singleton instance
+idempotency_service = IdempotencyService(
+    create_record_store(),
+    pending_timeout=Config.MODEL_TOTAL_DEADLINE + 30
+)
@@ -0,0 +1,217 @@
+import ipaddress
+import json
+import os
+import socket
+import threading
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from config import Config
+from .sqlite_support import SQLiteDatabase
+
+JOB_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated_at);
+"""
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def prune(self, cutoff):
+        with self._lock:
+            for job_id in [j['id'] for j in self._jobs.values() if j['updated_at'] < cutoff]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job records shared by all workers, so any worker can answer a status poll."""
+
+    def __init__(self, path):
+        self._db = SQLiteDatabase(path, JOB_STORE_SCHEMA)
+
+    def get(self, job_id):
+        row = self._db.connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def save(self, job):
+        self._db.connection().execute(
+            "INSERT OR REPLACE INTO jobs (id, user_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            (job['id'], job['user_id'], json.dumps(job), job['updated_at'])
+        )
+
+    def prune(self, cutoff):
+        self._db.connection().execute("DELETE FROM jobs WHERE updated_at < ?", (cutoff,))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could point the callback at an internal address.
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class JobService:
+    """Runs slow model-backed work off the request path.
+
+    Work is executed by a per-process thread pool; job records (status and the
+    final result) are kept in the job store for polling, and optionally POSTed to
+    a client callback URL when the job finishes. Records that stay queued or
+    running past `deadline` are reported as failed when read.
+    """
+
+    def __init__(self, store, max_workers=4, callback_timeout=10, retention=86400, deadline=600,
+                 allowed_callback_hosts=None):
+        self.store = store
+        self.max_workers = max_workers
+        self.callback_timeout = callback_timeout
+        self.retention = retention
+        self.deadline = deadline
+        self.allowed_callback_hosts = set(allowed_callback_hosts or [])
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, kind, work, callback_url=None):
+        """Queues work() -> (result, status_code) and returns the new job record."""
+        now = utc_now()
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "kind": kind,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now
+        }
+        self.store.save(job)
+        self.store.prune((datetime.now(timezone.utc) - timedelta(seconds=self.retention)).isoformat())
+        self._pool().submit(self._run, job, work, callback_url)
+        return job
+
+    def get_job(self, job_id):
+        job = self.store.get(job_id)
+        if job and job['status'] in ('queued', 'running') and job['updated_at'] < self._deadline_cutoff():
+            self._update(job, status="failed", status_code=504, result={
+                "error": "Job did not finish in time.",
+                "details": f"No progress for {self.deadline} seconds; the worker running it stopped."
+            })
+        return job
+
+    def callback_url_error(self, callback_url):
+        """Returns why callback_url may not be used, or None if it is acceptable.
+
+        Only http(s) URLs are accepted, and the host must be in the allow-list
+        or, without one, resolve exclusively to public addresses.
+        """
+        if not isinstance(callback_url, str):
+            return "'callback_url' must be an http(s) URL"
+        parsed = urllib.parse.urlsplit(callback_url)
+        host = (parsed.hostname or '').lower()
+        if parsed.scheme not in ('http', 'https') or not host:
+            return "'callback_url' must be an http(s) URL"
+        if self.allowed_callback_hosts:
+            if host not in self.allowed_callback_hosts:
+                return "'callback_url' host is not allowed"
+            return None
+        try:
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+        except (OSError, ValueError):
+            return "'callback_url' host could not be resolved"
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                return "'callback_url' must point to a public host"
+        return None
+
+    def _deadline_cutoff(self):
+        return (datetime.now(timezone.utc) - timedelta(seconds=self.deadline)).isoformat()
+
+    def _pool(self):
+        # Thread pools do not survive fork, so each worker process builds its own.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, job, work, callback_url):
+        stored = self.store.get(job['id'])
+        if stored is not None and stored['status'] == 'failed':
+            return  # Waited in the queue past the deadline and was already reported as failed.
+        self._update(job, status="running")
+        try:
+            result, status_code = work()
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) crashed: {e}")
+            result, status_code = {"error": "Job failed unexpectedly.", "details": str(e)}, 500
+
+        self._update(
+            job,
+            status="succeeded" if status_code < 400 else "failed",
+            status_code=status_code,
+            result=result
+        )
+        if callback_url:
+            self._send_callback(job, callback_url)
+
+    def _update(self, job, **changes):
+        job.update(changes, updated_at=utc_now())
+        self.store.save(job)
+
+    def _send_callback(self, job, callback_url):
+        # Checked again at send time: the host may resolve differently by now.
+        error = self.callback_url_error(callback_url)
+        if error:
+            print(f"Callback for job {job['id']} to {callback_url} dropped: {error}")
+            return
+        try:
+            request = urllib.request.Request(
+                callback_url,
+                data=json.dumps(job).encode('utf-8'),
+                headers={"Content-Type": "application/json"},
+                method="POST"
+            )
+            with urllib.request.build_opener(_NoRedirect).open(request, timeout=self.callback_timeout):
+                pass
+        except Exception as e:
+            print(f"Callback for job {job['id']} to {callback_url} failed: {e}")
+
+
+def create_job_store():
+    if Config.JOB_STORE_BACKEND == 'sqlite':
+        return SQLiteJobStore(Config.JOB_STORE_PATH)
+    return MemoryJobStore()
+
+# Singleton instance
+job_service = JobService(
+    create_job_store(),
+    max_workers=Config.JOB_WORKERS,
+    callback_timeout=Config.JOB_CALLBACK_TIMEOUT,
+    retention=Config.JOB_RETENTION,
+    deadline=Config.JOB_DEADLINE,
+    allowed_callback_hosts=Config.JOB_CALLBACK_ALLOWED_HOSTS
+)
@@ -0,0 +1,257 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from config import Config
+
+METRIC_PREFIX = "schematiq_"
+
+# Latency histogram bucket bounds, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Histograms whose time also counts towards a request's Server-Timing phases.
+SERVER_TIMING_PHASES = {
+    "model_call_duration_seconds": "model",
+    "prompt_build_duration_seconds": "prompt",
+    "plan_serialize_duration_seconds": "serialize",
+    "json_parse_duration_seconds": "parse",
+}
+
+HELP = {
+    "http_request_duration_seconds": "Time to build each response, by route.",
+    "model_call_duration_seconds": "Upstream model call latency, including retries.",
+    "model_tokens_total": "Prompt and response tokens reported by the model's usage metadata.",
+    "prompt_build_duration_seconds": "Time spent building prompts, by PromptLibrary builder.",
+    "plan_serialize_duration_seconds": "Time spent serializing plans for prompts.",
+    "json_parse_duration_seconds": "Time spent parsing, repairing and validating model JSON.",
+    "json_parse_total": "Model JSON responses by parse outcome.",
+    "response_cache_requests_total": "Response cache lookups by scope and result.",
+    "semantic_cache_requests_total": "Near-duplicate cache lookups by scope and result.",
+}
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, shared across gunicorn workers via files.
+
+    Each process periodically writes a snapshot of its own metrics to
+    METRICS_DIR/metrics-<pid>-<start time>.json; collect() merges every
+    snapshot in the directory, so /metrics reports the whole server no matter
+    which worker answers. Snapshots of exited workers are kept (a reused pid
+    gets a new file), keeping counters monotonic.
+    """
+
+    def __init__(self, snapshot_dir=None, flush_interval=5.0, buckets=DEFAULT_BUCKETS, clock=time.monotonic):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._reset()
+
+    # --- recording ---
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _label_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+        phase = SERVER_TIMING_PHASES.get(name)
+        timings = getattr(self._local, 'timings', None)
+        if phase is not None and timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + value
+        self._maybe_flush()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of timer()."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_usage(self, response, **labels):
+        """Counts tokens from a model response's usage_metadata, when present."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        for direction, field in (("prompt", "prompt_token_count"), ("response", "candidates_token_count")):
+            count = getattr(usage, field, None)
+            if count:
+                self.inc("model_tokens_total", count, direction=direction, **labels)
+
+    # --- per-request timing ---
+
+    def start_request(self):
+        """Starts collecting Server-Timing phases for the current thread's request."""
+        self._local.timings = {}
+
+    def finish_request(self):
+        """Returns {phase: seconds} collected since start_request()."""
+        timings = getattr(self._local, 'timings', None) or {}
+        self._local.timings = None
+        return timings
+
+    # --- export ---
+
+    def snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                "counters": [[name, list(map(list, labels)), value]
+                             for (name, labels), value in self._counters.items()],
+                "histograms": [[name, list(map(list, labels)), dict(h, buckets=list(h["buckets"]))]
+                               for (name, labels), h in self._histograms.items()],
+            }
+
+    def flush(self):
+        if not self.snapshot_dir:
+            return
+        # One writer per process at a time; a concurrent flush would write the same data.
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        temp_path = None
+        try:
+            self._last_flush = self._clock()
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            snapshot = self.snapshot()
+            descriptor, temp_path = tempfile.mkstemp(dir=self.snapshot_dir, prefix=".metrics-", suffix=".tmp")
+            with os.fdopen(descriptor, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temp_path, self._snapshot_path())
+            temp_path = None
+        except OSError as e:
+            print(f"Could not write metrics snapshot: {e}")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            self._flush_lock.release()
+
+    def collect(self):
+        """Merges this process's live metrics with the other workers' snapshots."""
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir:
+            own_path = self._snapshot_path()
+            for path in glob.glob(os.path.join(self.snapshot_dir, "metrics-*.json")):
+                if path == own_path:
+                    continue
+                try:
+                    with open(path) as snapshot_file:
+                        snapshots.append(json.load(snapshot_file))
+                except (OSError, ValueError):
+                    continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get("counters", []):
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, histogram in snapshot.get("histograms", []):
+                if len(histogram["buckets"]) != len(self.buckets):
+                    continue
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], histogram["buckets"])]
+                merged["sum"] += histogram["sum"]
+                merged["count"] += histogram["count"]
+        return counters, histograms
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.extend(self._header(name, "counter"))
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{self._labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.extend(self._header(name, "histogram"))
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{self._labels(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{self._labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{self._labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    # --- internals ---
+
+    def _reset(self):
+        self._counters = {}
+        self._histograms = {}
+        self._pid = os.getpid()
+        self._started_ms = int(time.time() * 1000)
+        self._last_flush = self._clock()
+
+    def _check_pid(self):
+        # A forked worker starts from zero rather than re-reporting its parent's counts.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _maybe_flush(self):
+        if self.snapshot_dir and self._clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _snapshot_path(self):
+        return os.path.join(self.snapshot_dir, f"metrics-{self._pid}-{self._started_ms}.json")
+
+    @staticmethod
+    def _header(name, metric_type):
+        lines = [f"# HELP {METRIC_PREFIX}{name} {HELP[name]}"] if name in HELP else []
+        return lines + [f"# TYPE {METRIC_PREFIX}{name} {metric_type}"]
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+# Singleton instance
+metrics = MetricsRegistry(
+    snapshot_dir=Config.METRICS_DIR,
+    flush_interval=Config.METRICS_FLUSH_INTERVAL
+)
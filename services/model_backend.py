@@ -0,0 +1,189 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import google.generativeai as genai
+from config import Config
+from google.generativeai.types import Tool
+from .context_cache import context_cache
+
+FAKE_WORDS = (
+    "plan research outline draft review launch audience budget schedule prototype feedback "
+    "measure iterate publish contact outreach template checklist milestone content workflow "
+    "validate customers pricing landing page newsletter automate analytics partner polish"
+).split()
+
+
+class GeminiBackend:
+    """Builds real Gemini models. Requires GEMINI_API_KEY."""
+
+    name = "gemini"
+
+    def configure(self):
+        if not Config.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY not found in environment variables.")
+        genai.configure(api_key=Config.GEMINI_API_KEY)
+
+    def standard_model(self):
+        return genai.GenerativeModel(Config.GEMINI_MODEL)
+
+    def research_model(self):
+        return genai.GenerativeModel(
+            model_name=Config.GEMINI_MODEL,
+            tools=[Tool(google_search_retrieval={})]
+        )
+
+    def model_for(self, template):
+        """A model that carries template.prefix as upstream context."""
+        return context_cache.model_for(template)
+
+
+class _FakeUsage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+
+class _FakeResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel; see FakeBackend."""
+
+    def __init__(self, backend, system_instruction=None):
+        self._backend = backend
+        self._system_instruction = system_instruction
+
+    def generate_content(self, contents, stream=False, safety_settings=None, generation_config=None,
+                         request_options=None):
+        prompt = f"{self._system_instruction or ''}\n{contents}"
+        rng = random.Random(f"{self._backend.seed}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}")
+        latency, malformed = self._backend.next_call()
+        text = self._backend.response_text(rng, generation_config or {}, malformed)
+        usage = _FakeUsage(len(prompt) // 4 + 1, len(text) // 4 + 1)
+        if stream:
+            return self._stream(text, latency, usage)
+        time.sleep(latency)
+        return _FakeResponse(text, usage)
+
+    def _stream(self, text, latency, usage):
+        time.sleep(latency)
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        for index, token in enumerate(tokens):
+            if self._backend.token_delay:
+                time.sleep(self._backend.token_delay)
+            yield _FakeResponse(token, usage if index == len(tokens) - 1 else None)
+
+
+class FakeBackend:
+    """Deterministic local stand-in for Gemini, for development and benchmarks.
+
+    Content is derived from a hash of the prompt and FAKE_MODEL_SEED, so the
+    same request always gets the same answer; JSON requests with a
+    response_schema get schema-shaped data. Latencies (lognormal around a
+    median) and which JSON responses are deliberately malformed, to exercise
+    the repair/retry path, come from one seeded sequence per process, so a
+    retried call can succeed. Streamed responses arrive roughly one token
+    (four characters) at a time.
+    """
+
+    name = "fake"
+
+    def __init__(self, seed=0, latency_median=0.8, latency_sigma=0.5, token_delay=0.005, malformed_rate=0.0):
+        self.seed = seed
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.token_delay = token_delay
+        self.malformed_rate = malformed_rate
+        self._calls = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def configure(self):
+        pass
+
+    def standard_model(self):
+        return FakeModel(self)
+
+    def research_model(self):
+        return FakeModel(self)
+
+    def model_for(self, template):
+        return FakeModel(self, system_instruction=template.prefix)
+
+    def next_call(self):
+        """Returns (latency in seconds, malformed?) for the next model call."""
+        with self._lock:
+            latency = max(self.latency_median, 0.0)
+            if latency and self.latency_sigma:
+                latency *= self._calls.lognormvariate(0, self.latency_sigma)
+            return latency, self._calls.random() < self.malformed_rate
+
+    def response_text(self, rng, generation_config, malformed=False):
+        if generation_config.get("response_mime_type") != "application/json":
+            return " ".join(self._sentence(rng) for _ in range(rng.randint(2, 5)))
+        schema = generation_config.get("response_schema")
+        data = self._from_schema(rng, schema, counter=[0]) if schema else {"result": self._sentence(rng)}
+        text = json.dumps(data)
+        if malformed:
+            text = self._malform(rng, text)
+        return text
+
+    def _from_schema(self, rng, schema, counter, key=None):
+        schema_type = schema.get("type", "").upper()
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        if schema_type == "OBJECT":
+            data = {
+                name: self._from_schema(rng, sub_schema, counter, key=name)
+                for name, sub_schema in schema.get("properties", {}).items()
+                if name in schema.get("required", []) or rng.random() < 0.8
+            }
+            if isinstance(data.get("min"), (int, float)) and isinstance(data.get("max"), (int, float)):
+                data["min"], data["max"] = sorted((data["min"], data["max"]))
+            return data
+        if schema_type == "ARRAY":
+            count = rng.randint(4, 8) if key == "steps" or key is None else rng.randint(1, 3)
+            return [self._from_schema(rng, schema.get("items", {}), counter) for _ in range(count)]
+        if schema_type in ("NUMBER", "INTEGER"):
+            return rng.randint(1, 5)
+        if schema_type == "BOOLEAN":
+            return False if key == "is_complete" else rng.random() < 0.2
+        if key == "id":
+            counter[0] += 1
+            return f"step_{counter[0]}"
+        if key == "link":
+            return f"https://example.com/{rng.choice(FAKE_WORDS)}"
+        return self._sentence(rng, max_words=6 if key in ("title", "name") else 14)
+
+    @staticmethod
+    def _sentence(rng, max_words=14):
+        words = [rng.choice(FAKE_WORDS) for _ in range(rng.randint(3, max_words))]
+        return " ".join(words).capitalize() + "."
+
+    @staticmethod
+    def _malform(rng, text):
+        kind = rng.choice(("truncate", "fence", "trailing_comma", "garbage"))
+        if kind == "truncate":
+            return text[:max(1, int(len(text) * rng.uniform(0.5, 0.95)))]
+        if kind == "fence":
+            return f"Here is the JSON you asked for:\n```json\n{text}\n```"
+        if kind == "trailing_comma":
+            return text[:-1] + "," + text[-1]
+        return "I'm sorry, I can't produce that right now."
+
+
+def create_model_backend():
+    if Config.MODEL_BACKEND == 'fake':
+        return FakeBackend(
+            seed=Config.FAKE_MODEL_SEED,
+            latency_median=Config.FAKE_MODEL_LATENCY_MS / 1000,
+            latency_sigma=Config.FAKE_MODEL_LATENCY_SIGMA,
+            token_delay=Config.FAKE_MODEL_TOKEN_DELAY_MS / 1000,
+            malformed_rate=Config.FAKE_MODEL_MALFORMED_RATE
+        )
+    return GeminiBackend()
@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from google.api_core import exceptions as google_exceptions
+from config import Config
+
+# Errors worth retrying: quota, overload, transient server failures and timeouts.
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when a model call is rejected without reaching the upstream."""
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and fails fast until reset_timeout
+    has passed, then lets a single trial call through (half-open)."""
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+
+class ModelCallExecutor:
+    """Runs upstream model calls with a concurrency limit, per-call deadlines,
+    jittered exponential backoff and a circuit breaker.
+
+    Calls are passed as functions taking the SDK `request_options` dict, so the
+    executor works the same against Gemini or a local fake model.
+    """
+
+    def __init__(self, max_concurrency, queue_timeout, call_timeout, total_deadline,
+                 max_retries, backoff_base, backoff_max, breaker, sleep=time.sleep):
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.total_deadline = total_deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._sleep = sleep
+
+    def call(self, fn):
+        """Returns fn(request_options), retrying retryable errors until the deadline."""
+        with self._slot():
+            return self._attempt(fn)
+
+    def stream(self, start):
+        """Yields the chunks of the stream returned by start(request_options).
+
+        Only opening the stream is retried; once chunks have been delivered an
+        error is passed straight to the consumer. The concurrency slot is held
+        until the stream is exhausted or closed.
+        """
+        with self._slot():
+            chunks = self._attempt(start)
+            try:
+                for chunk in chunks:
+                    yield chunk
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                raise
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @contextmanager
+    def _slot(self):
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            raise UpstreamUnavailableError("Too many concurrent model calls; try again shortly.")
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def _attempt(self, fn):
+        deadline = time.monotonic() + self.total_deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise UpstreamUnavailableError("Model upstream is unhealthy; failing fast.")
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn({"timeout": max(1.0, min(self.call_timeout, remaining))})
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                delay = self.backoff(attempt)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                print(f"Retryable model error ({e}); retry {attempt} in {delay:.2f}s")
+                self._sleep(delay)
+                continue
+            except Exception:
+                # The upstream answered (e.g. an invalid request), so it is healthy.
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+
+# Singleton instance
+model_executor = ModelCallExecutor(
+    max_concurrency=Config.MODEL_MAX_CONCURRENCY,
+    queue_timeout=Config.MODEL_QUEUE_TIMEOUT,
+    call_timeout=Config.MODEL_CALL_TIMEOUT,
+    total_deadline=Config.MODEL_TOTAL_DEADLINE,
+    max_retries=Config.MODEL_MAX_RETRIES,
+    backoff_base=Config.MODEL_BACKOFF_BASE,
+    backoff_max=Config.MODEL_BACKOFF_MAX,
+    breaker=CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT),
+)
@@ -1,23 +1,78 @@
-from .gemini_service import gemini_service
-from prompts import PromptLibrary
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+from .forecast_service import forecast_service, hours_per_day
+from .gemini_service import gemini_service, JSON_SAFETY_SETTINGS
+from .plan_store import VersionConflict, plan_store
+from .schemas import MICRO_STEPS_SCHEMA, PLAN_SCHEMA, STEP_LIST_SCHEMA, micro_steps_batch_schema
+from .stream_json import StepStreamParser
+from prompts import PromptLibrary, PlanPromptSerializer
 import uuid
 
-# Mock database
-from config import Config
-db = Config.DATABASE
+PLAN_CONFLICT_ERROR = {
+    "error": "Plan was changed by another request.",
+    "details": "Reload the plan and try again."
+}
 
 class PlanService:
     def get_user_plans(self, user_id):
-        return [plan for plan in db['plans'].values() if plan.get('user_id') == user_id]
+        return plan_store.list_by_user(user_id)
+
+    def list_user_plans(self, user_id, limit, cursor=None, tag=None, view='summary'):
+        try:
+            plans, next_cursor = plan_store.list_page(
+                user_id, limit, cursor=cursor, tag=tag, summary=(view != 'full')
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return {"plans": plans, "next_cursor": next_cursor}, 200
+
+    def get_plan_summaries(self, user_id, plan_ids=None, tag=None):
+        """Forecast and progress summaries for a user's plans, from their stored aggregates."""
+        now = datetime.now()
+        summaries = []
+        for plan_id, aggregate in plan_store.list_aggregates(user_id, plan_ids, tag):
+            if aggregate is None:
+                # Missing or stale (e.g. seeded plans, or a write that skipped PlanService).
+                aggregate = self._plan_changed(plan_store.get(plan_id))
+            summaries.append(forecast_service.summarize(aggregate, now))
+        return {"plans": summaries}, 200
+
+    def _plan_changed(self, plan):
+        """Drops the plan's cached forecast and refreshes its precomputed aggregate."""
+        forecast_service.invalidate(plan['id'])
+        aggregate = forecast_service.aggregate(plan)
+        plan_store.save_aggregate(plan['id'], plan.get('version'), aggregate)
+        return aggregate
 
     def create_new_plan(self, user_id, user_input, mode, extras=None):
-        prompt = PromptLibrary.generate_base_plan(user_input, mode, extras)
-        plan_data_json = gemini_service.generate_json_response(prompt)
+        template, suffix = PromptLibrary.generate_base_plan_parts(user_input, mode, extras)
+        plan_data_json = gemini_service.generate_json_response(suffix, preamble=template, schema=PLAN_SCHEMA)
         
         if isinstance(plan_data_json, dict) and 'error' in plan_data_json:
             return plan_data_json
 
-        plan_id = plan_data_json.get('id', str(uuid.uuid4()))
+        return self._save_generated_plan(user_id, user_input, mode, plan_data_json, extras)
+
+    def stream_new_plan(self, user_id, user_input, mode, extras=None):
+        """Yields ('step', step) for each step as soon as the model finishes it,
+        then ('plan', plan) once the complete plan has been stored."""
+        template, suffix = PromptLibrary.generate_base_plan_parts(user_input, mode, extras)
+        parser = StepStreamParser()
+        chunks = gemini_service.stream_text_response(
+            suffix, safety_settings=JSON_SAFETY_SETTINGS, preamble=template,
+            generation_config=gemini_service.json_generation_config(PLAN_SCHEMA)
+        )
+        for chunk in chunks:
+            for step in parser.feed(chunk):
+                yield 'step', step
+
+        plan_data_json = parser.result()
+        yield 'plan', self._save_generated_plan(user_id, user_input, mode, plan_data_json, extras)
+
+    def _save_generated_plan(self, user_id, user_input, mode, plan_data_json, extras=None):
+        # Ids are always assigned here; model-supplied ones are placeholders like "unique_plan_id_1".
+        plan_id = str(uuid.uuid4())
         
         metadata_source = plan_data_json
         if 'steps' in plan_data_json and isinstance(plan_data_json['steps'], dict):
@@ -35,89 +90,246 @@ class PlanService:
             "estimated_duration": metadata_source.get('estimated_duration'),
             "budget_level": metadata_source.get('budget_level'),
             "tags": metadata_source.get('tags', []),
-            "steps": steps_list if isinstance(steps_list, list) else [],
+            "steps": self._unique_step_ids(steps_list) if isinstance(steps_list, list) else [],
+            "constraints": self._clean_constraints((extras or {}).get('constraints')),
             "created_at": "timestamp_placeholder"
         }
         
-        db['plans'][plan_id] = new_plan
+        plan_store.save(new_plan)
+        self._plan_changed(new_plan)
         return new_plan
         
+    @staticmethod
+    def _clean_constraints(constraints):
+        """Stored constraints, with time_per_day as a positive number of hours or dropped."""
+        if not isinstance(constraints, dict):
+            return {}
+        constraints = dict(constraints)
+        if 'time_per_day' in constraints:
+            time_per_day = hours_per_day(constraints.pop('time_per_day'))
+            if time_per_day is not None:
+                constraints['time_per_day'] = time_per_day
+        return constraints
+
     def toggle_step_status(self, plan_id, step_id):
-        plan = db['plans'].get(plan_id)
-        if not plan:
+        if plan_store.get_owner(plan_id) is None:
             return {"error": "Plan not found"}, 404
 
-        step_found = False
-        for step in plan.get('steps', []):
-            # Add a check to ensure we're dealing with a dictionary
-            if isinstance(step, dict) and step.get('id') == step_id:
-                step['is_complete'] = not step.get('is_complete', False)
-                step_found = True
-                break
-        
-        if not step_found:
+        def toggle(step):
+            step['is_complete'] = not step.get('is_complete', False)
+
+        try:
+            found = plan_store.update_step(plan_id, step_id, toggle)
+        except VersionConflict:
+            return PLAN_CONFLICT_ERROR, 409
+        if found is None:
             return {"error": "Step not found"}, 404
-        
+
+        plan = plan_store.get(plan_id)
+        self._plan_changed(plan)
         return plan, 200
 
-    def get_dynamic_replan(self, plan_id, step_id, outcome, reason=None):
-        plan = db['plans'].get(plan_id)
+    def get_dynamic_replan(self, plan_id, step_id, outcome, reason=None, mode=None):
+        plan = plan_store.get(plan_id)
         if not plan:
             return {"error": "Plan not found"}, 404
 
-        import json
-        plan_json_str = json.dumps(plan, indent=2)
-
-        completed_step_title = ""
-        for step in plan['steps']:
-            if step['id'] == step_id:
-                completed_step_title = step['title']
-                break
+        found = plan_store.get_step(plan_id, step_id)
+        completed_step_title = found[1].get('title', "") if found else ""
         
         if not completed_step_title:
             return {"error": "Step to replan from not found"}, 404
-        
-        prompt = PromptLibrary.replan_based_on_outcome(plan_json_str, completed_step_title, outcome, reason)
-        ai_response = gemini_service.generate_json_response(prompt)
+
+        position = found[0]
+        if (mode or Config.REPLAN_MODE) == 'differential':
+            return self._differential_replan(plan, position, outcome, reason)
+
+        plan_json_str = PlanPromptSerializer.serialize(plan, 'replan')
+        template, suffix = PromptLibrary.replan_based_on_outcome_parts(plan_json_str, completed_step_title, outcome, reason)
+        validated_new_steps, error = self._request_replan_steps(template, suffix)
+        if error:
+            return error, 500
+
+        plan['steps'][position]['is_complete'] = True
+        new_plan_steps = [step for step in plan['steps'] if isinstance(step, dict) and step.get('is_complete')]
+
+        new_plan_steps.extend(self._with_fresh_ids(validated_new_steps))
+        plan['steps'] = new_plan_steps
+        return self._save_replan(plan)
+
+    def _differential_replan(self, plan, position, outcome, reason=None):
+        """Regenerates only the incomplete steps affected by the step at `position`
+        and puts each back in the place of the step it replaces, leaving every other
+        step (and its id) untouched.
+
+        Affected steps need not be contiguous. If the model returns fewer steps
+        than it was given, the leftover affected positions are dropped; extra steps
+        follow the last regenerated one."""
+        steps = plan['steps']
+        changed_step = steps[position]
+        affected = self._affected_positions(steps, position)
+        if not affected:
+            # Nothing incomplete follows the step; just record its outcome.
+            changed_step['is_complete'] = True
+            return self._save_replan(plan)
+
+        outline_json = PlanPromptSerializer.serialize_outline(plan, exclude_positions=set(affected))
+        slice_json = PlanPromptSerializer.serialize_steps([steps[i] for i in affected], 'replan')
+        template, suffix = PromptLibrary.replan_slice_parts(
+            outline_json, slice_json, changed_step['title'], outcome, reason
+        )
+        new_slice, error = self._request_replan_steps(template, suffix)
+        if error:
+            return error, 500
+
+        changed_step['is_complete'] = True
+        new_slice = self._with_fresh_ids(new_slice)
+        replacements = {index: [step] for index, step in zip(affected, new_slice)}
+        last = affected[min(len(affected), len(new_slice)) - 1] if new_slice else None
+        if last is not None:
+            replacements[last].extend(new_slice[len(affected):])
+        new_plan_steps = []
+        for index, step in enumerate(steps):
+            if index in replacements:
+                new_plan_steps.extend(replacements[index])
+            elif index not in affected:
+                new_plan_steps.append(step)
+
+        plan['steps'] = new_plan_steps
+        return self._save_replan(plan)
+
+    def _save_replan(self, plan):
+        try:
+            plan_store.save(plan)
+        except VersionConflict:
+            return PLAN_CONFLICT_ERROR, 409
+        self._plan_changed(plan)
+        return plan, 200
+
+    @staticmethod
+    def _unique_step_ids(steps):
+        """Model-generated steps with any repeated id replaced by a server-assigned one."""
+        seen = set()
+        unique = []
+        for step in steps:
+            if isinstance(step, dict) and step.get('id') is not None:
+                if str(step['id']) in seen:
+                    step = dict(step, id=str(uuid.uuid4()))
+                seen.add(str(step['id']))
+            unique.append(step)
+        return unique
+
+    @staticmethod
+    def _with_fresh_ids(steps):
+        """Model-generated steps with server-assigned ids; the model reuses ids like
+        "step_1" that would collide with the steps kept in the plan."""
+        return [dict(step, id=str(uuid.uuid4())) if isinstance(step, dict) else step for step in steps]
+
+    @staticmethod
+    def _affected_positions(steps, position):
+        """Incomplete steps after `position` that its outcome can affect: the next
+        REPLAN_WINDOW of them, plus any later step in the same category."""
+        category = steps[position].get('category')
+        affected = []
+        upcoming = 0
+        for index in range(position + 1, len(steps)):
+            step = steps[index]
+            if not isinstance(step, dict) or step.get('is_complete'):
+                continue
+            upcoming += 1
+            if upcoming <= Config.REPLAN_WINDOW or (category and step.get('category') == category):
+                affected.append(index)
+        return affected
+
+    @staticmethod
+    def _request_replan_steps(template, suffix):
+        """Returns (steps, None) or (None, error dict) for a replan prompt."""
+        ai_response = gemini_service.generate_json_response(suffix, preamble=template, schema=STEP_LIST_SCHEMA)
         
         if isinstance(ai_response, dict) and 'error' in ai_response:
-            return ai_response, 500
+            return None, ai_response
 
         # --- VALIDATION FIX FOR AI RESPONSE STRUCTURE ---
-        validated_new_steps = []
         if isinstance(ai_response, list):
             # This is the expected, correct format
-            validated_new_steps = ai_response
-        elif isinstance(ai_response, dict) and 'steps' in ai_response and isinstance(ai_response['steps'], list):
+            return ai_response, None
+        if isinstance(ai_response, dict) and 'steps' in ai_response and isinstance(ai_response['steps'], list):
             # This handles the case where the AI incorrectly returns a full plan object
-            validated_new_steps = ai_response['steps']
-        else:
-            # The AI returned something completely unexpected
-            print(f"Unexpected AI replan format: {ai_response}")
-            return {"error": "AI returned an invalid format for the replan."}, 500
-        # --- END OF FIX ---
-
-        original_steps = plan['steps']
-        new_plan_steps = []
-        for step in original_steps:
-            if isinstance(step, dict) and step.get('id') == step_id:
-                step['is_complete'] = True
-                new_plan_steps.append(step)
-            elif isinstance(step, dict) and step.get('is_complete'):
-                new_plan_steps.append(step)
-
-        new_plan_steps.extend(validated_new_steps)
-        plan['steps'] = new_plan_steps
-        
-        return plan, 200
+            return ai_response['steps'], None
+        # The AI returned something completely unexpected
+        print(f"Unexpected AI replan format: {ai_response}")
+        return None, {"error": "AI returned an invalid format for the replan."}
 
     def get_ai_step_assistance(self, step_description, user_question):
         prompt = PromptLibrary.ask_ai_on_step(step_description, user_question)
-        return gemini_service.generate_text_response(prompt)
+        return gemini_service.generate_text_response(
+            prompt, cache_scope='ask_ai_on_step', similar_to=(step_description, user_question)
+        )
+
+    def stream_ai_step_assistance(self, step_description, user_question):
+        prompt = PromptLibrary.ask_ai_on_step(step_description, user_question)
+        return gemini_service.stream_text_response(
+            prompt, cache_scope='ask_ai_on_step', similar_to=(step_description, user_question)
+        )
 
     def get_step_decomposition(self, parent_step_title):
         prompt = PromptLibrary.decompose_step(parent_step_title)
-        return gemini_service.generate_json_response(prompt)
+        return gemini_service.generate_json_response(
+            prompt, cache_scope='decompose_step', schema=MICRO_STEPS_SCHEMA, similar_to=(parent_step_title,)
+        )
+
+    def decompose_plan_steps(self, plan_id, step_ids=None):
+        """Decomposes all (or the selected) steps of a stored plan and attaches the
+        results to each step as 'micro_steps'.
+
+        Steps are packed DECOMPOSE_BATCH_SIZE to a prompt and the batches run in
+        parallel, so a whole plan takes roughly one model round trip.
+        """
+        plan = plan_store.get(plan_id)
+        if not plan:
+            return {"error": "Plan not found"}, 404
+
+        wanted = {str(step_id) for step_id in step_ids} if step_ids else None
+        steps = [
+            (str(step['id']), step.get('title', ''))
+            for step in plan.get('steps', [])
+            if isinstance(step, dict) and step.get('id') is not None
+            and (wanted is None or str(step['id']) in wanted)
+        ]
+        if not steps:
+            return {"error": "No matching steps to decompose"}, 404
+
+        size = max(1, Config.DECOMPOSE_BATCH_SIZE)
+        batches = [steps[i:i + size] for i in range(0, len(steps), size)]
+        with ThreadPoolExecutor(max_workers=min(len(batches), Config.DECOMPOSE_MAX_PARALLEL)) as pool:
+            responses = list(pool.map(
+                lambda batch: gemini_service.generate_json_response(
+                    PromptLibrary.decompose_steps_batch(batch),
+                    schema=micro_steps_batch_schema([step_id for step_id, _ in batch]),
+                    prompt_name='decompose_steps_batch'
+                ),
+                batches
+            ))
+
+        micro_steps = {}
+        for batch, response in zip(batches, responses):
+            if not isinstance(response, dict) or 'error' in response:
+                print(f"Batch decomposition failed for plan {plan_id}: {response}")
+                continue
+            for step_id, _ in batch:
+                if isinstance(response.get(step_id), list):
+                    micro_steps[step_id] = response[step_id]
+
+        for step_id, items in micro_steps.items():
+            try:
+                plan_store.update_step(plan_id, step_id, lambda step, items=items: step.update(micro_steps=items))
+            except VersionConflict:
+                print(f"Could not attach micro-steps to step {step_id} of plan {plan_id}: kept conflicting")
+
+        failed_step_ids = [step_id for step_id, _ in steps if step_id not in micro_steps]
+        if not micro_steps:
+            return {"error": "Failed to generate or parse AI micro-steps.", "failed_step_ids": failed_step_ids}, 500
+        return {"plan_id": plan_id, "micro_steps": micro_steps, "failed_step_ids": failed_step_ids}, 200
 
 # Singleton instance
-plan_service = PlanService()
\ No newline at end of file
+plan_service = PlanService()
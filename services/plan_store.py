@@ -0,0 +1,463 @@
+import base64
+import copy
+import json
+import threading
+from abc import ABC, abstractmethod
+from config import Config
+from .sqlite_support import SQLiteDatabase
+
+PLAN_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plans_user ON plans (user_id, seq);
+
+CREATE TABLE IF NOT EXISTS plan_steps (
+    plan_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    step_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (plan_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_plan_steps_step ON plan_steps (plan_id, step_id);
+
+CREATE TABLE IF NOT EXISTS plan_aggregates (
+    plan_id TEXT PRIMARY KEY,
+    version INTEGER,
+    data TEXT NOT NULL
+);
+"""
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(str(position).encode()).decode()
+
+def decode_cursor(cursor):
+    """Turns an opaque page cursor back into a position. Raises ValueError if malformed."""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def plan_summary(plan, completed=None, total=None):
+    """Lightweight projection of a plan for list views."""
+    if total is None:
+        steps = [step for step in plan.get('steps') or [] if isinstance(step, dict)]
+        total = len(steps)
+        completed = sum(1 for step in steps if step.get('is_complete'))
+    completed = completed or 0
+    return {
+        "id": plan['id'],
+        "title": plan.get('title'),
+        "tags": plan.get('tags', []),
+        "estimated_duration": plan.get('estimated_duration'),
+        "progress": {
+            "completed": completed,
+            "total": total,
+            "percent": round(100 * completed / total) if total else 0
+        }
+    }
+
+
+class VersionConflict(Exception):
+    """The plan was written by someone else since the caller read it."""
+
+
+class DuplicateStepId(ValueError):
+    """Two steps of a plan share an id, so step lookups by id would be ambiguous."""
+
+
+# save_step() default: write without checking the version.
+ANY_VERSION = object()
+
+
+class PlanRepository(ABC):
+    """Storage interface used by PlanService and the route handlers.
+
+    Plans are plain dicts. Callers that change a plan returned by get() must
+    hand it back to save() for the change to persist. Every write increments
+    plan['version'], which derived data (forecasts, aggregates) is keyed on,
+    and save() only succeeds if the stored version is still the one the
+    caller read (compare-and-swap); otherwise it raises VersionConflict.
+    Step ids must be unique within a plan; save() raises DuplicateStepId.
+    """
+
+    @abstractmethod
+    def get(self, plan_id):
+        """Returns the plan dict, or None if it does not exist."""
+
+    @abstractmethod
+    def save(self, plan):
+        """Stores the plan and bumps plan['version']. Raises VersionConflict or DuplicateStepId."""
+
+    @abstractmethod
+    def list_by_user(self, user_id):
+        """Returns all of a user's plans, oldest first."""
+
+    @abstractmethod
+    def list_page(self, user_id, limit, cursor=None, tag=None, summary=True):
+        """Returns (plans, next_cursor) for one page of a user's plans, oldest first.
+
+        next_cursor is None on the last page. Raises ValueError for a bad cursor.
+        """
+
+    def get_owner(self, plan_id):
+        """Returns the plan's user_id without loading its steps, or None if missing."""
+        plan = self.get(plan_id)
+        return plan.get('user_id') if plan else None
+
+    def get_version(self, plan_id):
+        """Returns the plan's version, bumped on every save()/save_step(), or None."""
+        plan = self.get(plan_id)
+        return plan.get('version') if plan else None
+
+    @abstractmethod
+    def get_step(self, plan_id, step_id):
+        """Returns (position, step) for a step id via the step index, or None."""
+
+    @abstractmethod
+    def save_step(self, plan_id, position, step, expected_version=ANY_VERSION):
+        """Persists a single changed step without rewriting the rest of the plan.
+
+        Returns the new plan version. Given expected_version, raises
+        VersionConflict if the plan has been written since.
+        """
+
+    def update_step(self, plan_id, step_id, change, attempts=5):
+        """Applies change(step) and saves it, re-reading and retrying on conflicts.
+
+        Returns (position, step), or None if the step does not exist.
+        """
+        for _ in range(attempts):
+            version = self.get_version(plan_id)
+            found = self.get_step(plan_id, step_id)
+            if found is None:
+                return None
+            position, step = found
+            change(step)
+            try:
+                self.save_step(plan_id, position, step, expected_version=version)
+            except VersionConflict:
+                continue
+            return position, step
+        raise VersionConflict()
+
+    def exists(self, plan_id):
+        return self.get(plan_id) is not None
+
+    @abstractmethod
+    def save_aggregate(self, plan_id, version, aggregate):
+        """Stores precomputed per-plan figures, valid for the given plan version."""
+
+    @abstractmethod
+    def list_aggregates(self, user_id, plan_ids=None, tag=None):
+        """Returns (plan_id, aggregate) for a user's plans, oldest first.
+
+        aggregate is None when it is missing or older than the plan itself.
+        """
+
+
+def step_key(step):
+    step_id = step.get('id') if isinstance(step, dict) else None
+    return str(step_id) if step_id is not None else None
+
+
+def check_step_ids(steps):
+    """Raises DuplicateStepId if two steps share an id."""
+    seen = set()
+    for step in steps or []:
+        key = step_key(step)
+        if key in seen:
+            raise DuplicateStepId(f"Duplicate step id: {key}")
+        if key is not None:
+            seen.add(key)
+
+
+class MemoryPlanStore(PlanRepository):
+    """Per-process store backed by the Config.DATABASE mock dict."""
+
+    def __init__(self, plans):
+        self._plans = plans
+        self._user_index = {}  # user_id -> plan ids in creation order
+        self._step_index = {}  # plan_id -> {step_id: position}
+        self._aggregates = {}  # plan_id -> (version, aggregate)
+        self._lock = threading.RLock()
+        for plan in plans.values():
+            self._index_plan(plan)
+            self._index_steps(plan)
+
+    # Plans are copied in and out, so a caller's changes only land through save().
+
+    def get(self, plan_id):
+        with self._lock:
+            return copy.deepcopy(self._plans.get(plan_id))
+
+    def save(self, plan):
+        check_step_ids(plan.get('steps'))
+        with self._lock:
+            previous = self._plans.get(plan['id'])
+            if (previous.get('version') if previous else None) != plan.get('version'):
+                raise VersionConflict()
+            if previous is not None and previous.get('user_id') != plan.get('user_id'):
+                self._user_index[previous.get('user_id')].remove(plan['id'])
+                previous = None
+            plan['version'] = (plan.get('version') or 0) + 1
+            self._plans[plan['id']] = copy.deepcopy(plan)
+            if previous is None:
+                self._index_plan(plan)
+            self._index_steps(plan)
+
+    def get_version(self, plan_id):
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            return plan.get('version') if plan else None
+
+    def get_step(self, plan_id, step_id):
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if plan is None:
+                return None
+            steps = plan.get('steps') or []
+            position = self._step_index.get(plan_id, {}).get(str(step_id))
+            if position is None or position >= len(steps) or step_key(steps[position]) != str(step_id):
+                # The seeded plan was changed in place; rebuild once and retry.
+                self._index_steps(plan)
+                position = self._step_index[plan_id].get(str(step_id))
+                if position is None:
+                    return None
+            return position, copy.deepcopy(steps[position])
+
+    def save_step(self, plan_id, position, step, expected_version=ANY_VERSION):
+        with self._lock:
+            plan = self._plans[plan_id]
+            if expected_version is not ANY_VERSION and plan.get('version') != expected_version:
+                raise VersionConflict()
+            plan['steps'][position] = copy.deepcopy(step)
+            plan['version'] = (plan.get('version') or 0) + 1
+            return plan['version']
+
+    def list_by_user(self, user_id):
+        with self._lock:
+            return [copy.deepcopy(self._plans[plan_id]) for plan_id in self._user_index.get(user_id, [])]
+
+    def list_page(self, user_id, limit, cursor=None, tag=None, summary=True):
+        position = decode_cursor(cursor) if cursor else 0
+        page = []
+        with self._lock:
+            plan_ids = self._user_index.get(user_id, [])
+            while position < len(plan_ids) and len(page) < limit:
+                plan = self._plans[plan_ids[position]]
+                position += 1
+                if tag is None or tag in (plan.get('tags') or []):
+                    page.append(plan_summary(plan) if summary else copy.deepcopy(plan))
+            next_cursor = encode_cursor(position) if position < len(plan_ids) else None
+        return page, next_cursor
+
+    def save_aggregate(self, plan_id, version, aggregate):
+        with self._lock:
+            self._aggregates[plan_id] = (version, aggregate)
+
+    def list_aggregates(self, user_id, plan_ids=None, tag=None):
+        wanted = set(plan_ids) if plan_ids is not None else None
+        results = []
+        with self._lock:
+            for plan_id in self._user_index.get(user_id, []):
+                plan = self._plans[plan_id]
+                if wanted is not None and plan_id not in wanted:
+                    continue
+                if tag is not None and tag not in (plan.get('tags') or []):
+                    continue
+                version, aggregate = self._aggregates.get(plan_id, (None, None))
+                results.append((plan_id, aggregate if version == plan.get('version') else None))
+        return results
+
+    def _index_plan(self, plan):
+        self._user_index.setdefault(plan.get('user_id'), []).append(plan['id'])
+
+    def _index_steps(self, plan):
+        index = {}
+        for position, step in enumerate(plan.get('steps') or []):
+            key = step_key(step)
+            if key is not None:
+                index.setdefault(key, position)
+        self._step_index[plan['id']] = index
+
+
+class SQLitePlanStore(PlanRepository):
+    """SQLite-backed store shared by every worker process.
+
+    Plan metadata lives in `plans` (indexed by id and user_id); each step is a
+    row in `plan_steps`, indexed by (plan_id, step_id).
+    """
+
+    def __init__(self, path):
+        self._db = SQLiteDatabase(path, PLAN_STORE_SCHEMA)
+
+    def get(self, plan_id):
+        conn = self._db.connection()
+        row = conn.execute("SELECT data FROM plans WHERE id = ?", (plan_id,)).fetchone()
+        if row is None:
+            return None
+        plan = json.loads(row['data'])
+        plan['steps'] = self._load_steps(conn, plan_id)
+        return plan
+
+    def get_owner(self, plan_id):
+        row = self._db.connection().execute("SELECT user_id FROM plans WHERE id = ?", (plan_id,)).fetchone()
+        return row['user_id'] if row else None
+
+    def get_step(self, plan_id, step_id):
+        row = self._db.connection().execute(
+            "SELECT position, data FROM plan_steps WHERE plan_id = ? AND step_id = ? ORDER BY position LIMIT 1",
+            (plan_id, str(step_id))
+        ).fetchone()
+        return (row['position'], json.loads(row['data'])) if row else None
+
+    def save_step(self, plan_id, position, step, expected_version=ANY_VERSION):
+        query = (
+            "UPDATE plans SET data = json_set(data, '$.version', "
+            "COALESCE(json_extract(data, '$.version'), 0) + 1) WHERE id = ?"
+        )
+        params = [plan_id]
+        if expected_version is not ANY_VERSION:
+            query += " AND json_extract(data, '$.version') IS ?"
+            params.append(expected_version)
+        with self._db.transaction() as conn:
+            if conn.execute(query, params).rowcount == 0:
+                raise VersionConflict()
+            conn.execute(
+                "UPDATE plan_steps SET step_id = ?, data = ? WHERE plan_id = ? AND position = ?",
+                (step_key(step), json.dumps(step), plan_id, position)
+            )
+            return self._version(conn, plan_id)
+
+    def get_version(self, plan_id):
+        return self._version(self._db.connection(), plan_id)
+
+    @staticmethod
+    def _version(conn, plan_id):
+        row = conn.execute(
+            "SELECT json_extract(data, '$.version') AS version FROM plans WHERE id = ?", (plan_id,)
+        ).fetchone()
+        return row['version'] if row else None
+
+    def exists(self, plan_id):
+        row = self._db.connection().execute("SELECT 1 FROM plans WHERE id = ?", (plan_id,)).fetchone()
+        return row is not None
+
+    def save(self, plan):
+        steps = plan.get('steps') or []
+        check_step_ids(steps)
+        metadata = {key: value for key, value in plan.items() if key != 'steps'}
+        with self._db.transaction() as conn:
+            # The version is bumped from the stored row, and only if it is still
+            # the one the caller read.
+            written = conn.execute(
+                "INSERT INTO plans (id, user_id, data) VALUES (?, ?, json_set(?, '$.version', 1)) "
+                "ON CONFLICT(id) DO UPDATE SET user_id = excluded.user_id, "
+                "data = json_set(excluded.data, '$.version', COALESCE(json_extract(plans.data, '$.version'), 0) + 1) "
+                "WHERE json_extract(plans.data, '$.version') IS ?",
+                (plan['id'], plan.get('user_id'), json.dumps(metadata), plan.get('version'))
+            ).rowcount
+            if written == 0:
+                raise VersionConflict()
+            conn.execute("DELETE FROM plan_steps WHERE plan_id = ?", (plan['id'],))
+            conn.executemany(
+                "INSERT INTO plan_steps (plan_id, position, step_id, data) VALUES (?, ?, ?, ?)",
+                [(plan['id'], position, step_key(step), json.dumps(step)) for position, step in enumerate(steps)]
+            )
+            version = self._version(conn, plan['id'])
+        plan['version'] = version
+
+    def list_by_user(self, user_id):
+        conn = self._db.connection()
+        rows = conn.execute("SELECT id, data FROM plans WHERE user_id = ? ORDER BY seq", (user_id,)).fetchall()
+        plans = []
+        for row in rows:
+            plan = json.loads(row['data'])
+            plan['steps'] = self._load_steps(conn, row['id'])
+            plans.append(plan)
+        return plans
+
+    def list_page(self, user_id, limit, cursor=None, tag=None, summary=True):
+        conn = self._db.connection()
+        query = "SELECT seq, id, data FROM plans WHERE user_id = ? AND seq > ?"
+        params = [user_id, decode_cursor(cursor) if cursor else 0]
+        if tag is not None:
+            query += " AND EXISTS (SELECT 1 FROM json_each(plans.data, '$.tags') WHERE value = ?)"
+            params.append(tag)
+        query += " ORDER BY seq LIMIT ?"
+        params.append(limit + 1)
+        rows = conn.execute(query, params).fetchall()
+
+        next_cursor = encode_cursor(rows[limit - 1]['seq']) if len(rows) > limit else None
+        rows = rows[:limit]
+        plans = []
+        counts = self._step_counts(conn, [row['id'] for row in rows]) if summary else {}
+        for row in rows:
+            plan = json.loads(row['data'])
+            if summary:
+                total, completed = counts.get(row['id'], (0, 0))
+                plans.append(plan_summary(plan, completed=completed, total=total))
+            else:
+                plan['steps'] = self._load_steps(conn, row['id'])
+                plans.append(plan)
+        return plans, next_cursor
+
+    def save_aggregate(self, plan_id, version, aggregate):
+        self._db.connection().execute(
+            "INSERT OR REPLACE INTO plan_aggregates (plan_id, version, data) VALUES (?, ?, ?)",
+            (plan_id, version, json.dumps(aggregate))
+        )
+
+    def list_aggregates(self, user_id, plan_ids=None, tag=None):
+        query = (
+            "SELECT plans.id, a.data AS aggregate FROM plans "
+            "LEFT JOIN plan_aggregates a ON a.plan_id = plans.id "
+            "AND a.version = json_extract(plans.data, '$.version') "
+            "WHERE plans.user_id = ?"
+        )
+        params = [user_id]
+        if plan_ids is not None:
+            if not plan_ids:
+                return []
+            query += f" AND plans.id IN ({','.join('?' for _ in plan_ids)})"
+            params.extend(plan_ids)
+        if tag is not None:
+            query += " AND EXISTS (SELECT 1 FROM json_each(plans.data, '$.tags') WHERE value = ?)"
+            params.append(tag)
+        rows = self._db.connection().execute(query + " ORDER BY plans.seq", params).fetchall()
+        return [(row['id'], json.loads(row['aggregate']) if row['aggregate'] else None) for row in rows]
+
+    @staticmethod
+    def _step_counts(conn, plan_ids):
+        if not plan_ids:
+            return {}
+        placeholders = ",".join("?" for _ in plan_ids)
+        rows = conn.execute(
+            "SELECT plan_id, COUNT(*) AS total, "
+            "SUM(CASE WHEN json_extract(data, '$.is_complete') THEN 1 ELSE 0 END) AS completed "
+            f"FROM plan_steps WHERE plan_id IN ({placeholders}) AND json_type(data) = 'object' "
+            "GROUP BY plan_id",
+            plan_ids
+        ).fetchall()
+        return {row['plan_id']: (row['total'], row['completed']) for row in rows}
+
+    @staticmethod
+    def _load_steps(conn, plan_id):
+        rows = conn.execute(
+            "SELECT data FROM plan_steps WHERE plan_id = ? ORDER BY position", (plan_id,)
+        ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+
+def create_plan_store():
+    if Config.PLAN_STORE_BACKEND == 'sqlite':
+        return SQLitePlanStore(Config.PLAN_STORE_PATH)
+    return MemoryPlanStore(Config.DATABASE['plans'])
+
+# Singleton instance
+plan_store = create_plan_store()
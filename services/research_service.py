@@ -5,7 +5,11 @@ class ResearchService:
     def perform_research(self, query: str):
         prompt = PromptLibrary.ai_researcher(query)
         # Call the gemini_service with the flag to enable the search tool
-        return gemini_service.generate_text_response(prompt, use_research_tool=True)
+        return gemini_service.generate_text_response(prompt, use_research_tool=True, prompt_name='ai_researcher')
+
+    def stream_research(self, query: str):
+        prompt = PromptLibrary.ai_researcher(query)
+        return gemini_service.stream_text_response(prompt, use_research_tool=True, prompt_name='ai_researcher')
 
 # Singleton instance
 research_service = ResearchService()
\ No newline at end of file
@@ -0,0 +1,191 @@
+import json
+
+# Response schemas in the OpenAPI subset accepted by Gemini's `response_schema`.
+
+POWER_TOOL_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "name": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "link": {"type": "STRING"},
+        "cost": {"type": "STRING"}
+    },
+    "required": ["name"]
+}
+
+STEP_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "id": {"type": "STRING"},
+        "title": {"type": "STRING"},
+        "subtasks": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "time_estimate": {
+            "type": "OBJECT",
+            "properties": {
+                "min": {"type": "NUMBER"},
+                "max": {"type": "NUMBER"},
+                "unit": {"type": "STRING", "enum": ["hours", "days", "weeks"]}
+            },
+            "required": ["min", "max", "unit"]
+        },
+        "effort": {"type": "STRING", "enum": ["low", "medium", "high"]},
+        "is_milestone": {"type": "BOOLEAN"},
+        "category": {"type": "STRING"},
+        "is_complete": {"type": "BOOLEAN"},
+        "parallel_with_previous": {"type": "BOOLEAN"},
+        "power_tools": {"type": "ARRAY", "items": POWER_TOOL_SCHEMA},
+        "potential_pitfall": {"type": "STRING"}
+    },
+    "required": ["id", "title"]
+}
+
+PLAN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "estimated_duration": {"type": "STRING"},
+        "budget_level": {"type": "STRING"},
+        "tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "steps": {"type": "ARRAY", "items": STEP_SCHEMA}
+    },
+    "required": ["steps"]
+}
+
+STEP_LIST_SCHEMA = {"type": "ARRAY", "items": STEP_SCHEMA}
+
+MICRO_STEPS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "explanation": {"type": "STRING"},
+            "example": {"type": "STRING"}
+        },
+        "required": ["title", "explanation", "example"]
+    }
+}
+
+
+def micro_steps_batch_schema(step_ids):
+    """Schema for a batched decomposition: an object mapping each step id to its
+    micro-steps. Built per batch, since response schemas cannot describe
+    arbitrary keys."""
+    return {
+        "type": "OBJECT",
+        "properties": {str(step_id): MICRO_STEPS_SCHEMA for step_id in step_ids},
+        "required": [str(step_id) for step_id in step_ids]
+    }
+
+
+NEXT_MOVE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"suggestion": {"type": "STRING"}},
+    "required": ["suggestion"]
+}
+
+_TYPE_CHECKS = {
+    "OBJECT": lambda value: isinstance(value, dict),
+    "ARRAY": lambda value: isinstance(value, list),
+    "STRING": lambda value: isinstance(value, str),
+    "NUMBER": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "INTEGER": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "BOOLEAN": lambda value: isinstance(value, bool),
+}
+
+
+def validate(data, schema, path="$"):
+    """Returns a list of human-readable violations of `schema` (empty when valid)."""
+    schema_type = schema.get("type", "").upper()
+    if data is None and schema.get("nullable"):
+        return []
+    check = _TYPE_CHECKS.get(schema_type)
+    if check is not None and not check(data):
+        return [f"{path}: expected {schema_type.lower()}, got {type(data).__name__}"]
+    if "enum" in schema and data not in schema["enum"]:
+        return [f"{path}: {data!r} is not one of {schema['enum']}"]
+
+    errors = []
+    if schema_type == "OBJECT":
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing required key '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate(data[key], sub_schema, f"{path}.{key}"))
+    elif schema_type == "ARRAY" and "items" in schema:
+        for index, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def coerce(data, schema):
+    """Fixes common shape slips where an array was expected but an object came back:
+    a full plan ({"title": ..., "steps": [...]}) or other wrapper ({"result": [...]})
+    is unwrapped, and a bare object that is itself one valid item is wrapped."""
+    schema_type = schema.get("type", "").upper()
+    if schema_type != "ARRAY" or not isinstance(data, dict):
+        return data
+    if isinstance(data.get("steps"), list):
+        return data["steps"]
+    if _looks_like_item(data, schema.get("items", {})):
+        return [data]
+    lists = [value for value in data.values() if isinstance(value, list)]
+    if len(lists) == 1:
+        return lists[0]
+    return data
+
+
+def _looks_like_item(data, item_schema):
+    """True if `data` is a valid item whose list values are all item properties,
+    so a wrapper that happens to carry the item's required keys is not mistaken for one."""
+    if item_schema.get("type", "").upper() != "OBJECT" or validate(data, item_schema):
+        return False
+    properties = item_schema.get("properties", {})
+    return all(key in properties for key, value in data.items() if isinstance(value, list))
+
+
+def repair_json(text):
+    """Best-effort parse of almost-JSON model output.
+
+    Skips code fences and prose around the first JSON object or array, and
+    drops trailing commas outside strings. Truncated output is not completed:
+    it raises json.JSONDecodeError like any other unparseable text, so the
+    caller treats it as a failed generation.
+    """
+    starts = [index for index in (text.find('{'), text.find('[')) if index != -1]
+    if not starts:
+        return json.loads(text)
+    start = min(starts)
+
+    kept = []
+    depth = 0
+    in_string = escape = False
+    pending_comma = None  # index in `kept` of a comma that may turn out to be trailing
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            kept.append(char)
+            continue
+        if char in '}]' and pending_comma is not None:
+            del kept[pending_comma]
+        if not char.isspace():
+            pending_comma = None
+        if char == '"':
+            in_string = True
+        elif char == ',':
+            pending_comma = len(kept)
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+        kept.append(char)
+        if depth == 0:
+            return json.loads("".join(kept))
+    raise json.JSONDecodeError("Truncated JSON", text, len(text))
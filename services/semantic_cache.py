@@ -0,0 +1,222 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+# Words that carry no meaning for matching ("deep clean my apartment" ~ "apartment deep clean").
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from get have how i in into is it me my of on or our "
+    "should so some that the their this to up we what when where which who why will with you your".split()
+)
+
+# Question words and modals change what is being asked ("Can I skip this step?" vs
+# "Should I skip this step?"); scopes that answer questions keep them.
+QUESTION_WORDS = frozenset("can do does how should what when where which who why will".split())
+
+# Words kept (and required to match exactly) per scope, on top of numbers.
+SCOPE_KEEP_WORDS = {
+    "ask_ai_on_step": QUESTION_WORDS,
+}
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize(text, keep_words=frozenset()):
+    """Lowercased content words with punctuation, stopwords and plural 's' removed."""
+    tokens = re.findall(r"[a-z0-9]+", str(text).lower())
+    return [
+        token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') and not token.isdigit()
+        else token
+        for token in tokens if token not in STOPWORDS or token in keep_words
+    ]
+
+
+def features(text, keep_words=frozenset(), ngram=3):
+    """Returns (shingles, exact tokens) for text.
+
+    Shingles are word tokens plus character n-grams of each word, so word order
+    does not matter and typos or inflections still overlap. Tokens with digits
+    and `keep_words` get no n-grams and must match exactly ("500" vs "5000").
+    """
+    shingle_set, exact = set(), set()
+    for token in normalize(text, keep_words):
+        shingle_set.add("w:" + token)
+        if token in keep_words or any(char.isdigit() for char in token):
+            exact.add(token)
+            continue
+        padded = f"#{token}#"
+        shingle_set.update("c:" + padded[i:i + ngram] for i in range(max(1, len(padded) - ngram + 1)))
+    return frozenset(shingle_set), frozenset(exact)
+
+
+def jaccard(first, second):
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class _Entry:
+    def __init__(self, field_features, bands, value, expires_at):
+        self.field_features = field_features
+        self.bands = bands
+        self.value = value
+        self.expires_at = expires_at
+
+
+class SemanticIndex:
+    """Near-duplicate lookup for one endpoint.
+
+    Inputs are reduced to shingle sets; a MinHash signature split into LSH bands
+    finds candidates in roughly constant time, and a candidate is a hit only if
+    every input field's Jaccard similarity reaches the threshold and its exact
+    tokens (numbers, `keep_words`) are the same. Entries expire after `ttl`
+    and the least recently used are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold, max_entries=2048, ttl=86400, num_perm=64, bands=16, keep_words=frozenset(),
+                 seed=1, clock=time.time):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.keep_words = frozenset(keep_words)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._clock = clock
+        self._entries = OrderedDict()  # entry id -> _Entry
+        self._buckets = {}  # (band, band signature) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def get(self, *fields):
+        """Returns (value, similarity) of the closest stored match, or (None, 0.0)."""
+        field_features = [features(field, self.keep_words) for field in fields]
+        bands = self._bands(field_features)
+        now = self._clock()
+        with self._lock:
+            candidates = set()
+            for band in bands:
+                candidates.update(self._buckets.get(band, ()))
+            best_id, best_similarity = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.expires_at <= now or len(entry.field_features) != len(field_features):
+                    continue
+                pairs = list(zip(entry.field_features, field_features))
+                if any(stored[1] != query[1] for stored, query in pairs):
+                    continue
+                similarity = min(jaccard(stored[0], query[0]) for stored, query in pairs)
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                return None, 0.0
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id].value, best_similarity
+
+    def set(self, value, *fields):
+        field_features = [features(field, self.keep_words) for field in fields]
+        if not any(shingle_set for shingle_set, _ in field_features):
+            return
+        entry = _Entry(field_features, self._bands(field_features), value, self._clock() + self.ttl)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for band in entry.bands:
+                self._buckets.setdefault(band, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _bands(self, field_features):
+        hashes = [
+            _hash(f"{index}|{shingle}")
+            for index, (shingle_set, _) in enumerate(field_features) for shingle in shingle_set
+        ]
+        if not hashes:
+            return []
+        signature = [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+        return [
+            (band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+
+class SemanticCache:
+    """Per-endpoint SemanticIndexes, each with its own similarity threshold.
+
+    Values are stored JSON-encoded, so every hit hands the caller a fresh copy.
+    """
+
+    def __init__(self, thresholds, max_entries=2048, ttl=86400, num_perm=64, bands=16):
+        self._indexes = {
+            scope: SemanticIndex(threshold, max_entries=max_entries, ttl=ttl, num_perm=num_perm, bands=bands,
+                                 keep_words=SCOPE_KEEP_WORDS.get(scope, frozenset()))
+            for scope, threshold in thresholds.items()
+        }
+
+    def is_enabled(self, scope):
+        return scope in self._indexes
+
+    def get(self, scope, *fields):
+        index = self._indexes.get(scope)
+        if index is None:
+            return None
+        value, _ = index.get(*fields)
+        return json.loads(value) if value is not None else None
+
+    def set(self, scope, value, *fields):
+        index = self._indexes.get(scope)
+        if index is not None:
+            index.set(json.dumps(value), *fields)
+
+    def clear(self):
+        for index in self._indexes.values():
+            index.clear()
+
+
+def parse_thresholds(text):
+    """'discover_idea=0.8,decompose_step=0.85' -> {'discover_idea': 0.8, ...}"""
+    thresholds = {}
+    for part in text.split(','):
+        scope, _, threshold = part.partition('=')
+        if scope.strip() and threshold.strip():
+            thresholds[scope.strip()] = float(threshold)
+    return thresholds
+
+
+# Singleton instance
+semantic_cache = SemanticCache(
+    parse_thresholds(Config.SEMANTIC_CACHE_THRESHOLDS) if Config.SEMANTIC_CACHE_ENABLED else {},
+    max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl=Config.SEMANTIC_CACHE_TTL,
+    num_perm=Config.SEMANTIC_CACHE_NUM_PERM,
+    bands=Config.SEMANTIC_CACHE_BANDS
+)
@@ -0,0 +1,62 @@
+import copy
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive a deep copy of its result. When there
+    were followers the leader gets a copy as well, so the original is never
+    handed out and nobody shares mutable plan data with another request.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # No followers can join once the key is gone.
+                shared = call.followers > 0
+            call.done.set()
+        return copy.deepcopy(call.result) if shared else call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+# Singleton instance
+single_flight = SingleFlight()
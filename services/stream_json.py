@@ -0,0 +1,87 @@
+import json
+from .schemas import repair_json
+
+
+class StepStreamParser:
+    """Incrementally scans streamed plan JSON and emits each element of the
+    first "steps" array as soon as its closing brace arrives.
+
+    Only structural characters are tracked (strings, escapes, nesting), so code
+    fences or stray prose around the JSON are ignored. The full text is kept so
+    the complete document can be parsed once the stream ends.
+    """
+
+    def __init__(self, key='steps'):
+        self.key = key
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        self._steps_depth = None
+        self._steps_closed = False
+        self._element_start = None
+        self._text = ""
+
+    def feed(self, chunk):
+        """Consumes the next chunk of model output and returns any completed steps."""
+        completed = []
+        base = len(self._text)
+        self._text += chunk
+        for offset, char in enumerate(chunk):
+            index = base + offset
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = self._text[self._string_start + 1:index]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char == ':':
+                self._pending_key = self._last_string
+            elif char == ',':
+                self._pending_key = None
+            elif char in '{[':
+                if (char == '{' and self._steps_depth is not None and not self._steps_closed
+                        and len(self._stack) == self._steps_depth):
+                    self._element_start = index
+                self._stack.append(char)
+                if (char == '[' and self._steps_depth is None and self._pending_key == self.key
+                        and len(self._stack) > 1 and self._stack[-2] == '{'):
+                    self._steps_depth = len(self._stack)
+                self._pending_key = None
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if self._steps_depth is not None and not self._steps_closed:
+                    if char == '}' and self._element_start is not None and len(self._stack) == self._steps_depth:
+                        step = self._parse_element(self._text[self._element_start:index + 1])
+                        if step is not None:
+                            completed.append(step)
+                        self._element_start = None
+                    elif char == ']' and len(self._stack) == self._steps_depth - 1:
+                        self._steps_closed = True
+        return completed
+
+    def result(self):
+        """Parses the complete document, repairing it if needed. Raises
+        json.JSONDecodeError if it cannot be repaired (e.g. it was truncated)."""
+        try:
+            return json.loads(self._text)
+        except json.JSONDecodeError:
+            return repair_json(self._text)
+
+    @staticmethod
+    def _parse_element(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            print(f"Skipping unparseable streamed step: {e}")
+            return None
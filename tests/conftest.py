@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Config is read at import time, so the offline settings go in before any
+# application module is imported: the fake model, per-process stores and no
+# upstream context caching.
+_scratch = tempfile.mkdtemp(prefix="schematiq-tests-")
+os.environ.setdefault('SECRET_KEY', 'schematiq-test-secret-key-of-32-bytes')
+os.environ.setdefault('MODEL_BACKEND', 'fake')
+os.environ.setdefault('FAKE_MODEL_LATENCY_MS', '0')
+os.environ.setdefault('FAKE_MODEL_TOKEN_DELAY_MS', '0')
+os.environ.setdefault('PLAN_STORE_BACKEND', 'memory')
+os.environ.setdefault('RESPONSE_CACHE_BACKEND', 'memory')
+os.environ.setdefault('CONTEXT_CACHE_ENABLED', 'false')
+os.environ.setdefault('EXPORT_CACHE_DIR', os.path.join(_scratch, 'exports'))
+os.environ.setdefault('METRICS_DIR', os.path.join(_scratch, 'metrics'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import jwt
+import pytest
+from config import Config
+from services.auth_service import AuthService
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('services.auth_service.time.time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    calls = []
+    decode = jwt.decode
+
+    def counting_decode(token, *args, **kwargs):
+        calls.append(token)
+        return decode(token, *args, **kwargs)
+    monkeypatch.setattr('services.auth_service.jwt.decode', counting_decode)
+    return calls
+
+
+def test_invalid_token_is_cached_as_a_miss_until_its_ttl_expires(clock, decodes):
+    auth = AuthService(cache_ttl=300, negative_ttl=60)
+    assert auth.validate_token("not-a-jwt") is None
+    clock[0] += 59
+    assert auth.validate_token("not-a-jwt") is None
+    assert decodes == ["not-a-jwt"]
+    clock[0] += 2
+    assert auth.validate_token("not-a-jwt") is None
+    assert decodes == ["not-a-jwt", "not-a-jwt"]
+
+
+def test_valid_token_is_cached_separately_from_rejected_ones(clock, decodes):
+    auth = AuthService(cache_ttl=300, negative_ttl=60)
+    token = auth.get_mock_token("user-1")
+    auth.validate_token("not-a-jwt")
+    assert auth.validate_token(token) == {"user_id": "user-1", "tier": "paid"}
+    assert auth.validate_token(token) == {"user_id": "user-1", "tier": "paid"}
+    assert auth.validate_token("not-a-jwt") is None
+    assert decodes == ["not-a-jwt", token]
+    clock[0] += 301
+    auth.validate_token(token)
+    assert decodes == ["not-a-jwt", token, token]
+
+
+def test_valid_token_with_an_empty_payload_is_not_treated_as_rejected(clock, decodes):
+    auth = AuthService()
+    token = jwt.encode({}, Config.SECRET_KEY, algorithm="HS256")
+    assert auth.validate_token(token) == {}
+    assert auth.validate_token(token) == {}
+    assert decodes == [token]
+
+
+def test_cached_payloads_are_copies(clock):
+    auth = AuthService()
+    token = auth.get_mock_token("user-1")
+    auth.validate_token(token)['user_id'] = "someone-else"
+    assert auth.validate_token(token)['user_id'] == "user-1"
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from services import export_service as exports
+from services.export_service import ExportService, chunked
+
+
+def _plan(**fields):
+    plan = {
+        "id": "p1", "user_id": "u1", "version": 1, "title": "Launch <my> app",
+        "steps": [{"id": "s1", "title": "Research & plan", "subtasks": ["Read"], "potential_pitfall": "Scope"}]
+    }
+    plan.update(fields)
+    return plan
+
+
+def _export(service, plan, fmt):
+    chunks, mimetype = service.export(plan, fmt)
+    return b"".join(chunks), mimetype
+
+
+@pytest.fixture
+def service(tmp_path):
+    return ExportService(str(tmp_path), chunk_size=64)
+
+
+def test_html_export_escapes_plan_content(service):
+    body, mimetype = _export(service, _plan(), "html")
+    assert mimetype.startswith("text/html")
+    assert b"<title>Launch &lt;my&gt; app</title>" in body
+    assert b"Research &amp; plan" in body
+
+
+def test_pdf_export_is_a_complete_document(service):
+    body, mimetype = _export(service, _plan(), "pdf")
+    assert mimetype == "application/pdf"
+    assert body.startswith(b"%PDF-") and body.rstrip().endswith(b"%%EOF")
+
+
+def test_repeat_export_streams_the_cached_artifact(service, monkeypatch):
+    first, _ = _export(service, _plan(), "pdf")
+    monkeypatch.setitem(exports.EXPORT_FORMATS, "pdf", (lambda plan: pytest.fail("rendered again"), "application/pdf"))
+    assert _export(service, _plan(), "pdf")[0] == first
+
+
+def test_changed_plan_renders_afresh_and_replaces_the_old_artifact(service, tmp_path):
+    _export(service, _plan(), "html")
+    body, _ = _export(service, _plan(title="Renamed"), "html")
+    assert b"Renamed" in body
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_artifacts_are_kept_apart_per_owner(service, tmp_path):
+    _export(service, _plan(), "html")
+    _export(service, _plan(user_id="u2"), "html")
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_interrupted_download_leaves_no_artifact(service, tmp_path):
+    chunks, _ = service.export(_plan(steps=[{"id": f"s{i}", "title": "x" * 50} for i in range(20)]), "html")
+    next(chunks)
+    chunks.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_chunked_groups_small_pieces():
+    assert list(chunked(["ab", b"cd", "ef"], 4)) == [b"abcd", b"ef"]
+
+
+def test_filename_is_a_safe_slug():
+    assert ExportService.filename({"title": "Launch <my> App!"}, "pdf") == "launch-my-app.pdf"
+    assert ExportService.filename({}, "html") == "plan.html"
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+from services.forecast_service import ForecastService, hours_per_day, step_hours
+
+
+def _step(step_id, hours=None, unit="hours", **fields):
+    step = {"id": step_id, "title": step_id, **fields}
+    if hours is not None:
+        step["time_estimate"] = {"min": hours, "max": hours, "unit": unit}
+    return step
+
+
+@pytest.mark.parametrize("value, expected", [
+    (2, 2.0), ("1.5", 1.5), (24, 24.0), (0, None), (-1, None), (25, None), ("lots", None), (True, None), (None, None)
+])
+def test_hours_per_day_accepts_only_usable_limits(value, expected):
+    assert hours_per_day(value) == expected
+
+
+def test_step_hours_spreads_hour_estimates_over_the_daily_limit():
+    assert step_hours(_step("a", 4)) == 4
+    assert step_hours(_step("a", 4), time_per_day=2) == 48
+    assert step_hours(_step("a", 2, unit="days"), time_per_day=2) == 48
+    assert step_hours(_step("a", 4), time_per_day="invalid") == 4
+    assert step_hours(_step("a", 4, is_complete=True)) == 0
+
+
+def test_schedule_runs_parallel_steps_alongside_the_previous_one():
+    service = ForecastService(gap_hours=0)
+    offsets = service.schedule([
+        _step("a", 4), _step("b", 8, parallel_with_previous=True), _step("c", 2), _step("d", 1, is_complete=True)
+    ])
+    assert offsets == [(0, 4), (0, 8), (8, 10), (10, 10)]
+
+
+def test_schedule_separates_groups_with_the_gap():
+    service = ForecastService(gap_hours=24)
+    assert service.schedule([_step("a", 4), _step("b", 4)]) == [(0, 4), (28, 32)]
+
+
+def test_forecast_is_cached_per_plan_version():
+    service = ForecastService(gap_hours=0)
+    now = datetime(2026, 1, 1)
+    plan = {"id": "p", "version": 1, "steps": [_step("a", 4)]}
+    first = service.forecast(plan, now)
+    plan['steps'][0]['time_estimate']['max'] = 100  # Changed without a version bump: still cached.
+    assert service.forecast(plan, now) == first
+    plan['version'] = 2
+    assert service.forecast(plan, now)[0]['end_date'] != first[0]['end_date']
+
+
+def test_invalidate_drops_every_version_of_a_plan():
+    service = ForecastService(gap_hours=0)
+    plan = {"id": "p", "version": 1, "steps": [_step("a", 4)]}
+    service.forecast(plan)
+    plan['steps'].append(_step("b", 4))
+    service.invalidate("p")
+    assert len(service.forecast(plan)) == 2
+
+
+def test_aggregate_uses_the_plans_daily_limit():
+    service = ForecastService(gap_hours=0)
+    plan = {"id": "p", "version": 1, "constraints": {"time_per_day": 2},
+            "steps": [_step("a", 4, is_complete=True), _step("b", 4, is_milestone=True)]}
+    aggregate = service.aggregate(plan)
+    assert aggregate['remaining_effort_hours'] == 48
+    assert aggregate['percent_complete'] == 50
+    assert aggregate['next_milestone'] == {"step_id": "b", "title": "b", "offset_hours": 48}
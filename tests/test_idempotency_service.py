@@ -0,0 +1,96 @@
+import threading
+import time
+import pytest
+from services.cache_service import ResponseCache
+from services.idempotency_service import IdempotencyConflict, IdempotencyService
+
+
+def memory_service(**kwargs):
+    return IdempotencyService(ResponseCache(max_entries=100, ttl=60, scopes=['idempotency']), **kwargs)
+
+
+def shared_services(path, count):
+    """Services sharing one SQLite record store, as separate gunicorn workers would."""
+    return [
+        IdempotencyService(ResponseCache(max_entries=0, ttl=60, shared_path=path, scopes=['idempotency']),
+                           poll_interval=0.01)
+        for _ in range(count)
+    ]
+
+
+class Work:
+    def __init__(self, status_code=201, delay=0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        return {"run": calls}, self.status_code, {"Location": "/x"}
+
+
+def run_concurrently(targets):
+    results = []
+    threads = [threading.Thread(target=lambda target=target: results.append(target())) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_retry_replays_the_stored_response():
+    service, work = memory_service(), Work()
+    assert service.run("u", "r", "k", "fp", work) == ({"run": 1}, 201, {"Location": "/x"}, False)
+    assert service.run("u", "r", "k", "fp", work) == ({"run": 1}, 201, {"Location": "/x"}, True)
+    assert work.calls == 1
+
+
+def test_keys_are_scoped_by_user_and_route():
+    service, work = memory_service(), Work()
+    service.run("u1", "r", "k", "fp", work)
+    service.run("u2", "r", "k", "fp", work)
+    service.run("u1", "other", "k", "fp", work)
+    assert work.calls == 3
+
+
+def test_reusing_a_key_with_a_different_body_conflicts():
+    service = memory_service()
+    service.run("u", "r", "k", "fp1", Work())
+    with pytest.raises(IdempotencyConflict):
+        service.run("u", "r", "k", "fp2", Work())
+
+
+def test_server_errors_are_not_stored():
+    service = memory_service()
+    assert service.run("u", "r", "k", "fp", Work(status_code=500))[1] == 500
+    assert service.run("u", "r", "k", "fp", Work(status_code=201))[1:] == (201, {"Location": "/x"}, False)
+
+
+def test_concurrent_requests_in_one_process_run_once():
+    service, work = memory_service(), Work(delay=0.1)
+    results = run_concurrently([lambda: service.run("u", "r", "k", "fp", work)] * 5)
+    assert work.calls == 1
+    assert sorted(result[3] for result in results) == [False, True, True, True, True]
+
+
+def test_concurrent_requests_across_workers_run_once(tmp_path):
+    workers, work = shared_services(str(tmp_path / "idempotency.sqlite3"), 3), Work(delay=0.2)
+    results = run_concurrently([lambda worker=worker: worker.run("u", "r", "k", "fp", work)
+                                for worker in workers for _ in range(2)])
+    assert work.calls == 1
+    assert {str(result[0]) for result in results} == {str({"run": 1})}
+    assert [result[3] for result in results].count(False) == 1
+
+
+def test_abandoned_pending_record_is_taken_over():
+    service, work = memory_service(pending_timeout=0.05), Work()
+    record_key = service.fingerprint("u", "r", "k")
+    service.records.set(record_key, {"state": "pending", "fingerprint": "fp", "started_at": time.time()},
+                        'idempotency')
+    assert service.run("u", "r", "k", "fp", work)[3] is False
+    assert work.calls == 1
@@ -0,0 +1,81 @@
+import ipaddress
+import socket
+
+import pytest
+from services.job_service import JobService, MemoryJobStore
+
+RESOLVES_TO = {
+    "example.com": ["93.184.216.34"],
+    "internal.example.com": ["10.1.2.3"],
+    "mixed.example.com": ["93.184.216.34", "192.168.0.10"],
+    "mapped.example.com": ["::ffff:127.0.0.1"],
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_dns(monkeypatch):
+    def getaddrinfo(host, port, *args, **kwargs):
+        try:
+            addresses = RESOLVES_TO.get(host) or [str(ipaddress.ip_address(host))]
+        except ValueError:
+            raise socket.gaierror(f"unknown host {host}")
+        return [(socket.AF_INET6 if ':' in a else socket.AF_INET, socket.SOCK_STREAM, 6, '', (a, port))
+                for a in addresses]
+    monkeypatch.setattr('services.job_service.socket.getaddrinfo', getaddrinfo)
+
+
+@pytest.fixture
+def service():
+    return JobService(MemoryJobStore())
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://10.0.0.5:8080/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://internal.example.com/hook",
+    "https://mixed.example.com/hook",
+    "http://mapped.example.com/hook",
+])
+def test_private_callback_hosts_are_rejected(service, url):
+    assert service.callback_url_error(url) == "'callback_url' must point to a public host"
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "example.com/hook", "http:///hook", None])
+def test_non_http_callback_urls_are_rejected(service, url):
+    assert service.callback_url_error(url) == "'callback_url' must be an http(s) URL"
+
+
+def test_unresolvable_callback_host_is_rejected(service):
+    assert service.callback_url_error("https://nowhere.invalid/hook") == "'callback_url' host could not be resolved"
+
+
+def test_public_callback_url_is_accepted(service):
+    assert service.callback_url_error("https://example.com/hook") is None
+
+
+def test_allow_list_overrides_resolution():
+    service = JobService(MemoryJobStore(), allowed_callback_hosts=["internal.example.com"])
+    assert service.callback_url_error("http://internal.example.com/hook") is None
+    assert service.callback_url_error("https://example.com/hook") == "'callback_url' host is not allowed"
+
+
+def test_callback_is_checked_again_when_sent(service, monkeypatch):
+    monkeypatch.setattr('services.job_service.urllib.request.build_opener',
+                        lambda *handlers: pytest.fail("callback was sent"))
+    RESOLVES_TO["rebinding.example.com"] = ["127.0.0.1"]
+    try:
+        service._send_callback({"id": "job"}, "http://rebinding.example.com/hook")
+    finally:
+        del RESOLVES_TO["rebinding.example.com"]
+
+
+def test_job_stuck_past_its_deadline_is_reported_as_failed():
+    store = MemoryJobStore()
+    service = JobService(store, deadline=60)
+    store.save({"id": "job", "user_id": "u", "kind": "replan", "status": "running",
+                "created_at": "2000-01-01T00:00:00+00:00", "updated_at": "2000-01-01T00:00:00+00:00"})
+    job = service.get_job("job")
+    assert job['status'] == "failed" and job['status_code'] == 504
+    assert store.get("job")['status'] == "failed"
@@ -0,0 +1,66 @@
+import json
+import random
+import time
+
+import jwt
+import pytest
+from benchmarks.load_test import VirtualUser, summarize
+from config import Config
+
+
+class AppClient:
+    """The load test's Client interface over Flask's test client; records every route hit."""
+
+    def __init__(self, app, user_id):
+        self.client = app.test_client()
+        token = jwt.encode({"user_id": user_id, "tier": "paid"}, Config.SECRET_KEY, algorithm="HS256")
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.calls = []
+
+    def request(self, method, path, body=None, timeout=None):
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, json=body, headers=self.headers)
+        adapter = self.client.application.url_map.bind('localhost')
+        rule, _ = adapter.match(path.split('?')[0], method=method, return_rule=True)
+        self.calls.append((method, rule.rule, response.status_code))
+        try:
+            payload = json.loads(response.data)
+        except ValueError:
+            payload = None
+        return response.status_code, payload, time.perf_counter() - started
+
+
+@pytest.fixture
+def user():
+    app = pytest.importorskip("app").app
+    return VirtualUser(AppClient(app, "load-test-user"), random.Random(0))
+
+
+def test_generate_remembers_the_created_plan(user):
+    status, _ = user.generate()
+    assert status == 201
+    assert len(user.plans) == 1
+    assert all(user.plans.values())
+
+
+@pytest.mark.parametrize("operation, method, rule", [
+    ("list", "GET", "/api/plans"),
+    ("summary", "GET", "/api/plans/summary"),
+    ("forecast", "GET", "/api/plan/<plan_id>/forecast"),
+    ("toggle", "PATCH", "/api/plan/<plan_id>/step/<step_id>"),
+    ("replan", "POST", "/api/plan/<plan_id>/step/<step_id>/replan"),
+])
+def test_every_operation_hits_its_own_route(user, operation, method, rule):
+    user.generate()
+    del user.client.calls[:]
+    status, _ = getattr(user, operation)()
+    assert user.client.calls == [(method, rule, status)]
+    assert status == 200
+
+
+def test_summarize_groups_samples_by_operation():
+    report = summarize([("list", 200, 0.01), ("list", 200, 0.03), ("toggle", 500, 0.02)], wall=1.0)
+    assert report["operations"]["list"]["requests"] == 2
+    assert report["operations"]["list"]["p50_ms"] == 10.0
+    assert report["operations"]["toggle"]["errors"] == 1
+    assert report["operations"]["all"]["requests"] == 3
@@ -0,0 +1,55 @@
+import re
+import uuid
+
+import pytest
+from services.metrics_service import MetricsRegistry, metrics
+from services.plan_service import plan_service
+from services.research_service import research_service
+
+
+def test_counters_and_histograms_render_in_prometheus_format():
+    registry = MetricsRegistry(buckets=(0.1, 1))
+    registry.inc("json_parse_total", prompt="replan", outcome="ok")
+    registry.inc("json_parse_total", 2, prompt="replan", outcome="ok")
+    registry.observe("model_call_duration_seconds", 0.5, kind="json", prompt="replan")
+    text = registry.render_prometheus()
+    assert 'schematiq_json_parse_total{outcome="ok",prompt="replan"} 3' in text
+    assert 'schematiq_model_call_duration_seconds_bucket{kind="json",prompt="replan",le="0.1"} 0' in text
+    assert 'schematiq_model_call_duration_seconds_bucket{kind="json",prompt="replan",le="1"} 1' in text
+    assert 'schematiq_model_call_duration_seconds_count{kind="json",prompt="replan"} 1' in text
+
+
+def test_collect_merges_other_workers_snapshots(tmp_path):
+    worker, reader = MetricsRegistry(snapshot_dir=str(tmp_path)), MetricsRegistry(snapshot_dir=str(tmp_path))
+    worker._started_ms += 1  # A different process's snapshot file.
+    worker.inc("json_parse_total", prompt="replan", outcome="ok")
+    worker.flush()
+    reader.inc("json_parse_total", prompt="replan", outcome="ok")
+    assert 'schematiq_json_parse_total{outcome="ok",prompt="replan"} 2' in reader.render_prometheus()
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    monkeypatch.setattr(metrics, 'snapshot_dir', None)
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def _prompt_labels():
+    return set(re.findall(r'model_call_duration_seconds_count\{kind="\w+",prompt="(\w+)"\}', metrics.render_prometheus()))
+
+
+def test_model_calls_are_labelled_by_prompt(recorded):
+    unique = uuid.uuid4().hex
+    plan = plan_service.create_new_plan("metrics-user", f"learn {unique}", "standard")
+    plan_service.get_ai_step_assistance(f"Step {unique}", "How long should this take?")
+    plan_service.get_step_decomposition(f"Step {unique}")
+    plan_service.decompose_plan_steps(plan['id'])
+    research_service.perform_research(f"market for {unique}")
+    "".join(research_service.stream_research(f"competitors of {unique}"))
+
+    labels = _prompt_labels()
+    assert any(label.startswith("base_plan_") for label in labels)
+    assert {"ask_ai_on_step", "decompose_step", "decompose_steps_batch", "ai_researcher"} <= labels
+    assert "adhoc" not in labels
@@ -0,0 +1,48 @@
+import json
+from services.gemini_service import GeminiService
+from services.model_backend import FakeBackend
+from services.schemas import PLAN_SCHEMA, validate
+
+
+def json_config(schema):
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def test_same_prompt_gets_same_answer():
+    backend = FakeBackend(seed=7, latency_median=0)
+    first = backend.standard_model().generate_content("plan a trip", generation_config=json_config(PLAN_SCHEMA))
+    second = backend.standard_model().generate_content("plan a trip", generation_config=json_config(PLAN_SCHEMA))
+    other = backend.standard_model().generate_content("plan a party", generation_config=json_config(PLAN_SCHEMA))
+    assert first.text == second.text
+    assert first.text != other.text
+
+
+def test_json_responses_follow_the_schema():
+    backend = FakeBackend(seed=1, latency_median=0)
+    response = backend.standard_model().generate_content("learn guitar", generation_config=json_config(PLAN_SCHEMA))
+    data = json.loads(response.text)
+    assert validate(data, PLAN_SCHEMA) == []
+    assert response.usage_metadata.total_token_count > 0
+
+
+def test_stream_reassembles_to_the_full_response():
+    backend = FakeBackend(seed=3, latency_median=0, token_delay=0)
+    whole = backend.standard_model().generate_content("write a poem").text
+    streamed = "".join(chunk.text for chunk in backend.standard_model().generate_content("write a poem", stream=True))
+    assert streamed == whole
+
+
+def test_malformed_responses_are_retried_until_valid(monkeypatch):
+    monkeypatch.setattr('config.Config.JSON_MAX_RETRIES', 20)
+    service = GeminiService(backend=FakeBackend(seed=5, latency_median=0, malformed_rate=0.5))
+    for index in range(5):
+        plan = service.generate_json_response(f"goal {index}", schema=PLAN_SCHEMA)
+        assert 'error' not in plan
+        assert validate(plan, PLAN_SCHEMA) == []
+
+
+def test_always_malformed_output_is_reported_as_an_error(monkeypatch):
+    monkeypatch.setattr('config.Config.JSON_MAX_RETRIES', 1)
+    service = GeminiService(backend=FakeBackend(seed=5, latency_median=0, malformed_rate=1.0))
+    result = service.generate_json_response("goal", schema=PLAN_SCHEMA)
+    assert result.get('error')
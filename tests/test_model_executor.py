@@ -0,0 +1,97 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+from services.model_executor import CircuitBreaker, ModelCallExecutor, UpstreamUnavailableError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_executor(breaker=None, max_retries=3, max_concurrency=2, queue_timeout=1):
+    return ModelCallExecutor(
+        max_concurrency=max_concurrency, queue_timeout=queue_timeout, call_timeout=5, total_deadline=60,
+        max_retries=max_retries, backoff_base=0.01, backoff_max=0.01,
+        breaker=breaker or CircuitBreaker(failure_threshold=100, reset_timeout=30), sleep=lambda seconds: None
+    )
+
+
+def flaky(failures, error=google_exceptions.ServiceUnavailable("busy")):
+    calls = []
+
+    def fn(request_options):
+        calls.append(request_options)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return fn, calls
+
+
+def test_retryable_errors_are_retried():
+    fn, calls = flaky(2)
+    assert make_executor().call(fn) == "ok"
+    assert len(calls) == 3
+    assert all(options["timeout"] <= 5 for options in calls)
+
+
+def test_retries_stop_after_max_retries():
+    fn, calls = flaky(10)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        make_executor(max_retries=2).call(fn)
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried():
+    fn, calls = flaky(1, error=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        make_executor().call(fn)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_then_half_opens_after_the_timeout():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    clock.now = 31
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()  # Only one trial call at a time.
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_the_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 31
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    fn, calls = flaky(0)
+    with pytest.raises(UpstreamUnavailableError):
+        make_executor(breaker=breaker).call(fn)
+    assert calls == []
+
+
+def test_calls_beyond_the_concurrency_limit_are_rejected():
+    executor = make_executor(max_concurrency=1, queue_timeout=0.01)
+    stream = executor.stream(lambda request_options: iter(["a", "b"]))
+    assert next(stream) == "a"  # Holds the only slot until the stream finishes.
+    with pytest.raises(UpstreamUnavailableError):
+        executor.call(lambda request_options: "ok")
+    assert list(stream) == ["b"]
+    assert executor.call(lambda request_options: "ok") == "ok"
@@ -0,0 +1,190 @@
+import uuid
+
+import pytest
+from services.plan_service import plan_service
+from services.plan_store import plan_store
+
+
+@pytest.fixture
+def plan():
+    return plan_service.create_new_plan("user-1", "learn to play guitar", "standard")
+
+
+def test_generated_plan_is_stored_with_a_server_id(plan):
+    assert 'error' not in plan
+    assert plan['id'] != "unique_plan_id_1"
+    assert plan_store.get(plan['id'])['steps'] == plan['steps']
+    assert plan['version'] == 1
+
+
+def test_toggle_bumps_the_version(plan):
+    step_id = plan['steps'][0]['id']
+    toggled, status = plan_service.toggle_step_status(plan['id'], step_id)
+    assert status == 200
+    assert toggled['steps'][0]['is_complete'] is True
+    assert toggled['version'] == 2
+
+
+def test_replan_of_the_last_step_does_not_call_the_model(plan, monkeypatch):
+    monkeypatch.setattr(
+        'services.plan_service.gemini_service.generate_json_response',
+        lambda *args, **kwargs: pytest.fail("model was called")
+    )
+    replanned, status = plan_service.get_dynamic_replan(plan['id'], plan['steps'][-1]['id'], 'success')
+    assert status == 200
+    assert len(replanned['steps']) == len(plan['steps'])
+    assert replanned['steps'][-1]['is_complete'] is True
+
+
+def test_differential_replan_keeps_earlier_steps(plan):
+    first = plan['steps'][0]
+    replanned, status = plan_service.get_dynamic_replan(plan['id'], first['id'], 'failure', mode='differential')
+    assert status == 200
+    assert replanned['steps'][0]['id'] == first['id']
+    assert replanned['steps'][0]['is_complete'] is True
+
+
+def _stored_plan(categories, first_step_id="s0", first_complete=False):
+    plan = {
+        "id": str(uuid.uuid4()), "user_id": "user-1", "title": "Plan",
+        "steps": [{"id": f"s{i}", "title": f"Step {i}", "category": category, "is_complete": False}
+                  for i, category in enumerate(categories)]
+    }
+    plan['steps'][0].update(id=first_step_id, is_complete=first_complete)
+    plan_store.save(plan)
+    return plan
+
+
+def _model_returns(monkeypatch, count):
+    steps = [{"id": f"step_{i}", "title": f"New {i}", "is_complete": False} for i in range(count)]
+    monkeypatch.setattr(plan_service, '_request_replan_steps', lambda template, suffix: (steps, None))
+
+
+def test_differential_replan_keeps_unaffected_steps_in_place(monkeypatch):
+    # s1..s3 are the next window; s5 shares s0's category; s4 is not affected.
+    plan = _stored_plan(["A", "B", "C", "D", "E", "A"])
+    _model_returns(monkeypatch, 4)
+    replanned, status = plan_service.get_dynamic_replan(plan['id'], "s0", 'success', mode='differential')
+    assert status == 200
+    assert [step['title'] for step in replanned['steps']] == ["Step 0", "New 0", "New 1", "New 2", "Step 4", "New 3"]
+
+
+def test_differential_replan_places_extra_steps_after_the_last_replaced_one(monkeypatch):
+    plan = _stored_plan(["A", "B", "C", "D", "E", "A"])
+    _model_returns(monkeypatch, 6)
+    replanned, _ = plan_service.get_dynamic_replan(plan['id'], "s0", 'success', mode='differential')
+    assert [step['title'] for step in replanned['steps']] == [
+        "Step 0", "New 0", "New 1", "New 2", "Step 4", "New 3", "New 4", "New 5"
+    ]
+
+
+def test_differential_replan_drops_affected_steps_the_model_left_out(monkeypatch):
+    plan = _stored_plan(["A", "B", "C", "D", "E", "A"])
+    _model_returns(monkeypatch, 2)
+    replanned, _ = plan_service.get_dynamic_replan(plan['id'], "s0", 'success', mode='differential')
+    assert [step['title'] for step in replanned['steps']] == ["Step 0", "New 0", "New 1", "Step 4"]
+
+
+@pytest.mark.parametrize("mode", ['differential', 'full'])
+def test_replanned_steps_get_fresh_ids(monkeypatch, mode):
+    # The model names its steps step_0, step_1, ... like the kept first step.
+    plan = _stored_plan(["A", "B", "C", "D", "E", "A"], first_step_id="step_0", first_complete=True)
+    _model_returns(monkeypatch, 4)
+    replanned, status = plan_service.get_dynamic_replan(plan['id'], "s1", 'success', mode=mode)
+    assert status == 200
+    ids = [step['id'] for step in replanned['steps']]
+    assert len(ids) == len(set(ids))
+    assert ids[0] == "step_0"
+    # Toggling the kept step still finds it, not a regenerated namesake.
+    toggled, _ = plan_service.toggle_step_status(plan['id'], "step_0")
+    assert toggled['steps'][0]['is_complete'] is False
+
+
+def test_full_replan_over_budget_shows_the_model_every_incomplete_step(monkeypatch):
+    plan = _stored_plan(["Work"] * 30)
+    for step in plan['steps']:
+        step['subtasks'] = ["a fairly long subtask description"] * 6
+    plan_store.save(plan)
+    prompts = []
+
+    def request(template, suffix):
+        prompts.append(suffix)
+        return [{"id": "step_1", "title": "New"}], None
+
+    monkeypatch.setattr('services.plan_service.Config.PROMPT_PLAN_TOKEN_BUDGET', 200)
+    monkeypatch.setattr(plan_service, '_request_replan_steps', request)
+    _, status = plan_service.get_dynamic_replan(plan['id'], "s0", 'success', mode='full')
+    assert status == 200
+    assert all(f'"id":"s{i}"' in prompts[0] for i in range(1, 30))
+
+
+def test_generated_plan_with_repeated_step_ids_is_stored_with_unique_ones(monkeypatch):
+    monkeypatch.setattr('services.plan_service.gemini_service.generate_json_response', lambda *args, **kwargs: {
+        "title": "Plan", "steps": [{"id": "step_1", "title": "One"}, {"id": "step_1", "title": "Two"}]
+    })
+    plan = plan_service.create_new_plan("user-1", "anything", "standard")
+    ids = [step['id'] for step in plan['steps']]
+    assert ids[0] == "step_1" and len(set(ids)) == 2
+    assert plan_store.get_step(plan['id'], ids[1])[1]['title'] == "Two"
+
+
+def test_decompose_plan_steps_works_offline(plan):
+    result, status = plan_service.decompose_plan_steps(plan['id'])
+    assert status == 200
+    assert result['failed_step_ids'] == []
+    assert set(result['micro_steps']) == {step['id'] for step in plan['steps']}
+    stored = plan_store.get(plan['id'])
+    assert all(step['micro_steps'] for step in stored['steps'])
+
+
+def test_decompose_plan_steps_batches_and_reports_failed_batches(monkeypatch):
+    plan = _stored_plan(["Work"] * 5)
+    calls = []
+
+    def generate(prompt, schema=None, **kwargs):
+        step_ids = schema['required']
+        calls.append(step_ids)
+        if "s2" in step_ids:
+            return {"error": "Failed to generate or parse AI plan."}
+        return {step_id: [{"title": "t", "explanation": "e", "example": "x"}] for step_id in step_ids}
+
+    monkeypatch.setattr('services.plan_service.Config.DECOMPOSE_BATCH_SIZE', 2)
+    monkeypatch.setattr('services.plan_service.gemini_service.generate_json_response', generate)
+    result, status = plan_service.decompose_plan_steps(plan['id'])
+    assert status == 200
+    assert sorted(calls) == [["s0", "s1"], ["s2", "s3"], ["s4"]]
+    assert result['failed_step_ids'] == ["s2", "s3"]
+    assert set(result['micro_steps']) == {"s0", "s1", "s4"}
+    assert 'micro_steps' not in plan_store.get_step(plan['id'], "s2")[1]
+
+
+@pytest.mark.parametrize("time_per_day, stored", [("3", 3.0), (0, None), ("soon", None)])
+def test_generated_plan_keeps_only_a_valid_daily_limit(time_per_day, stored):
+    plan = plan_service.create_new_plan(
+        "user-1", "learn to cook", "standard", {"constraints": {"time_per_day": time_per_day, "budget": "low"}}
+    )
+    assert plan['constraints'].get('time_per_day') == stored
+    assert plan['constraints']['budget'] == "low"
+
+
+def test_plan_summaries_report_progress_for_the_users_plans():
+    user_id = f"summary-user-{uuid.uuid4()}"
+    first = plan_service.create_new_plan(user_id, "learn to sail", "standard")
+    second = plan_service.create_new_plan(user_id, "learn to knit", "standard")
+    plan_service.toggle_step_status(first['id'], first['steps'][0]['id'])
+
+    result, status = plan_service.get_plan_summaries(user_id)
+    assert status == 200
+    summaries = {summary['id']: summary for summary in result['plans']}
+    assert set(summaries) == {first['id'], second['id']}
+    assert summaries[first['id']]['completed_steps'] == 1
+    assert summaries[first['id']]['total_steps'] == len(first['steps'])
+    assert summaries[second['id']]['completed_steps'] == 0
+    assert summaries[second['id']]['projected_end_date'] is not None
+
+
+def test_plan_summaries_rebuild_missing_aggregates():
+    plan = _stored_plan(["Work"] * 3)  # Saved straight to the store: no aggregate yet.
+    result, _ = plan_service.get_plan_summaries("user-1", plan_ids=[plan['id']])
+    assert [summary['total_steps'] for summary in result['plans']] == [3]
+    assert plan_store.list_aggregates("user-1", plan_ids=[plan['id']])[0][1] is not None
@@ -0,0 +1,185 @@
+import threading
+
+import pytest
+from services.plan_store import (
+    DuplicateStepId, MemoryPlanStore, PlanRepository, SQLitePlanStore, VersionConflict
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryPlanStore({})
+    return SQLitePlanStore(str(tmp_path / "plans.sqlite3"))
+
+
+def _plan(plan_id="p", user_id="u", step_ids=("a", "b")):
+    return {"id": plan_id, "user_id": user_id, "steps": [{"id": step_id} for step_id in step_ids]}
+
+
+def test_plan_repository_cannot_be_instantiated_without_the_interface():
+    with pytest.raises(TypeError):
+        PlanRepository()
+
+    class Partial(PlanRepository):
+        def get(self, plan_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.mark.parametrize("backend", [MemoryPlanStore, SQLitePlanStore])
+def test_backends_implement_every_abstract_method(backend):
+    assert not getattr(backend, '__abstractmethods__', None)
+    assert issubclass(backend, PlanRepository)
+
+
+def test_save_assigns_versions_and_round_trips(store):
+    plan = _plan()
+    store.save(plan)
+    assert plan['version'] == 1
+    assert store.get("p") == {"id": "p", "user_id": "u", "version": 1, "steps": [{"id": "a"}, {"id": "b"}]}
+    assert store.get_owner("p") == "u" and store.get_version("p") == 1
+    assert store.exists("p") and not store.exists("missing")
+    assert store.get("missing") is None and store.get_owner("missing") is None
+
+
+def test_returned_plans_are_detached_from_the_store(store):
+    store.save(_plan())
+    plan = store.get("p")
+    plan['steps'][0]['is_complete'] = True
+    assert store.get("p")['steps'][0] == {"id": "a"}
+
+
+def test_get_step_and_save_step(store):
+    store.save(_plan())
+    assert store.get_step("p", "b") == (1, {"id": "b"})
+    assert store.get_step("p", "missing") is None
+    assert store.save_step("p", 1, {"id": "b", "is_complete": True}) == 2
+    assert store.get("p")['steps'][1] == {"id": "b", "is_complete": True}
+    with pytest.raises(VersionConflict):
+        store.save_step("p", 1, {"id": "b"}, expected_version=1)
+
+
+def test_list_by_user_returns_only_the_users_plans_in_order(store):
+    for plan_id, user_id in (("p1", "u"), ("p2", "other"), ("p3", "u")):
+        store.save(_plan(plan_id=plan_id, user_id=user_id))
+    assert [plan['id'] for plan in store.list_by_user("u")] == ["p1", "p3"]
+
+
+def test_stale_save_raises_version_conflict(store):
+    store.save(_plan())
+    first, second = store.get("p"), store.get("p")
+    first['title'] = "first"
+    store.save(first)
+    second['title'] = "second"
+    with pytest.raises(VersionConflict):
+        store.save(second)
+    assert store.get("p")['title'] == "first"
+    with pytest.raises(VersionConflict):
+        store.save(_plan())  # A new plan reusing an existing id.
+
+
+def test_update_step_retries_after_a_conflict(store):
+    store.save(_plan(step_ids=("a",)))
+    interfered = []
+
+    def change(step):
+        if not interfered:
+            interfered.append(True)
+            store.save_step("p", 0, {"id": "a", "count": 10})  # A concurrent writer.
+        step['count'] = step.get('count', 0) + 1
+
+    assert store.update_step("p", "a", change) == (0, {"id": "a", "count": 11})
+    assert store.get_step("p", "a")[1]['count'] == 11
+    assert store.update_step("p", "missing", change) is None
+
+
+def test_concurrent_update_step_loses_no_writes(store):
+    store.save(_plan(step_ids=("a",)))
+
+    def increment():
+        for _ in range(20):
+            store.update_step("p", "a", lambda step: step.update(count=step.get('count', 0) + 1), attempts=100)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get_step("p", "a")[1]['count'] == 80
+
+
+def test_save_rejects_duplicate_step_ids(store):
+    with pytest.raises(DuplicateStepId):
+        store.save(_plan(step_ids=("a", "b", "a")))
+    assert store.get("p") is None
+
+
+def test_duplicate_step_ids_do_not_replace_a_stored_plan(store):
+    store.save(_plan())
+    plan = store.get("p")
+    plan['steps'].append({"id": "b"})
+    with pytest.raises(DuplicateStepId):
+        store.save(plan)
+    assert [step['id'] for step in store.get("p")['steps']] == ["a", "b"]
+    assert store.get_step("p", "b") == (1, {"id": "b"})
+
+
+def test_list_page_is_safe_during_concurrent_saves(store):
+    for index in range(20):
+        store.save(_plan(plan_id=f"seed{index}"))
+    errors, done = [], threading.Event()
+
+    def writer():
+        index = 0
+        while not done.is_set():
+            store.save(_plan(plan_id=f"new{index}"))
+            store.save_step("seed0", 0, {"id": "a", "is_complete": index % 2 == 0})
+            index += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(200):
+            try:
+                store.list_page("u", 50, summary=False)
+            except RuntimeError as e:
+                errors.append(e)
+    finally:
+        done.set()
+        thread.join()
+    assert errors == []
+
+
+def test_list_page_follows_cursors_and_filters_tags(store):
+    for index in range(5):
+        store.save(dict(_plan(plan_id=f"p{index}"), tags=["even"] if index % 2 == 0 else []))
+    first, cursor = store.list_page("u", 2)
+    second, _ = store.list_page("u", 2, cursor=cursor)
+    assert [plan['id'] for plan in first + second] == ["p0", "p1", "p2", "p3"]
+    assert first[0]['progress'] == {"completed": 0, "total": 2, "percent": 0}
+    tagged, _ = store.list_page("u", 10, tag="even")
+    assert [plan['id'] for plan in tagged] == ["p0", "p2", "p4"]
+    with pytest.raises(ValueError):
+        store.list_page("u", 2, cursor="not-a-cursor")
+
+
+def test_aggregates_are_returned_only_for_the_current_version(store):
+    store.save(_plan(plan_id="p1"))
+    store.save(_plan(plan_id="p2"))
+    store.save(_plan(plan_id="other", user_id="someone-else"))
+    store.save_aggregate("p1", 1, {"plan_id": "p1"})
+    store.save_aggregate("p2", 1, {"plan_id": "p2"})
+    store.save_step("p2", 0, {"id": "a", "is_complete": True})  # Now version 2.
+    assert store.list_aggregates("u") == [("p1", {"plan_id": "p1"}), ("p2", None)]
+
+
+def test_aggregates_can_be_filtered_by_id_and_tag(store):
+    store.save(dict(_plan(plan_id="p1"), tags=["work"]))
+    store.save(_plan(plan_id="p2"))
+    store.save(_plan(plan_id="other", user_id="someone-else"))
+    assert [plan_id for plan_id, _ in store.list_aggregates("u", plan_ids=["p2", "other"])] == ["p2"]
+    assert [plan_id for plan_id, _ in store.list_aggregates("u", tag="work")] == ["p1"]
+    assert store.list_aggregates("u", plan_ids=[]) == []
@@ -0,0 +1,39 @@
+import json
+from prompts import PlanPromptSerializer
+
+
+def _plan(step_count, completed=0):
+    return {
+        "title": "Plan", "mode": "standard",
+        "steps": [
+            {"id": f"s{i}", "title": f"Step {i}", "category": "Work", "is_complete": i < completed,
+             "subtasks": [f"Subtask {i}.{j} " + "detail " * 5 for j in range(6)],
+             "potential_pitfall": "A long warning about what can go wrong. " * 5,
+             "power_tools": [{"name": "Tool", "description": "Does things. " * 10, "link": "https://x", "cost": "free"}]}
+            for i in range(step_count)
+        ]
+    }
+
+
+def test_plan_within_budget_is_serialized_whole():
+    projected = json.loads(PlanPromptSerializer.serialize(_plan(2), 'replan', token_budget=10000))
+    assert len(projected['steps']) == 2
+    assert 'omitted_steps' not in projected
+    assert projected['steps'][0]['potential_pitfall']
+
+
+def test_over_budget_plans_drop_trailing_steps_for_other_purposes():
+    projected = json.loads(PlanPromptSerializer.serialize(_plan(20), 'agent_simulation', token_budget=300))
+    assert projected['omitted_steps'] > 0
+    assert [step['title'] for step in projected['steps']] == [f"Step {i}" for i in range(len(projected['steps']))]
+
+
+def test_over_budget_replan_keeps_every_incomplete_step():
+    text = PlanPromptSerializer.serialize(_plan(20, completed=5), 'replan', token_budget=50)
+    projected = json.loads(text)
+    incomplete = [step['id'] for step in projected['steps'] if not step.get('is_complete')]
+    assert incomplete == [f"s{i}" for i in range(5, 20)]
+    # Completed steps and step descriptions went first; the rest goes over budget.
+    assert all(not step.get('is_complete') for step in projected['steps'])
+    assert all(set(step) <= set(PlanPromptSerializer.OUTLINE_STEP_FIELDS) for step in projected['steps'])
+    assert projected['omitted_steps'] == 5
@@ -0,0 +1,27 @@
+import json
+import pytest
+from services.schemas import repair_json
+
+
+def test_code_fences_and_prose_are_stripped():
+    assert repair_json('Here you go:\n```json\n{"a": 1}\n```\nEnjoy!') == {"a": 1}
+
+
+def test_trailing_commas_are_dropped():
+    assert repair_json('{"a": [1, 2, ], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_strings_are_left_untouched():
+    text = '{"a": "x, ]", "b": "```json", "c": "q\\"}, "}'
+    assert repair_json(text) == {"a": "x, ]", "b": "```json", "c": 'q"}, '}
+
+
+@pytest.mark.parametrize("text", ['{"steps": [{"id": "s1"}, {"id": "s2"', '{"title": "half a str', '[1, 2,'])
+def test_truncated_output_is_not_completed(text):
+    with pytest.raises(json.JSONDecodeError):
+        repair_json(text)
+
+
+def test_text_without_json_fails():
+    with pytest.raises(json.JSONDecodeError):
+        repair_json("I'm sorry, I can't produce that right now.")
@@ -0,0 +1,39 @@
+import json
+from services.gemini_service import GeminiService
+from services.schemas import MICRO_STEPS_SCHEMA, STEP_LIST_SCHEMA, coerce, micro_steps_batch_schema, validate
+
+STEP = {"id": "s1", "title": "Research", "subtasks": ["Read", "Compare"], "power_tools": []}
+
+
+def test_full_plan_is_unwrapped_to_its_steps():
+    plan = {"id": "p1", "title": "Plan", "tags": ["x"], "steps": [STEP]}
+    assert coerce(plan, STEP_LIST_SCHEMA) == [STEP]
+
+
+def test_single_item_with_list_fields_is_wrapped():
+    assert coerce(STEP, STEP_LIST_SCHEMA) == [STEP]
+
+
+def test_single_list_wrapper_is_unwrapped():
+    items = [{"title": "t", "explanation": "e", "example": "x"}]
+    assert coerce({"result": items}, MICRO_STEPS_SCHEMA) == items
+
+
+def test_object_that_is_not_an_item_is_left_alone():
+    data = {"id": "p1", "title": "Plan", "tags": ["x"], "notes": ["y"]}
+    assert coerce(data, STEP_LIST_SCHEMA) is data
+    assert validate(data, STEP_LIST_SCHEMA) != []
+
+
+def test_parse_json_returns_the_steps_of_a_full_plan():
+    text = json.dumps({"id": "p1", "title": "Plan", "tags": ["x"], "steps": [STEP, dict(STEP, id="s2")]})
+    data, problem = GeminiService._parse_json(text, STEP_LIST_SCHEMA)
+    assert problem is None
+    assert [step['id'] for step in data] == ["s1", "s2"]
+
+
+def test_batch_schema_requires_every_step_id():
+    schema = micro_steps_batch_schema(["s1", "s2"])
+    item = {"title": "t", "explanation": "e", "example": "x"}
+    assert validate({"s1": [item], "s2": [item]}, schema) == []
+    assert validate({"s1": [item]}, schema) == ["$: missing required key 's2'"]
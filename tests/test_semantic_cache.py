@@ -0,0 +1,76 @@
+import pytest
+from services.semantic_cache import SemanticCache, SemanticIndex, features, jaccard
+
+THRESHOLDS = {"discover_idea": 0.8, "decompose_step": 0.85, "ask_ai_on_step": 0.9}
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(THRESHOLDS, max_entries=16)
+
+
+def test_reworded_request_hits(cache):
+    cache.set("discover_idea", {"idea": "A"}, "Apartment deep clean")
+    assert cache.get("discover_idea", "deep clean my apartment!") == {"idea": "A"}
+
+
+def test_unrelated_request_misses(cache):
+    cache.set("discover_idea", "A", "Apartment deep clean")
+    assert cache.get("discover_idea", "learn to play the guitar") is None
+
+
+def test_hits_are_copies(cache):
+    cache.set("decompose_step", [{"title": "x"}], "Write the outline")
+    cache.get("decompose_step", "write the outline").append("mutated")
+    assert cache.get("decompose_step", "write the outline") == [{"title": "x"}]
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Why should I hire a designer?", "How do I hire a designer?"),
+    ("Can I skip this step?", "Should I skip this step?"),
+])
+def test_different_questions_do_not_match(cache, stored, asked):
+    cache.set("ask_ai_on_step", "answer", "Hire help", stored)
+    assert cache.get("ask_ai_on_step", "Hire help", asked) is None
+    assert cache.get("ask_ai_on_step", "Hire help", stored.lower()) == "answer"
+
+
+def test_numbers_must_match_exactly(cache):
+    cache.set("decompose_step", "small", "Plan a budget of 500")
+    assert cache.get("decompose_step", "plan a budget of 5000") is None
+    assert cache.get("decompose_step", "Plan budget of 500") == "small"
+
+
+def test_every_field_must_be_similar(cache):
+    cache.set("ask_ai_on_step", "answer", "Set up the newsletter", "How long should it be?")
+    assert cache.get("ask_ai_on_step", "Launch the podcast", "How long should it be?") is None
+
+
+def test_scopes_are_separate_and_opt_in(cache):
+    cache.set("discover_idea", "A", "Apartment deep clean")
+    assert cache.get("decompose_step", "Apartment deep clean") is None
+    assert not cache.is_enabled("generate_plan")
+    assert cache.get("generate_plan", "anything") is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    index = SemanticIndex(0.8, max_entries=2)
+    index.set("A", "apartment deep clean")
+    index.set("B", "learn guitar chords")
+    assert index.get("apartment deep clean")[0] == "A"  # A is now the most recent.
+    index.set("C", "bake sourdough bread")
+    assert len(index) == 2
+    assert index.get("learn guitar chords") == (None, 0.0)
+    assert index.get("apartment deep clean")[0] == "A"
+
+
+def test_entries_expire():
+    now = [0.0]
+    index = SemanticIndex(0.8, ttl=10, clock=lambda: now[0])
+    index.set("A", "apartment deep clean")
+    now[0] = 11
+    assert index.get("apartment deep clean") == (None, 0.0)
+
+
+def test_word_order_does_not_matter():
+    assert jaccard(features("deep clean apartment")[0], features("apartment clean deep")[0]) == 1.0
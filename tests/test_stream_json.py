@@ -0,0 +1,56 @@
+import json
+import pytest
+from services.stream_json import StepStreamParser
+
+PLAN = {
+    "title": "Tricky {plan} [with] \"quotes\"",
+    "steps": [
+        {"id": "s1", "title": "First }", "subtasks": ["a", "b"]},
+        {"id": "s2", "title": "Second", "time_estimate": {"min": 1, "max": 2, "unit": "days"}},
+        {"id": "s3", "title": "Third \\ with backslash"},
+    ],
+    "tags": ["x"],
+}
+
+
+def feed_all(parser, text, size):
+    steps = []
+    for start in range(0, len(text), size):
+        steps.extend(parser.feed(text[start:start + size]))
+    return steps
+
+
+@pytest.mark.parametrize("size", [1, 3, 64, 10000])
+def test_steps_are_emitted_whatever_the_chunking(size):
+    parser = StepStreamParser()
+    assert feed_all(parser, json.dumps(PLAN), size) == PLAN["steps"]
+    assert parser.result() == PLAN
+
+
+def test_each_step_arrives_as_soon_as_it_closes():
+    text = json.dumps(PLAN)
+    first_end = text.index('"subtasks": ["a", "b"]}') + len('"subtasks": ["a", "b"]}')
+    parser = StepStreamParser()
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [PLAN["steps"][0]]
+
+
+def test_fences_and_prose_are_ignored():
+    parser = StepStreamParser()
+    steps = feed_all(parser, "Sure!\n```json\n" + json.dumps(PLAN) + "\n```", 5)
+    assert steps == PLAN["steps"]
+    assert parser.result() == PLAN
+
+
+def test_steps_wrapped_in_an_object_are_found():
+    plan = {"steps": {"title": "x", "steps": [{"id": "s1"}, {"id": "s2"}]}}
+    parser = StepStreamParser()
+    assert feed_all(parser, json.dumps(plan), 4) == [{"id": "s1"}, {"id": "s2"}]
+
+
+def test_truncated_stream_fails():
+    text = json.dumps(PLAN)
+    parser = StepStreamParser()
+    feed_all(parser, text[:len(text) // 2], 7)
+    with pytest.raises(json.JSONDecodeError):
+        parser.result()